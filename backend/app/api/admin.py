@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional
+from models.schemas import ProfileRequest
+from services.profiler import generation_profiler, ProfilerBusy
+from config.settings import settings
+import hmac
+
+# Operator endpoints on processes that hold the model, outside /api so the frontend's
+# proxy never exposes them; every call needs X-Admin-Token to match ADMIN_TOKEN
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    if not settings.admin_token:
+        # No token configured: behave as if the admin API did not exist
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode("utf-8"), settings.admin_token.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.post("/profile", status_code=202)
+async def start_profile(request: ProfileRequest):
+    # Profile the next N generations; files appear in GET /admin/profile as they are written
+    try:
+        return generation_profiler.start(request.mode.value, request.generations, request.interval_ms)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get("/profile")
+async def profile_status():
+    # Capture window, written files and per-stage generation timings
+    return generation_profiler.status()
+
+@router.delete("/profile")
+async def stop_profile():
+    return generation_profiler.stop()
+
+@router.get("/profile/files/{name}")
+async def profile_file(name: str):
+    # Open .speedscope.json files in speedscope.app, .trace.json in chrome://tracing or Perfetto
+    path = generation_profiler.file_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=name)
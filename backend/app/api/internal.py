@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from typing import Dict, Optional
+from models.schemas import InferenceRequest, InferenceResponse
+from services.inference_client import inference_client
+from services.profile_service import profile_service
+from services.scheduler import generation_scheduler, get_priority, QueueFullError
+from services.generation_control import GenerationControl, GenerationCancelled
+from config.settings import settings
+from utils.request_utils import is_inference_peer
+import asyncio
+import uuid
+
+# Served by inference workers (SERVICE_ROLE=inference) to frontends, outside /api
+# so the per-client rate limits do not apply to the frontend's own requests; every call
+# needs X-Inference-Token to match INFERENCE_TOKEN, or comes from this host without one
+
+def require_frontend(request: Request, x_inference_token: Optional[str] = Header(default=None)):
+    if not is_inference_peer(x_inference_token, request.client.host if request.client else None):
+        raise HTTPException(status_code=403, detail="Invalid inference token")
+
+router = APIRouter(dependencies=[Depends(require_frontend)])
+
+# Generations in flight by the request_id their frontend sent, for /cancel
+_running: Dict[str, GenerationControl] = {}
+
+@router.post("/generate", response_model=InferenceResponse)
+async def generate(request: InferenceRequest, http_request: Request):
+    control = GenerationControl(
+        request.timeout_seconds if request.timeout_seconds is not None else settings.get_generation_timeout()
+    )
+    if request.request_id:
+        _running[request.request_id] = control
+    # Frontends already queue fairly per client, so every forwarded request is its own client here
+    task = asyncio.ensure_future(generation_scheduler.submit(
+        uuid.uuid4().hex,
+        get_priority(profile_service.select(request.params[0]).batch_class),
+        inference_client.generate_stories_sync,
+        request.params,
+        control
+    ))
+    
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.disconnect_poll_interval)
+            if done:
+                return InferenceResponse(stories=task.result(), timed_out=control.timed_out, rejected=control.rejected)
+            
+            if await http_request.is_disconnected():
+                # The frontend gave up on this request
+                control.cancel()
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    
+    except GenerationCancelled:
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    finally:
+        if request.request_id:
+            _running.pop(request.request_id, None)
+
+@router.post("/cancel/{request_id}", status_code=204)
+async def cancel(request_id: str):
+    # Sent by a frontend whose client went away; finished or unknown requests are ignored
+    control = _running.get(request_id)
+    if control is not None:
+        control.cancel()
+
+@router.get("/status")
+async def status():
+    return inference_client.status()
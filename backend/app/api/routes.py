@@ -1,53 +1,247 @@
-from fastapi import APIRouter, HTTPException
-from models.schemas import ChatRequest, ChatResponse, HealthResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from models.schemas import ChatRequest, ChatResponse, HealthResponse, JobResponse, JobResultResponse, JobStatus
+from models.schemas import StoryRequest, StoryResponse
 from services.chat_service import chat_service
-from services.llm_service import llm_service
-from core.prompts import StoryPrompts
+from services.inference_client import inference_client
+from services.job_service import job_service
+from services.story_service import story_service
+from services.topic_index import topic_index
+from services.batch_service import batch_service, parse_batch_line
+from services.profile_service import profile_service
+from services.scheduler import generation_scheduler, QueueFullError
+from services.rate_limiter import rate_limiter, RateLimitExceeded
+from services.generation_control import GenerationControl, GenerationCancelled
+from models.schemas import StoryParams
+from core.prompts import prompt_catalog, prompt_engine
+from config.settings import settings
+from utils.metrics import metrics
+from utils.request_utils import get_client_id
+from utils.responses import FastJSONResponse, cached_response
+from utils.log import session_id_var
+import asyncio
+import uuid
 
 router = APIRouter()
 
+async def _generate_until_disconnect(http_request: Request, params: StoryParams, control: GenerationControl) -> str:
+    # Generate a story, cancelling it if the client goes away
+    task = asyncio.ensure_future(story_service.generate(params, get_client_id(http_request), control))
+    
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=settings.disconnect_poll_interval)
+        if done:
+            return task.result()
+        
+        if await http_request.is_disconnected():
+            # Stops the decode loop if running, or drops the request from the queue
+            control.cancel()
+            task.cancel()
+            raise GenerationCancelled()
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     # Chat endpoint for story generation conversation
     try:
         # Process user message
-        response, session_id, story_params, is_complete = chat_service.process_message(
-            request.session_id,
-            request.message
-        )
+        turn = chat_service.process_message(request.session_id, request.message, request.client_message_id)
+        session_id, story_params, is_complete = turn.session_id, turn.story_params, turn.is_complete
+        response = turn.response
+        session_id_var.set(session_id)
         
-        # If ready to generate story
-        story = None
-        if is_complete and story_params:
-            # Build prompt
-            prompt = StoryPrompts.build_story_prompt(story_params.dict())
+        # A retried turn gets the story or job its first attempt produced
+        story = turn.story
+        job_id = turn.job_id
+        needs_generation = is_complete and story_params and story is None and job_id is None
+        if needs_generation:
+            # Only one request generates a session's story, a retry waits for the first to give up
+            owner = str(uuid.uuid4()) if request.async_mode else "request"
+            if not chat_service.claim_generation(session_id, owner):
+                raise HTTPException(status_code=409, detail="This story is already being generated")
             
-            # Generate story
-            story = await llm_service.generate_story(prompt)
+            # Generation is the expensive part, so it has its own budget; charged for every
+            # generation that starts, a retried turn included, and never for a replayed result
+            try:
+                rate_limiter.check_generation(
+                    [get_client_id(http_request), f"session:{session_id}"],
+                    profile_service.select(story_params).max_new_tokens
+                )
+            except RateLimitExceeded:
+                # Let the client resend the last answer once the budget refills
+                chat_service.release_generation(session_id, owner)
+                chat_service.rollback_generation(session_id, request.client_message_id)
+                raise
+        
+        if needs_generation and request.async_mode:
+            # Hand generation to a background job and return right away
+            job_id = owner
+            try:
+                job_service.submit(session_id, story_params, get_client_id(http_request), request.timeout_seconds, job_id=job_id)
+            except Exception:
+                chat_service.release_generation(session_id, job_id)
+                raise
+        
+        elif needs_generation:
+            # Generate story within the request deadline
+            control = GenerationControl(settings.get_generation_timeout(request.timeout_seconds))
+            try:
+                story = await _generate_until_disconnect(http_request, story_params, control)
+            except BaseException:
+                chat_service.release_generation(session_id)
+                raise
             
             # Save story to session
             chat_service.set_story(session_id, story)
         
-        return ChatResponse(
+        chat_response = ChatResponse(
             session_id=session_id,
             message=response,
+            message_id=prompt_catalog.message_id(response),
             story_params=story_params,
             story=story,
-            is_complete=is_complete
+            is_complete=is_complete,
+            job_id=job_id
         )
+        # Serialized here rather than through response_model, the model is already valid
+        return FastJSONResponse(chat_response.dict(
+            exclude_none=request.lean,
+            exclude={"message"} if request.lean and chat_response.message_id else None
+        ))
+    
+    except (RateLimitExceeded, HTTPException):
+        raise
+    
+    except GenerationCancelled:
+        # Client closed the connection, nobody is waiting for this response
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    
+    except QueueFullError as e:
+        raise HTTPException(status_code=429 if e.per_client else 503, detail=str(e))
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/story", response_model=StoryResponse)
+async def story(request: StoryRequest, http_request: Request):
+    # One-shot generation for clients that already know every parameter
+    params = StoryParams(**request.dict(exclude={"timeout_seconds"}))
+    is_valid, error = story_service.prepare(params)
+    if not is_valid:
+        raise HTTPException(status_code=422, detail=error)
+    
+    try:
+        rate_limiter.check_generation([get_client_id(http_request)], profile_service.select(params).max_new_tokens)
+        control = GenerationControl(settings.get_generation_timeout(request.timeout_seconds))
+        story = await _generate_until_disconnect(http_request, params, control)
+        return StoryResponse(story_params=params, story=story)
+    
+    except RateLimitExceeded:
+        raise
+    
+    except GenerationCancelled:
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    
+    except QueueFullError as e:
+        raise HTTPException(status_code=429 if e.per_client else 503, detail=str(e))
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/batch")
+async def batch_stories(http_request: Request):
+    # Bulk generation: JSONL of StoryParams in, JSONL results streamed out as batches complete
+    body = (await http_request.body()).decode("utf-8")
+    items = [
+        parse_batch_line(line, str(line_number))
+        for line_number, line in enumerate(body.splitlines())
+        if line.strip()
+    ]
+    
+    if not items:
+        raise HTTPException(status_code=400, detail="No story parameters given")
+    
+    if len(items) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"A batch can contain up to {settings.batch_max_items} stories")
+    
+    return StreamingResponse(
+        batch_service.stream(items, get_client_id(http_request)),
+        media_type="application/x-ndjson"
+    )
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    job = job_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return JobResponse(
+        job_id=job_id,
+        session_id=job["session_id"],
+        status=job["status"],
+        queue_position=job_service.get_queue_position(job),
+        eta_seconds=job_service.estimate_wait(job)
+    )
+
+@router.get("/jobs/{job_id}/result", response_model=JobResultResponse)
+async def get_job_result(job_id: str):
+    job = job_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if job["status"] in (JobStatus.QUEUED.value, JobStatus.RUNNING.value):
+        raise HTTPException(status_code=409, detail="Job is not finished yet")
+    
+    # The job worker attaches the story to its conversation when it finishes; again here
+    # for a session held by another API process. Both are no-ops the second time
+    if job["status"] == JobStatus.DONE.value and job["session_id"]:
+        chat_service.set_story(job["session_id"], job["story"])
+    elif job["session_id"]:
+        # Failed or cancelled: the session may generate again
+        chat_service.release_generation(job["session_id"], job_id)
+    
+    return JobResultResponse(
+        job_id=job_id,
+        session_id=job["session_id"],
+        status=job["status"],
+        story=job["story"],
+        error=job["error"]
+    )
+
 @router.get("/health", response_model=HealthResponse)
 async def health():
-    return HealthResponse(
-        status="healthy",
-        model_loaded=llm_service.is_loaded(),
-        model_name=llm_service.get_model_name()
-    )
+    # A frontend asks its inference worker, off the event loop
+    model_status = await asyncio.to_thread(inference_client.status)
+    return HealthResponse(status="healthy", **model_status)
+
+@router.get("/prompts/messages")
+async def prompt_messages(request: Request):
+    # Static chat texts by message id, revalidated with the catalog's ETag
+    return cached_response(request, prompt_catalog.messages, prompt_catalog.etag, settings.prompt_cache_max_age)
+
+@router.get("/prompts/messages/{message_id}")
+async def prompt_message(message_id: str, request: Request):
+    # A message id changes whenever its text does, so one text can be cached for good
+    text = prompt_catalog.messages.get(message_id)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Unknown message id")
+    return cached_response(request, {"message_id": message_id, "message": text}, f'"{message_id}"', 31536000)
+
+@router.get("/prompts/stats")
+async def prompt_stats():
+    # Prompt tokens per age/genre/length combination, available once the model is loaded
+    return prompt_engine.stats()
+
+@router.get("/profiles")
+async def profile_stats():
+    # Generation profiles in match order, with latency and acceptance per profile
+    return profile_service.stats()
+
+@router.get("/metrics")
+async def get_metrics():
+    return {**metrics.snapshot(), **generation_scheduler.stats(), **topic_index.stats()}
 
 @router.post("/cleanup")
 async def cleanup_sessions():
     count = chat_service.cleanup_old_sessions()
-    return {"cleaned_sessions": count}
\ No newline at end of file
+    jobs = job_service.cleanup_old_jobs()
+    return {"cleaned_sessions": count, "cleaned_jobs": jobs}
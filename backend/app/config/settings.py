@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):    
@@ -8,6 +8,12 @@ class Settings(BaseSettings):
     api_port: int = 8000
     debug: bool = True
     
+    # Logging Settings
+    log_level: str = "INFO"
+    log_json: bool = True
+    log_sample_rate: float = 0.1  # Fraction of high-volume events (e.g. request logs) kept
+    log_queue_size: int = 10000
+    
     # CORS Settings
     allowed_origins: list = [
         "http://localhost:3000",
@@ -24,6 +30,47 @@ class Settings(BaseSettings):
     temperature: float = 0.7
     top_p: float = 0.9
     top_k: int = 50
+    repetition_penalty: float = 1.2
+    no_repeat_ngram_size: int = 3
+    decode_loop: str = "direct"  # "direct" (own KV-cache loop over reused buffers) or "generate" (model.generate)
+    
+    # Model Store Settings
+    model_store_path: str = "./models/store"  # Content-addressed pinned models, see scripts/pin_model.py
+    model_store_verify: bool = True  # Re-hash pinned files before loading them
+    model_offline: bool = False  # Never reach the Hugging Face Hub when loading
+    preload_tokenizer: bool = False  # Load the fast tokenizer at startup
+    preload_model: bool = False  # Load the model at startup instead of on the first request
+    
+    # Service Role Settings
+    service_role: str = "all"  # "all", "frontend" (forwards generation) or "inference" (serves it)
+    # Inference worker(s) used by a frontend: http:// for an API process with SERVICE_ROLE=inference, or
+    # comma-separated unix:<path> / tcp://<host>:<port> addresses of inference_server.py processes
+    inference_url: str = "http://127.0.0.1:8001"
+    # X-Inference-Token frontends send to inference workers; without it workers only serve loopback clients
+    inference_token: Optional[str] = None
+    inference_timeout_margin: float = 10.0  # Seconds added to the story deadline for the worker round trip
+    inference_pool_size: int = 4  # Idle connections kept per inference server
+    inference_server_address: str = "unix:/tmp/story-inference.sock"  # Where inference_server.py listens
+    
+    # Generation Profile Settings
+    generation_profiles_path: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generation_profiles.json")
+    generation_profiles_reload_interval: float = 5.0  # Seconds between checks for a changed file
+    
+    # Generation Deadline Settings
+    generation_timeout_seconds: float = 120.0
+    max_generation_timeout_seconds: float = 300.0
+    min_partial_sentences: int = 3
+    disconnect_poll_interval: float = 0.5
+    
+    # Batch Settings
+    batch_size: int = 8
+    batch_max_items: int = 1000
+    
+    # Scheduler Settings
+    scheduler_max_concurrency: int = 1
+    scheduler_max_queue: int = 64
+    scheduler_max_queue_per_client: int = 8
+    scheduler_max_wait_seconds: float = 60.0
     
     # Story Settings
     min_story_length: int = 100
@@ -31,8 +78,48 @@ class Settings(BaseSettings):
     max_characters: int = 5
     max_character_name_length: int = 30
     
+    # Topic Reuse Settings
+    topic_reuse_enabled: bool = False  # answer with an earlier story for a rephrased topic
+    topic_reuse_threshold: float = 0.81  # cosine similarity of the topics' hashed content words for a candidate
+    topic_index_dims: int = 256
+    topic_index_bucket_size: int = 1000  # stories kept per age group, genre and length
+    
+    # Rate Limit Settings
+    rate_limit_enabled: bool = True
+    rate_limit_store: str = "memory"  # "memory" or "sqlite" to share buckets across workers
+    rate_limit_db_path: str = "./data/rate_limits.db"
+    rate_limit_api_keys: str = ""  # comma-separated; callers sending one are limited per key, everyone else per IP
+    rate_limit_turns_per_minute: float = 60.0
+    rate_limit_turn_burst: int = 20
+    rate_limit_generation_tokens_per_hour: float = 20000.0
+    rate_limit_generation_token_burst: int = 4096
+    
+    # Response Settings
+    compression_min_size: int = 500  # bytes; smaller responses are sent as is, 0 disables compression
+    compression_brotli: bool = False  # needs brotli-asgi, falls back to gzip for clients without br
+    prompt_cache_max_age: int = 3600  # seconds clients may reuse GET /api/prompts/messages
+    
+    # Profiling Settings
+    admin_token: Optional[str] = None  # X-Admin-Token for /admin; the admin API is off without it
+    profile_output_dir: str = "./data/profiles"
+    profile_max_generations: int = 20  # per capture window
+    profile_window_seconds: float = 900.0  # a capture window closes after this even if generations are left
+    profile_max_seconds: float = 120.0  # sampling stops after this much of one generation
+    profile_keep_files: int = 50
+    
     # Session Settings
     session_timeout_hours: int = 24
+    session_snapshot_enabled: bool = True
+    session_snapshot_path: str = "./data/sessions.log"
+    session_snapshot_interval: float = 5.0  # seconds between incremental snapshots
+    session_snapshot_compact_ratio: float = 2.0  # compact once the log is this many times its live records
+    session_snapshot_fsync: bool = True
+    
+    # Job Settings
+    job_db_path: str = "./data/jobs.db"
+    job_workers: int = 1
+    job_poll_interval: float = 1.0
+    job_retention_hours: int = 24
     
     # Dataset Settings
     dataset_path: str = "./data/story_dataset.csv"
@@ -48,6 +135,14 @@ class Settings(BaseSettings):
             if os.path.exists(self.fine_tuned_model_path):
                 return self.fine_tuned_model_path
         return self.model_name
+    
+    def get_api_keys(self) -> List[str]:
+        return [key.strip() for key in self.rate_limit_api_keys.split(",") if key.strip()]
+    
+    def get_generation_timeout(self, override: Optional[float] = None) -> float:
+        if override:
+            return min(override, self.max_generation_timeout_seconds)
+        return self.generation_timeout_seconds
 
 # Global settings instance
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,144 @@
+from transformers import LogitsProcessor
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+import torch
+
+# Drop-in replacements for transformers' RepetitionPenaltyLogitsProcessor and
+# NoRepeatNGramLogitsProcessor. The stock processors look at the whole sequence
+# on every decode step; these keep their index between steps and only read the
+# newest token, so the bookkeeping per step no longer grows with story length.
+
+class _IncrementalProcessor(LogitsProcessor, ABC):
+    # Tracks whether a call continues the sequence seen on the previous call
+    
+    def __init__(self):
+        self._length: Optional[int] = None
+        self._batch_size = 0
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        batch_size, length = input_ids.shape
+        if self._length is not None and batch_size == self._batch_size and length == self._length + 1:
+            self._append(input_ids[:, -1].tolist(), scores)
+        else:
+            # First step, or a sequence this processor has not followed: index it all
+            self._reset(input_ids.tolist(), scores)
+        self._length = length
+        self._batch_size = batch_size
+        return self._process(scores)
+    
+    @abstractmethod
+    def _reset(self, rows: List[List[int]], scores: torch.FloatTensor):
+        pass
+    
+    @abstractmethod
+    def _append(self, tokens: List[int], scores: torch.FloatTensor):
+        pass
+    
+    @abstractmethod
+    def _process(self, scores: torch.FloatTensor) -> torch.FloatTensor:
+        pass
+
+class IncrementalRepetitionPenaltyLogitsProcessor(_IncrementalProcessor):
+    # Penalizes every token id already in the sequence, like repetition_penalty
+    
+    def __init__(self, penalty: float):
+        super().__init__()
+        self.penalty = penalty
+        self._seen: List[Set[int]] = []
+        self._counts: List[int] = []
+        # Unique ids per row; unused slots point at a spare column past the vocab
+        self._ids: Optional[torch.Tensor] = None
+        self._width = 0
+    
+    def _reset(self, rows: List[List[int]], scores: torch.FloatTensor):
+        vocab_size = scores.shape[-1]
+        # Ids past the lm head output cannot be generated, so they are never penalized
+        unique = [list(dict.fromkeys(token for token in row if token < vocab_size)) for row in rows]
+        self._seen = [set(ids) for ids in unique]
+        self._counts = [len(ids) for ids in unique]
+        self._width = max(self._counts, default=0)
+        
+        capacity = max(self._width * 2, 64)
+        self._ids = torch.full((len(rows), capacity), vocab_size, dtype=torch.long, device=scores.device)
+        for row, ids in enumerate(unique):
+            if ids:
+                self._ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long, device=scores.device)
+    
+    def _append(self, tokens: List[int], scores: torch.FloatTensor):
+        vocab_size = scores.shape[-1]
+        for row, token in enumerate(tokens):
+            if token >= vocab_size or token in self._seen[row]:
+                continue
+            
+            count = self._counts[row]
+            if count == self._ids.shape[1]:
+                self._grow(vocab_size)
+            self._ids[row, count] = token
+            self._seen[row].add(token)
+            self._counts[row] = count + 1
+            self._width = max(self._width, count + 1)
+    
+    def _grow(self, vocab_size: int):
+        grown = torch.full((self._ids.shape[0], self._ids.shape[1] * 2), vocab_size, dtype=torch.long, device=self._ids.device)
+        grown[:, :self._ids.shape[1]] = self._ids
+        self._ids = grown
+    
+    def _process(self, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if not self._width:
+            return scores
+        
+        ids = self._ids[:, :self._width]
+        padded = torch.nn.functional.pad(scores, (0, 1))
+        score = torch.gather(padded, 1, ids)
+        # Negative scores are multiplied so the penalty always lowers the probability
+        score = torch.where(score < 0, score * self.penalty, score / self.penalty)
+        return padded.scatter(1, ids, score)[:, :-1]
+
+class IncrementalNoRepeatNGramLogitsProcessor(_IncrementalProcessor):
+    # Bans any token that would complete an n-gram already in the sequence, like no_repeat_ngram_size
+    
+    def __init__(self, ngram_size: int):
+        super().__init__()
+        if ngram_size < 1:
+            raise ValueError(f"ngram_size must be a positive integer, got {ngram_size}")
+        self.ngram_size = ngram_size
+        # Per row: first n-1 tokens of each n-gram -> tokens that followed them
+        self._ngrams: List[Dict[Tuple[int, ...], Set[int]]] = []
+        # Per row: the last n-1 tokens, the prefix the next token would complete
+        self._tails: List[Deque[int]] = []
+    
+    def _reset(self, rows: List[List[int]], scores: torch.FloatTensor):
+        self._ngrams = [{} for _ in rows]
+        self._tails = [deque(maxlen=self.ngram_size - 1) for _ in rows]
+        for row, tokens in enumerate(rows):
+            for token in tokens:
+                self._add(row, token)
+    
+    def _append(self, tokens: List[int], scores: torch.FloatTensor):
+        for row, token in enumerate(tokens):
+            self._add(row, token)
+    
+    def _add(self, row: int, token: int):
+        tail = self._tails[row]
+        if len(tail) == self.ngram_size - 1:
+            self._ngrams[row].setdefault(tuple(tail), set()).add(token)
+        tail.append(token)
+    
+    def _process(self, scores: torch.FloatTensor) -> torch.FloatTensor:
+        vocab_size = scores.shape[-1]
+        rows, banned = [], []
+        for row, (ngrams, tail) in enumerate(zip(self._ngrams, self._tails)):
+            for token in ngrams.get(tuple(tail), ()):
+                if token < vocab_size:
+                    rows.append(row)
+                    banned.append(token)
+        
+        if not rows:
+            return scores
+        
+        index = (
+            torch.tensor(rows, dtype=torch.long, device=scores.device),
+            torch.tensor(banned, dtype=torch.long, device=scores.device)
+        )
+        return scores.index_put(index, torch.tensor(-float("inf"), dtype=scores.dtype, device=scores.device))
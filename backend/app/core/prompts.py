@@ -1,4 +1,15 @@
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+from itertools import product
+import hashlib
+import json
+import re
+
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+def normalize_whitespace(text: str) -> str:
+    # Strip indentation and collapse runs of blank lines
+    lines = [line.strip() for line in text.split("\n")]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines))
 
 class StoryPrompts:
     # Story generation prompt templates
@@ -51,29 +62,8 @@ class StoryPrompts:
         "long": "Write a long and detailed story (approximately 800-1000 words)."
     }
     
-    @staticmethod
-    def build_story_prompt(params: Dict) -> str:
-        # Build complete story generation prompt
-        
-        age_group = params.get("age_group", "6-10")
-        genre = params.get("genre", "adventure")
-        length = params.get("length", "medium")
-        topic = params.get("topic", "")
-        characters = params.get("characters", [])
-        
-        # Get instructions
-        age_instruction = StoryPrompts.AGE_PROMPTS.get(age_group)
-        genre_instruction = StoryPrompts.GENRE_PROMPTS.get(genre)
-        length_instruction = StoryPrompts.LENGTH_SPECS.get(length)
-        
-        # Build character section
-        character_section = ""
-        if characters:
-            char_names = ", ".join(characters)
-            character_section = f"\nCHARACTERS: {char_names} use named characters."
-        
-        # Build complete prompt
-        prompt = f"""You are a professional children's story writer.
+    # Story prompt layout, indentation is stripped when the templates are compiled
+    STORY_TEMPLATE = """You are a professional children's story writer.
 
                 {age_instruction}
 
@@ -81,7 +71,7 @@ class StoryPrompts:
 
                 LENGTH: {length_instruction}
 
-                TOPIC: {topic}{character_section}
+                TOPIC: {details}
 
                 IMPORTANT:
                 1. Start the story with a catchy title
@@ -91,8 +81,25 @@ class StoryPrompts:
                 5. End with a happy or educational ending
 
                 Now write the story:"""
+    
+    @staticmethod
+    def build_story_details(params: Dict) -> str:
+        # Per-request part of the prompt: topic and characters
+        topic = params.get("topic", "")
+        characters = params.get("characters", [])
+        
+        # Build character section
+        character_section = ""
+        if characters:
+            char_names = ", ".join(characters)
+            character_section = f"\nCHARACTERS: {char_names} use named characters."
         
-        return prompt
+        return f" {topic}{character_section}"
+    
+    @staticmethod
+    def build_story_prompt(params: Dict) -> str:
+        # Build complete story generation prompt
+        return prompt_engine.build(params)
     
     @staticmethod
     def get_collection_prompts() -> Dict[str, str]:
@@ -140,4 +147,109 @@ class StoryPrompts:
             "generating": """I've got all the information!
 
             Now I'm writing a special story for you..."""
-        }
\ No newline at end of file
+        }
+
+class PromptTemplateEngine:
+    # Compiles every age/genre/length combination once, only topic and characters are encoded per request
+    
+    DEFAULTS = ("6-10", "adventure", "medium")
+    
+    def __init__(self):
+        head, tail = StoryPrompts.STORY_TEMPLATE.split("{details}")
+        self._raw_heads: Dict[Tuple[str, str, str], str] = {}
+        self._heads: Dict[Tuple[str, str, str], str] = {}
+        self._raw_tail = tail
+        self._tail = normalize_whitespace(tail)
+        
+        for age_group, genre, length in product(
+            StoryPrompts.AGE_PROMPTS, StoryPrompts.GENRE_PROMPTS, StoryPrompts.LENGTH_SPECS
+        ):
+            raw = head.format(
+                age_instruction=StoryPrompts.AGE_PROMPTS[age_group],
+                genre_instruction=StoryPrompts.GENRE_PROMPTS[genre],
+                length_instruction=StoryPrompts.LENGTH_SPECS[length]
+            )
+            self._raw_heads[(age_group, genre, length)] = raw
+            self._heads[(age_group, genre, length)] = normalize_whitespace(raw)
+        
+        self._tokenizer = None
+        self._head_ids: Dict[Tuple[str, str, str], List[int]] = {}
+        self._tail_ids: List[int] = []
+    
+    def compile(self, tokenizer):
+        # Pre-tokenize the static parts of every combination
+        self._head_ids = {key: tokenizer.encode(text) for key, text in self._heads.items()}
+        self._tail_ids = tokenizer.encode(self._tail, add_special_tokens=False)
+        self._tokenizer = tokenizer
+    
+    def reset(self):
+        # Forget the token ids, e.g. once the tokenizer they came from is unloaded
+        self._tokenizer = None
+        self._head_ids = {}
+        self._tail_ids = []
+    
+    def is_compiled(self) -> bool:
+        return self._tokenizer is not None
+    
+    def _key(self, params: Dict) -> Tuple[str, str, str]:
+        age_group, genre, length = self.DEFAULTS
+        key = (
+            params.get("age_group") or age_group,
+            params.get("genre") or genre,
+            params.get("length") or length
+        )
+        return key if key in self._heads else self.DEFAULTS
+    
+    def build(self, params: Dict) -> str:
+        return self._heads[self._key(params)] + StoryPrompts.build_story_details(params) + self._tail
+    
+    def encode(self, params: Dict) -> List[int]:
+        # Token ids of the full prompt; the static parts are reused as-is
+        details = self._tokenizer.encode(StoryPrompts.build_story_details(params), add_special_tokens=False)
+        return self._head_ids[self._key(params)] + details + self._tail_ids
+    
+    def stats(self) -> Dict:
+        # Static prompt tokens per combination, before and after whitespace normalization
+        if not self.is_compiled():
+            return {"compiled": False, "combinations": []}
+        
+        raw_tail_tokens = len(self._tokenizer.encode(self._raw_tail, add_special_tokens=False))
+        combinations = []
+        for key, ids in self._head_ids.items():
+            raw_tokens = len(self._tokenizer.encode(self._raw_heads[key])) + raw_tail_tokens
+            prompt_tokens = len(ids) + len(self._tail_ids)
+            combinations.append({
+                "age_group": key[0],
+                "genre": key[1],
+                "length": key[2],
+                "prompt_tokens": prompt_tokens,
+                "raw_prompt_tokens": raw_tokens,
+                "saved_tokens": raw_tokens - prompt_tokens
+            })
+        
+        return {
+            "compiled": True,
+            "average_saved_tokens": sum(c["saved_tokens"] for c in combinations) / len(combinations),
+            "combinations": combinations
+        }
+
+class PromptCatalog:
+    # Static chat texts under ids derived from their content, so clients can cache them
+    # and lean chat responses can send the id instead of the text
+    
+    def __init__(self, prompts: Dict[str, str]):
+        self.texts = {key: normalize_whitespace(text).strip() for key, text in prompts.items()}
+        self.messages = {
+            f"{key}.{hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]}": text
+            for key, text in self.texts.items()
+        }
+        self._ids = {text: message_id for message_id, text in self.messages.items()}
+        digest = hashlib.sha256(json.dumps(self.messages, sort_keys=True).encode("utf-8")).hexdigest()
+        self.etag = f'"{digest[:16]}"'
+    
+    def message_id(self, text: str) -> Optional[str]:
+        return self._ids.get(text)
+
+# Global instances
+prompt_engine = PromptTemplateEngine()
+prompt_catalog = PromptCatalog(StoryPrompts.get_collection_prompts())
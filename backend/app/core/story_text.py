@@ -0,0 +1,196 @@
+from typing import List, NamedTuple, Optional
+import re
+from utils.validators import INAPPROPRIATE_WORDS
+
+SENTENCE_MARKS = frozenset(".!?")
+
+_SENTENCE_END = re.compile(r"[.!?]+")
+_MARK_CAPITAL = re.compile(r"([.!?])([A-Z])")
+_BLOCKLIST = re.compile("|".join(map(re.escape, INAPPROPRIATE_WORDS)))
+# Lowercased characters kept from the previous chunk, so a word split across chunks is still found
+_BLOCKLIST_TAIL = max(map(len, INAPPROPRIATE_WORDS)) - 1
+# Deltas are buffered until a line break arrives or this many are waiting, then
+# processed up to the last line break or sentence mark
+FLUSH_DELTAS = 64
+# Tokens an IncrementalDetokenizer decodes per step before its window slides forward
+DETOKENIZE_WINDOW = 8
+
+# Handed out when no acceptable story could be generated
+FALLBACK_STORY = """# Little Hero
+
+Once upon a time, there lived a brave boy in a small town. Every day, he sought new adventures and played fun games with his friends.
+One day, he found a little cat lost in the town park. The cat was very sad and scared. The boy decided to help the cat.
+He searched all day for the cat's owner. He knocked on every door, asking everyone. Finally, he found a family who missed the cat very much.
+The family was overjoyed and thanked the boy. The boy learned how beautiful it was to help.
+From that day on, he always tried to help others. And so, he became the little hero."""
+
+class StoryText(NamedTuple):
+    # A post-processed story and the counts needed to validate it
+    text: str
+    sentences: int
+    blocked: bool
+
+def _lower(text: str) -> str:
+    # Lowercase without changing positions; characters whose lowercase form is
+    # longer (e.g. 'İ') cannot be part of a blocklist word
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(char if len(char) == 1 else "\0" for char in map(str.lower, text))
+
+class StoryTextProcessor:
+    # Post-processes a story while it is being decoded. Deltas are buffered until a
+    # line break arrives or FLUSH_DELTAS are waiting; everything up to the last line
+    # break or sentence mark is then normalized with a few string operations, and the
+    # last sentence boundary, sentence count and blocklist hits are kept up to date, so
+    # the story is ready as soon as decoding stops:
+    # - whitespace containing a line break becomes a blank line, other whitespace is kept
+    # - a space is added between a sentence mark and a capital letter
+    # - an unfinished last sentence is dropped
+    
+    def __init__(self):
+        self._parts: List[str] = []
+        self._length = 0
+        self._last = ""
+        # Raw text not processed yet
+        self._pending: List[str] = []
+        # Whether the next raw text starts a new line
+        self._line_start = True
+        # Output length just after the last sentence mark
+        self._boundary = 0
+        # Sentences are segments between runs of marks longer than 5 characters when
+        # stripped; the segment after the last mark is kept until it is finished
+        self._sentences = 0
+        self._segment = ""
+        self._tail = ""
+        self._first_blocked_end: Optional[int] = None
+    
+    def feed(self, delta: str):
+        pending = self._pending
+        pending.append(delta)
+        if "\n" in delta or len(pending) >= FLUSH_DELTAS:
+            self._flush()
+    
+    def _flush(self):
+        # Process up to the last mark or line break, keep the rest for later
+        text = "".join(self._pending)
+        cut = max(text.rfind("\n"), text.rfind("."), text.rfind("!"), text.rfind("?")) + 1
+        self._pending = [text[cut:]] if cut < len(text) else []
+        # Nothing to process yet when a long run of deltas had neither
+        if cut:
+            self._process(text[:cut], final=False)
+    
+    def finish(self) -> StoryText:
+        if self._pending:
+            self._process("".join(self._pending), final=True)
+            self._pending = []
+        text = "".join(self._parts)
+        sentences = self._sentences
+        
+        if self._last not in SENTENCE_MARKS and self._boundary > 1:
+            # Drop the unfinished sentence after the last mark
+            text = text[:self._boundary]
+        elif len(self._segment.strip()) > 5:
+            sentences += 1
+        
+        blocked = self._first_blocked_end is not None and self._first_blocked_end <= len(text)
+        return StoryText(text, sentences, blocked)
+    
+    def _process(self, text: str, final: bool):
+        # text ends with a line break or a sentence mark, or is the end of the story
+        if not self._line_start and not final and "\n" not in text:
+            # Most calls: the rest of a sentence in the middle of a line
+            pieces = [" ", _MARK_CAPITAL.sub(r"\1 \2", text)] if self._last in SENTENCE_MARKS and "A" <= text[0] <= "Z" else [_MARK_CAPITAL.sub(r"\1 \2", text)]
+            self._append("".join(pieces))
+            return
+        
+        lines = text.split("\n")
+        pieces = []
+        for number, line in enumerate(lines):
+            ends_line = number < len(lines) - 1 or final
+            if self._line_start:
+                line = line.strip() if ends_line else line.lstrip()
+                if line:
+                    if self._length or pieces:
+                        pieces.append("\n\n")
+                    self._line_start = False
+            elif ends_line:
+                line = line.rstrip()
+            
+            if line:
+                last = pieces[-1][-1] if pieces else self._last
+                if last in SENTENCE_MARKS and "A" <= line[0] <= "Z":
+                    pieces.append(" ")
+                pieces.append(_MARK_CAPITAL.sub(r"\1 \2", line))
+            if number < len(lines) - 1:
+                self._line_start = True
+        
+        if pieces:
+            self._append("".join(pieces))
+    
+    def _append(self, chunk: str):
+        start = self._length
+        self._parts.append(chunk)
+        self._length += len(chunk)
+        self._last = chunk[-1]
+        
+        mark = max(chunk.rfind("."), chunk.rfind("!"), chunk.rfind("?"))
+        if mark >= 0:
+            self._boundary = start + mark + 1
+        segments = _SENTENCE_END.split(self._segment + chunk)
+        self._segment = segments.pop()
+        self._sentences += len([segment for segment in segments if len(segment.strip()) > 5])
+        
+        if self._first_blocked_end is None:
+            self._scan_blocked(chunk)
+    
+    def _scan_blocked(self, new_text: str):
+        window = self._tail + _lower(new_text)
+        match = _BLOCKLIST.search(window)
+        if match:
+            self._first_blocked_end = self._length - len(window) + match.end()
+        else:
+            self._tail = window[-_BLOCKLIST_TAIL:]
+
+class IncrementalDetokenizer:
+    # Turns token ids into text deltas without decoding the whole sequence again.
+    # Each step decodes one short window: the tokens since the window start, which
+    # always lies on an already emitted token so it decodes with its context. The
+    # new text is whatever the window decodes to beyond what it gave last time, and
+    # a delta ending in a partial character is held back.
+    
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self._ids: List[int] = []
+        self._window_start = 0
+        # Text of the window up to the last emitted token
+        self._emitted = ""
+    
+    def push(self, token_id: int) -> str:
+        self._ids.append(token_id)
+        text = self._decode(self._ids[self._window_start:])
+        if len(text) <= len(self._emitted) or text.endswith("\ufffd"):
+            return ""
+        
+        delta = text[len(self._emitted):]
+        self._emitted = text
+        if len(self._ids) - self._window_start > DETOKENIZE_WINDOW:
+            # Slide the window to the last token; its text has been emitted already
+            self._window_start = len(self._ids) - 1
+            self._emitted = self._decode(self._ids[self._window_start:])
+        return delta
+    
+    def flush(self) -> str:
+        # Whatever is still held back once decoding has stopped
+        text = self._decode(self._ids[self._window_start:])
+        delta = text[len(self._emitted):]
+        self._window_start = len(self._ids)
+        self._emitted = ""
+        return delta
+    
+    def _decode(self, ids: List[int]) -> str:
+        if not ids:
+            return ""
+        # Cleanup is not defined on partial text, and its default differs between
+        # tokenizers and transformers versions, so it is always switched off
+        return self.tokenizer.decode(ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
@@ -0,0 +1,211 @@
+import os
+import sys
+
+# Add parent directory to path, before the app imports below need it
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from typing import Optional
+from config.settings import settings
+from models.schemas import InferenceRequest
+from services.inference_client import LocalInferenceClient
+from services.inference_protocol import (
+    FrameType, ProtocolError, connect, decode_json, encode_delta, encode_json, parse_address, read_frame
+)
+from services.generation_control import GenerationControl, GenerationCancelled
+from services.profile_service import profile_service
+from services.scheduler import generation_scheduler, get_priority, QueueFullError
+from utils.log import setup_logging
+from utils.request_utils import is_inference_peer, is_loopback
+import argparse
+import asyncio
+import logging
+import uuid
+
+# Standalone inference server: holds the model and serves API processes in the
+# frontend role (INFERENCE_URL=unix:... or tcp://...) with the framing from
+# services/inference_protocol.py. Run several for more inference capacity.
+
+setup_logging()
+logger = logging.getLogger("inference_server")
+
+local_client = LocalInferenceClient()
+
+class Connection:
+    # One client connection; requests on it are served one after another
+    
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        # Frames from the client and deltas from the decode thread, in arrival order
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+        # Unix socket peers are always on this host
+        peer = writer.get_extra_info("peername")
+        self.host = peer[0] if isinstance(peer, tuple) else "localhost"
+    
+    def _authorized(self, data) -> bool:
+        # Same rule as the HTTP worker: INFERENCE_TOKEN in the payload, or a local peer without one
+        token = data.get("token") if isinstance(data, dict) else None
+        if is_inference_peer(token, self.host):
+            return True
+        self.writer.write(encode_json(FrameType.ERROR, {"code": "forbidden", "error": "Invalid inference token"}))
+        return False
+    
+    async def _read_frames(self):
+        try:
+            while True:
+                self.events.put_nowait(("frame",) + await read_frame(self.reader))
+        except (asyncio.IncompleteReadError, ConnectionError, ProtocolError):
+            self.events.put_nowait(("closed",))
+    
+    async def serve(self):
+        reader_task = asyncio.create_task(self._read_frames())
+        try:
+            while True:
+                event = await self.events.get()
+                if event[0] == "closed":
+                    return
+                if event[0] != "frame":
+                    continue
+                
+                _, kind, payload = event
+                if kind == FrameType.STATUS:
+                    try:
+                        data = decode_json(payload) if payload else {}
+                    except ProtocolError:
+                        data = {}
+                    if not self._authorized(data):
+                        return
+                    self.writer.write(encode_json(FrameType.STATUS, local_client.status()))
+                elif kind == FrameType.GENERATE:
+                    if not await self._generate(payload):
+                        return
+                elif kind != FrameType.CANCEL:
+                    # A cancel that arrives after its result is harmless, anything else is not
+                    self.writer.write(encode_json(FrameType.ERROR, {"code": "protocol", "error": f"Unexpected {kind.name} frame"}))
+                    return
+                await self.writer.drain()
+        except ConnectionError:
+            return
+        finally:
+            reader_task.cancel()
+            self.writer.close()
+    
+    async def _generate(self, payload: bytes) -> bool:
+        # Stream one generation; False when the connection has to be closed
+        try:
+            data = decode_json(payload)
+            if not isinstance(data, dict):
+                raise ProtocolError("GENERATE payload must be a JSON object")
+        except ProtocolError as e:
+            self.writer.write(encode_json(FrameType.ERROR, {"code": "invalid", "error": str(e)}))
+            return True
+        if not self._authorized(data):
+            return False
+        try:
+            request = InferenceRequest(**{key: value for key, value in data.items() if key != "token"})
+        except (ValueError, TypeError) as e:
+            self.writer.write(encode_json(FrameType.ERROR, {"code": "invalid", "error": str(e)}))
+            return True
+        
+        control = GenerationControl(
+            request.timeout_seconds if request.timeout_seconds is not None else settings.get_generation_timeout()
+        )
+        
+        def on_delta(row: int, text: str):
+            # Called on the decode thread
+            self.loop.call_soon_threadsafe(self.events.put_nowait, ("delta", row, text))
+        
+        # Frontends already queue fairly per client, so every request is its own client here
+        task = asyncio.ensure_future(generation_scheduler.submit(
+            uuid.uuid4().hex,
+            get_priority(profile_service.select(request.params[0]).batch_class),
+            local_client.generate_stories_sync,
+            request.params,
+            control,
+            on_delta if request.stream else None
+        ))
+        task.add_done_callback(lambda _: self.events.put_nowait(("done",)))
+        
+        closed = False
+        while True:
+            event = await self.events.get()
+            if event[0] == "delta":
+                self.writer.write(encode_delta(event[1], event[2]))
+                await self.writer.drain()
+            elif event[0] == "frame" and event[1] == FrameType.CANCEL:
+                control.cancel()
+            elif event[0] == "frame":
+                # One request at a time per connection, the client is out of step with the server
+                self.writer.write(encode_json(FrameType.ERROR, {"code": "protocol", "error": f"Unexpected {event[1].name} frame while generating"}))
+                await self.writer.drain()
+                control.cancel()
+                task.cancel()
+                closed = True
+            elif event[0] == "closed":
+                # Client went away: stop decoding, then drop the connection
+                control.cancel()
+                task.cancel()
+                closed = True
+            elif event[0] == "done":
+                break
+        
+        if closed:
+            return False
+        self.writer.write(self._reply(task, control))
+        return True
+    
+    def _reply(self, task: asyncio.Future, control: GenerationControl) -> bytes:
+        try:
+            stories = task.result()
+        except (GenerationCancelled, asyncio.CancelledError):
+            return encode_json(FrameType.ERROR, {"code": "cancelled", "error": "Generation cancelled"})
+        except QueueFullError as e:
+            return encode_json(FrameType.ERROR, {"code": "busy", "error": str(e)})
+        except Exception as e:
+            logger.exception("Generation failed")
+            return encode_json(FrameType.ERROR, {"code": "failed", "error": str(e)})
+        return encode_json(FrameType.RESULT, {"stories": stories, "timed_out": control.timed_out, "rejected": control.rejected})
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    await Connection(reader, writer).serve()
+
+async def serve(address: str, preload: bool):
+    profile_service.load()
+    if preload:
+        await asyncio.to_thread(local_client.load_model)
+    
+    family, target = parse_address(address)
+    if family == "unix":
+        if os.path.exists(target):
+            try:
+                connect(address, timeout=1.0).close()
+            except OSError:
+                # A stale socket file from a previous run would make bind fail
+                os.unlink(target)
+            else:
+                raise RuntimeError(f"Another inference server is listening on {address}")
+        server = await asyncio.start_unix_server(handle_connection, path=target)
+    else:
+        if not settings.inference_token and not is_loopback(target[0]):
+            # Without a token only local frontends are served, so nobody else could use it anyway
+            raise RuntimeError(f"Set INFERENCE_TOKEN to listen on {address}, or listen on a loopback address")
+        server = await asyncio.start_server(handle_connection, host=target[0], port=target[1])
+    
+    logger.info("Inference server listening", extra={"fields": {"address": address}})
+    async with server:
+        await server.serve_forever()
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description='Serve story generation to API processes in the frontend role')
+    parser.add_argument('--address', type=str, default=settings.inference_server_address, help='unix:<path> or tcp://<host>:<port>')
+    parser.add_argument('--lazy', action='store_true', help='Load the model on the first request instead of at startup')
+    
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.address, preload=not args.lazy))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
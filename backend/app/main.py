@@ -1,7 +1,23 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 from api.routes import router
+from api import admin, internal
 from config.settings import settings
+from services.chat_service import chat_service
+from services.job_service import job_service
+from services.inference_client import inference_client
+from services.profile_service import profile_service
+from services.rate_limiter import rate_limiter, RateLimitExceeded
+from utils.request_utils import get_client_id
+from utils.responses import CompressionMiddleware, FastJSONResponse
+from utils.log import setup_logging, request_id_var
+import asyncio
+import logging
+import math
+import time
+import uuid
 import uvicorn
 import sys
 import os
@@ -9,13 +25,95 @@ import os
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+# Structured, queue-backed logging
+setup_logging()
+logger = logging.getLogger("api")
+
+def preload():
+    # Runs in a worker thread so the server answers health checks while loading
+    try:
+        inference_client.preload()
+    except Exception:
+        # The first generation request retries the load
+        logger.exception("Preload failed")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Refuse to start with invalid generation profiles
+    profile_service.load()
+    if settings.service_role != "frontend" and (settings.preload_model or settings.preload_tokenizer):
+        asyncio.get_running_loop().run_in_executor(None, preload)
+    # Restore chat sessions and start background story job workers; both belong to the
+    # API side, not to inference workers
+    if settings.service_role != "inference":
+        await chat_service.start()
+        await job_service.start()
+    yield
+    await job_service.stop()
+    await chat_service.stop()
+
 # Create FastAPI app
 app = FastAPI(
     title="AI BASED STORY GENERATOR CHATBOT",
     description="AI-powered story generator for children",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
 )
 
+# Compress larger responses. Registered first so it is the innermost middleware and sees
+# whole response bodies; batch results stream line by line and are left alone
+if settings.compression_min_size > 0:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.compression_min_size,
+        brotli=settings.compression_brotli,
+        skip_paths=["/api/batch"]
+    )
+
+def rate_limit_response(exc: RateLimitExceeded) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
+    return rate_limit_response(exc)
+
+# Requests that start or advance a conversation; polling and read-only calls are free
+TURN_PATHS = frozenset({"/api/chat", "/api/story", "/api/batch"})
+
+# Budget conversational turns (registered before CORS so 429s get CORS headers)
+@app.middleware("http")
+async def rate_limit_turns(request: Request, call_next):
+    if request.method == "POST" and request.url.path in TURN_PATHS:
+        try:
+            rate_limiter.check_turn([get_client_id(request)])
+        except RateLimitExceeded as e:
+            return rate_limit_response(e)
+    return await call_next(request)
+
+# Tag every request with an id and log its timing (sampled)
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        logger.info("Request completed", extra={"sampled": True, "fields": {
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+        }})
+        return response
+    finally:
+        request_id_var.reset(token)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +125,11 @@ app.add_middleware(
 
 # Include routes
 app.include_router(router, prefix="/api", tags=["chat"])
+if settings.service_role == "inference":
+    app.include_router(internal.router, prefix="/internal", tags=["inference"])
+# Profiling only makes sense where generations run
+if settings.service_role != "frontend":
+    app.include_router(admin.router, prefix="/admin", tags=["admin"])
 
 @app.get("/")
 async def root():
@@ -35,6 +138,8 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "chat": "/api/chat",
+            "story": "/api/story",
+            "jobs": "/api/jobs/{job_id}",
             "health": "/api/health",
             "docs": "/docs"
         }
@@ -45,5 +150,6 @@ if __name__ == "__main__":
         "main:app",
         host=settings.api_host,
         port=settings.api_port,
-        reload=settings.debug
+        reload=settings.debug,
+        log_level=settings.log_level.lower()
     )
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 from enum import Enum
 
@@ -9,6 +9,18 @@ class MessageRole(str, Enum):
     ASSISTANT = "assistant"
     SYSTEM = "system"
 
+class JobStatus(str, Enum):
+    # Background job states
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+class ProfileMode(str, Enum):
+    # Sampled Python stacks (speedscope) or torch.profiler (Chrome trace)
+    CPU = "cpu"
+    TORCH = "torch"
+
 class ChatMessage(BaseModel):
     # Single chat message
     role: MessageRole
@@ -37,16 +49,35 @@ class StoryParams(BaseModel):
             }
         }
 
+class StoryRequest(StoryParams):
+    # One-shot story API request
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
+
+class StoryResponse(BaseModel):
+    # One-shot story API response
+    story_params: StoryParams
+    story: str
+
 class ChatRequest(BaseModel):
     # Chat API request
     session_id: Optional[str] = None
     message: str
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
+    async_mode: bool = False
+    # Client-chosen id; resending a turn with the same id returns the first reply instead of advancing again
+    client_message_id: Optional[str] = Field(default=None, max_length=64)
+    # Drop empty fields, and the message text when message_id names a cached static text
+    lean: bool = False
     
     class Config:
         json_schema_extra = {
             "example": {
                 "session_id": None,
-                "message": "6-10 age"
+                "message": "6-10 age",
+                "timeout_seconds": None,
+                "async_mode": False,
+                "client_message_id": "3f6c1e2a-0001",
+                "lean": False
             }
         }
 
@@ -54,9 +85,12 @@ class ChatResponse(BaseModel):
     # Chat API response
     session_id: str
     message: str
+    # Set for static texts, see GET /api/prompts/messages
+    message_id: Optional[str] = None
     story_params: Optional[StoryParams] = None
     story: Optional[str] = None
     is_complete: bool = False
+    job_id: Optional[str] = None
     
     class Config:
         use_enum_values = True
@@ -64,14 +98,65 @@ class ChatResponse(BaseModel):
             "example": {
                 "session_id": "123e4567-e89b-12d3-a456-426614174000",
                 "message": "Great! I will prepare a story for the 6-10 age group.",
+                "message_id": None,
                 "story_params": None,
                 "story": None,
-                "is_complete": False
+                "is_complete": False,
+                "job_id": None
             }
         }
 
+class JobResponse(BaseModel):
+    # Background job status
+    job_id: str
+    session_id: Optional[str] = None
+    status: JobStatus
+    queue_position: Optional[int] = None
+    eta_seconds: Optional[float] = None
+    
+    class Config:
+        use_enum_values = True
+
+class JobResultResponse(BaseModel):
+    # Background job result
+    job_id: str
+    session_id: Optional[str] = None
+    status: JobStatus
+    story: Optional[str] = None
+    error: Optional[str] = None
+    
+    class Config:
+        use_enum_values = True
+
 class HealthResponse(BaseModel):
     # Health check response
     status: str
     model_loaded: bool
-    model_name: str
\ No newline at end of file
+    model_name: str
+    # "store" (pinned, verified), "local" or "hub"
+    model_source: Optional[str] = None
+    # Time spent loading the model, once it is loaded
+    cold_start_ms: Optional[float] = None
+    load_stages_ms: Optional[Dict[str, float]] = None
+
+class InferenceRequest(BaseModel):
+    # Stories forwarded from a frontend to an inference worker
+    params: List[StoryParams] = Field(min_length=1)
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
+    # Lets the frontend cancel the request through POST /internal/cancel/{request_id}
+    request_id: Optional[str] = Field(default=None, max_length=64)
+    # DELTA frames while decoding, socket transport only; off unless the frontend has a consumer
+    stream: bool = False
+
+class InferenceResponse(BaseModel):
+    # Stories in request order
+    stories: List[str]
+    timed_out: bool = False
+    # Rows that hold the fallback story instead of a generated one
+    rejected: List[int] = []
+
+class ProfileRequest(BaseModel):
+    # Admin request to profile the next generations
+    mode: ProfileMode = ProfileMode.CPU
+    generations: int = Field(default=1, ge=1)
+    interval_ms: float = Field(default=5.0, ge=1.0, le=1000.0)
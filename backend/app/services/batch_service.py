@@ -0,0 +1,98 @@
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from models.schemas import StoryParams
+from services.inference_client import inference_client
+from services.profile_service import profile_service
+from services.scheduler import generation_scheduler, get_priority, BATCH_PRIORITY, QueueFullError
+from services.rate_limiter import rate_limiter, RateLimitExceeded
+from services.story_service import story_service
+from services.generation_control import GenerationControl
+from config.settings import settings
+import asyncio
+import json
+
+# (id, params, error) for one input line
+BatchItem = Tuple[str, Optional[StoryParams], Optional[str]]
+
+# Records with params and an error were valid but not generated; resuming retries them
+GENERATION_FAILED = "Story generation failed, retry later"
+
+def parse_batch_line(line: str, default_id: str) -> BatchItem:
+    # Parse and validate one JSONL record of story parameters
+    try:
+        data = json.loads(line)
+        item_id = str(data.pop("id", default_id))
+    except (ValueError, AttributeError):
+        return default_id, None, "Invalid JSON record"
+    
+    try:
+        params = StoryParams(**data)
+    except ValueError as e:
+        return item_id, None, f"Invalid story parameters: {e}"
+    
+    is_valid, error = story_service.prepare(params)
+    if not is_valid:
+        return item_id, None, error
+    
+    return item_id, params, None
+
+def format_result(item_id: str, params: Optional[StoryParams] = None, story: Optional[str] = None, **extra) -> str:
+    record: Dict = {"id": item_id}
+    if params is not None:
+        record["params"] = params.dict()
+    if story is not None:
+        record["story"] = story
+    record.update(extra)
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+def chunk_items(items: List[BatchItem], batch_size: int) -> List[List[BatchItem]]:
+    # A batch is decoded with one profile, so only stories with the same profile share it
+    groups: Dict[str, List[BatchItem]] = {}
+    for item in items:
+        groups.setdefault(profile_service.select(item[1]).name, []).append(item)
+    
+    # Cheaper batch classes first
+    ordered = sorted(groups.values(), key=lambda group: get_priority(profile_service.select(group[0][1]).batch_class))
+    return [group[i:i + batch_size] for group in ordered for i in range(0, len(group), batch_size)]
+
+class BatchService:
+    # Bulk story generation without chat sessions
+    
+    async def stream(self, items: List[BatchItem], client_id: str) -> AsyncIterator[str]:
+        # Yield one JSONL result per item as each internal batch completes
+        valid = []
+        for item_id, params, error in items:
+            if error:
+                yield format_result(item_id, error=error)
+            else:
+                valid.append((item_id, params, error))
+        
+        chunks = chunk_items(valid, settings.batch_size)
+        for index, chunk in enumerate(chunks):
+            params_list = [params for _, params, _ in chunk]
+            control = GenerationControl(settings.get_generation_timeout())
+            try:
+                rate_limiter.check_generation([client_id], profile_service.select(params_list[0]).max_new_tokens * len(chunk))
+                stories = await generation_scheduler.submit(
+                    client_id, BATCH_PRIORITY, inference_client.generate_stories_sync, params_list, control
+                )
+            except (RateLimitExceeded, QueueFullError) as e:
+                # Report the rest as not generated, the client can resume with them later
+                retry_after = getattr(e, "retry_after", None)
+                for remaining in chunks[index:]:
+                    for item_id, params, _ in remaining:
+                        yield format_result(item_id, params, error=str(e), retry_after=retry_after)
+                return
+            except asyncio.CancelledError:
+                # Client stopped reading the stream
+                control.cancel()
+                raise
+            
+            for row, ((item_id, params, _), story) in enumerate(zip(chunk, stories)):
+                if row in control.rejected:
+                    # The fallback story is no result worth keeping
+                    yield format_result(item_id, params, error=GENERATION_FAILED)
+                else:
+                    yield format_result(item_id, params, story=story)
+
+# Global instance
+batch_service = BatchService()
@@ -1,14 +1,55 @@
-from typing import Dict, Optional, Tuple
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+from collections import OrderedDict
+from config.settings import settings
 from models.schemas import ChatMessage, StoryParams, MessageRole
 from utils.validators import (
     validate_age_group, validate_genre, 
     validate_length, validate_prompt, validate_characters,
     sanitize_input
 )
-from core.prompts import StoryPrompts
+from services.session_store import session_store, SessionStore
+from core.prompts import prompt_catalog
+import asyncio
+import json
+import logging
+import threading
 import uuid
 from datetime import datetime, timedelta
 
+# Allowed state changes; the questionnaire states may also repeat on invalid answers
+TRANSITIONS = {
+    "greeting": {"age"},
+    "age": {"age", "genre"},
+    "genre": {"genre", "length"},
+    "length": {"length", "topic"},
+    "topic": {"topic", "characters"},
+    "characters": {"characters", "generating"},
+    # Story attached, generation refused (back to the last question), or generation lost
+    "generating": {"generating", "done", "characters", "greeting"},
+    "done": {"done", "greeting"}
+}
+logger = logging.getLogger(__name__)
+
+# Replies remembered per session for retried turns
+MAX_REPLAYED_TURNS = 64
+LOCK_STRIPES = 64
+
+class InvalidTransition(Exception):
+    # Raised when code tries a state change the conversation flow does not allow
+    pass
+
+class ChatTurn(NamedTuple):
+    # Result of one user message
+    response: str
+    session_id: str
+    story_params: Optional[StoryParams]
+    is_complete: bool
+    # Set when the turn repeats an earlier client_message_id
+    duplicate: bool = False
+    # For a repeated turn whose story already exists or is being generated by a job
+    story: Optional[str] = None
+    job_id: Optional[str] = None
+
 class Session:
     # Session storage
     def __init__(self):
@@ -18,51 +59,178 @@ class Session:
         self.state = "greeting"
         self.created_at = datetime.now()
         self.story: Optional[str] = None
+        # Who is generating the story: "request" for a synchronous turn, else the job id
+        self.generation: Optional[str] = None
+        # client_message_id -> reply, oldest first
+        self.replies: "OrderedDict[str, Tuple[str, Optional[StoryParams], bool]]" = OrderedDict()
+    
+    def to_record(self) -> bytes:
+        # Snapshot payload for the session log; the id and created_at go in the record header
+        return json.dumps({
+            "state": self.state,
+            "params": self.params,
+            "story": self.story,
+            # Job ids survive a restart with their job, synchronous generations do not
+            "generation": self.generation if self.generation != "request" else None,
+            "messages": [[m["role"], m["content"], m["timestamp"].timestamp()] for m in self.messages],
+            "replies": [
+                [message_id, response, params.dict() if params else None, is_complete]
+                for message_id, (response, params, is_complete) in self.replies.items()
+            ]
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    
+    @classmethod
+    def from_record(cls, session_id: str, created_at: float, payload: bytes) -> "Session":
+        data = json.loads(payload)
+        session = cls()
+        session.id = session_id
+        session.created_at = datetime.fromtimestamp(created_at)
+        session.state = data["state"]
+        session.params = data["params"]
+        session.story = data["story"]
+        session.generation = data["generation"]
+        session.messages = [
+            {"role": role, "content": content, "timestamp": datetime.fromtimestamp(timestamp)}
+            for role, content, timestamp in data["messages"]
+        ]
+        session.replies = OrderedDict(
+            (message_id, (response, StoryParams(**params) if params else None, is_complete))
+            for message_id, response, params, is_complete in data["replies"]
+        )
+        
+        if session.state == "generating" and not session.generation:
+            # Its generation died with the old process: back to the last question, and a
+            # resent final answer is a new turn rather than a replay of the lost one
+            session.state = "characters"
+            session.replies = OrderedDict(
+                (message_id, reply) for message_id, reply in session.replies.items() if not reply[2]
+            )
+        return session
 
 class ChatService:
-    # Manages chat sessions and conversation flow
-    def __init__(self):
+    # Manages chat sessions and conversation flow. Every read-modify-write of a session
+    # happens under that session's lock (one of LOCK_STRIPES, picked by session id), so
+    # concurrent turns, job results and cleanup never interleave on the same session.
+    # With a SessionStore attached, changed sessions are appended to its log every few
+    # seconds and sessions from the previous run are loaded from it on first use.
+    def __init__(self, store: Optional[SessionStore] = None):
         self.sessions: Dict[str, Session] = {}
-        self.prompts = StoryPrompts.get_collection_prompts()
-        self._cleanup_interval = timedelta(hours=24)
+        self.prompts = prompt_catalog.texts
+        self._cleanup_interval = timedelta(hours=settings.session_timeout_hours)
+        # Guards adding, removing and iterating self.sessions
+        self._registry_lock = threading.Lock()
+        self._stripes = [threading.RLock() for _ in range(LOCK_STRIPES)]
+        self._store = store
+        # Sessions changed since the last snapshot, guarded by the registry lock
+        self._dirty: Set[str] = set()
+        self._snapshot_task: Optional[asyncio.Task] = None
+    
+    def _lock(self, session_id: str) -> threading.RLock:
+        return self._stripes[hash(session_id) % LOCK_STRIPES]
+    
+    def _is_expired(self, session: Session) -> bool:
+        return (datetime.now() - session.created_at) > self._cleanup_interval
+    
+    def _set_state(self, session: Session, state: str):
+        # Caller holds the session lock
+        if state not in TRANSITIONS[session.state]:
+            raise InvalidTransition(f"{session.state} -> {state}")
+        session.state = state
+    
+    def _changed(self, session: Session):
+        # Caller holds the session lock
+        if self._store is not None and self._store.is_open:
+            with self._registry_lock:
+                self._dirty.add(session.id)
     
     def create_session(self) -> Session:
         # Create new session
         session = Session()
-        self.sessions[session.id] = session
+        with self._registry_lock:
+            self.sessions[session.id] = session
         return session
     
     def get_session(self, session_id: str) -> Optional[Session]:
         # Get existing session
+        with self._lock(session_id):
+            return self._get_session(session_id)
+    
+    def _get_session(self, session_id: str) -> Optional[Session]:
+        # Caller holds the session lock
         session = self.sessions.get(session_id)
+        if session is None and self._store is not None:
+            session = self._restore(session_id)
         
-        if session and (datetime.now() - session.created_at) > self._cleanup_interval:
-            del self.sessions[session_id]
+        if session and self._is_expired(session):
+            with self._registry_lock:
+                self.sessions.pop(session_id, None)
             return None
         
         return session
     
+    def _restore(self, session_id: str) -> Optional[Session]:
+        # Load a session from the previous run; caller holds the session lock
+        record = self._store.read(session_id)
+        if record is None:
+            return None
+        
+        try:
+            session = Session.from_record(session_id, *record)
+        except (ValueError, KeyError, TypeError):
+            logger.exception("Unreadable session snapshot", extra={"fields": {"session_id": session_id}})
+            return None
+        
+        with self._registry_lock:
+            # Cleanup can only have removed it from memory, never from the log
+            self.sessions[session_id] = session
+        return session
+    
     def cleanup_old_sessions(self) -> int:
         # Remove expired sessions
-        expired = [
-            sid for sid, sess in self.sessions.items()
-            if (datetime.now() - sess.created_at) > self._cleanup_interval
-        ]
-        for sid in expired:
-            del self.sessions[sid]
-        return len(expired)
+        with self._registry_lock:
+            candidates = [sid for sid, sess in self.sessions.items() if self._is_expired(sess)]
+        
+        removed = 0
+        for sid in candidates:
+            # Re-checked under the session lock, a turn may be running on it right now
+            with self._lock(sid):
+                session = self.sessions.get(sid)
+                if session and self._is_expired(session):
+                    with self._registry_lock:
+                        del self.sessions[sid]
+                    removed += 1
+        
+        if self._store is not None:
+            # Sessions from the previous run that nobody came back for
+            removed += self._store.drop_expired()
+        return removed
     
-    def process_message(self, session_id: Optional[str], user_message: str) -> Tuple[str, str, Optional[StoryParams], bool]:
+    def process_message(self, session_id: Optional[str], user_message: str, client_message_id: Optional[str] = None) -> ChatTurn:
         # Sanitize input
         user_message = sanitize_input(user_message)
         
         # Get or create session
+        session = None
         if session_id:
-            session = self.get_session(session_id)
-            if not session:
-                session = self.create_session()
-        else:
-            session = self.create_session()
+            with self._lock(session_id):
+                session = self._get_session(session_id)
+                if session:
+                    return self._process(session, user_message, client_message_id)
+        
+        session = self.create_session()
+        with self._lock(session.id):
+            return self._process(session, user_message, client_message_id)
+    
+    def _process(self, session: Session, user_message: str, client_message_id: Optional[str]) -> ChatTurn:
+        # One turn of the conversation; caller holds the session lock
+        if client_message_id and client_message_id in session.replies:
+            # A retry of a turn already handled: same reply, no second state change
+            response, story_params, is_complete = session.replies[client_message_id]
+            return ChatTurn(
+                response, session.id, story_params, is_complete, duplicate=True,
+                story=session.story if is_complete and session.state == "done" else None,
+                job_id=session.generation if is_complete and session.generation != "request" else None
+            )
         
         # Add user message
         session.messages.append({
@@ -74,33 +242,43 @@ class ChatService:
         # Process based on state
         if session.state == "greeting":
             response = self.prompts["greeting"]
-            session.state = "age"
+            self._set_state(session, "age")
         
         elif session.state == "age":
-            response, session.state = self._handle_age(session, user_message)
+            response, state = self._handle_age(session, user_message)
+            self._set_state(session, state)
         
         elif session.state == "genre":
-            response, session.state = self._handle_genre(session, user_message)
+            response, state = self._handle_genre(session, user_message)
+            self._set_state(session, state)
         
         elif session.state == "length":
-            response, session.state = self._handle_length(session, user_message)
+            response, state = self._handle_length(session, user_message)
+            self._set_state(session, state)
         
         elif session.state == "topic":
-            response, session.state = self._handle_topic(session, user_message)
+            response, state = self._handle_topic(session, user_message)
+            self._set_state(session, state)
         
         elif session.state == "characters":
-            response, session.state = self._handle_characters(session, user_message)
+            response, state = self._handle_characters(session, user_message)
+            self._set_state(session, state)
         
         elif session.state == "done":
             response = "Write 'new story' for a new story!"
             if "new" in user_message.lower():
                 session.params = {}
-                session.state = "greeting"
+                session.story = None
+                self._set_state(session, "greeting")
                 response = self.prompts["greeting"]
         
+        elif session.state == "generating" and session.generation:
+            response = "Your story is still being written, please wait a moment!"
+        
         else:
+            # Generation was lost (e.g. the client went away)
             response = "Something went wrong. Let's start over!"
-            session.state = "greeting"
+            self._set_state(session, "greeting")
         
         # Add bot message
         session.messages.append({
@@ -110,13 +288,19 @@ class ChatService:
         })
         
         # Check if ready for generation
-        is_complete = session.state == "generating"
+        is_complete = session.state == "generating" and not session.generation
         story_params = None
         
         if is_complete:
             story_params = StoryParams(**session.params)
         
-        return response, session.id, story_params, is_complete
+        if client_message_id:
+            session.replies[client_message_id] = (response, story_params, is_complete)
+            if len(session.replies) > MAX_REPLAYED_TURNS:
+                session.replies.popitem(last=False)
+        
+        self._changed(session)
+        return ChatTurn(response, session.id, story_params, is_complete)
     
     def _handle_age(self, session: Session, message: str) -> Tuple[str, str]:
         msg_lower = message.lower().strip()
@@ -203,12 +387,106 @@ class ChatService:
         
         return "Write character names separated by commas or say 'no'.", "characters"
     
-    def set_story(self, session_id: str, story: str):
-        # Set generated story
-        session = self.get_session(session_id)
-        if session:
+    def rollback_generation(self, session_id: str, client_message_id: Optional[str] = None):
+        # Return a session to the last question when its generation was refused
+        with self._lock(session_id):
+            session = self._get_session(session_id)
+            if session and session.state == "generating" and not session.generation:
+                self._set_state(session, "characters")
+                # The client resends the same turn once allowed, it must not replay the refusal
+                if client_message_id:
+                    session.replies.pop(client_message_id, None)
+                self._changed(session)
+    
+    def claim_generation(self, session_id: str, owner: str = "request") -> bool:
+        # Mark the session's story as being generated; False if someone else already is
+        with self._lock(session_id):
+            session = self._get_session(session_id)
+            if not session or session.state != "generating" or session.generation:
+                return False
+            session.generation = owner
+            self._changed(session)
+            return True
+    
+    def release_generation(self, session_id: str, owner: str = "request"):
+        # Generation failed or was cancelled: a retried turn may claim it again
+        with self._lock(session_id):
+            session = self._get_session(session_id)
+            if session and session.generation == owner:
+                session.generation = None
+                self._changed(session)
+    
+    def set_story(self, session_id: str, story: str) -> bool:
+        # Set generated story; False when the session has moved on since
+        with self._lock(session_id):
+            session = self._get_session(session_id)
+            if not session:
+                return False
+            if session.state == "done":
+                # Job results can be fetched more than once
+                return session.story == story
+            if session.state != "generating":
+                return False
             session.story = story
-            session.state = "done"
+            session.generation = None
+            self._set_state(session, "done")
+            self._changed(session)
+            return True
+    
+    def restore(self) -> int:
+        # Replay the session log of the previous run; sessions load lazily afterwards
+        return self._store.open()
+    
+    def snapshot(self) -> int:
+        # Append every session changed since the last snapshot to the log
+        with self._registry_lock:
+            dirty, self._dirty = self._dirty, set()
+        
+        snapshots = []
+        for session_id in dirty:
+            with self._lock(session_id):
+                session = self.sessions.get(session_id)
+                if session and not self._is_expired(session):
+                    snapshots.append((session.id, session.created_at.timestamp(), session.to_record()))
+        
+        try:
+            self._store.append(snapshots)
+        except OSError:
+            # Written with the next snapshot instead
+            with self._registry_lock:
+                self._dirty |= dirty
+            raise
+        
+        if self._store.needs_compaction():
+            self._store.compact()
+        return len(snapshots)
+    
+    async def start(self):
+        # Restore sessions from the last run and start snapshotting
+        if self._store is None:
+            return
+        count = await asyncio.to_thread(self.restore)
+        logger.info("Sessions restored", extra={"fields": {"sessions": count}})
+        self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+    
+    async def stop(self):
+        if self._snapshot_task is None:
+            return
+        self._snapshot_task.cancel()
+        await asyncio.gather(self._snapshot_task, return_exceptions=True)
+        self._snapshot_task = None
+        # Changes since the last periodic snapshot
+        await asyncio.to_thread(self.snapshot)
+        self._store.close()
+    
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(settings.session_snapshot_interval)
+            try:
+                await asyncio.to_thread(self.snapshot)
+            except Exception:
+                logger.exception("Session snapshot failed")
+
 
 # Global instance
-chat_service = ChatService()
\ No newline at end of file
+chat_service = ChatService(session_store if settings.session_snapshot_enabled else None)
\ No newline at end of file
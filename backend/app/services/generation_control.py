@@ -0,0 +1,42 @@
+import threading
+import time
+from typing import List, Optional
+
+class GenerationCancelled(Exception):
+    # Raised when a generation is cancelled before it finished
+    pass
+
+class GenerationControl:
+    # Deadline and cancellation state shared between a request and its generation
+    
+    def __init__(self, timeout_seconds: Optional[float] = None):
+        self.started_at = time.monotonic()
+        # 0 is a deadline that has already passed, only None means no deadline
+        self.deadline = self.started_at + timeout_seconds if timeout_seconds is not None else None
+        self.timed_out = False
+        # Batch rows whose story failed or was rejected and replaced by the fallback story
+        self.rejected: List[int] = []
+        self._cancelled = threading.Event()
+    
+    def cancel(self):
+        self._cancelled.set()
+    
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+    
+    def remaining(self) -> Optional[float]:
+        # Seconds left until the deadline, None without one
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+    
+    def should_stop(self) -> bool:
+        # Checked by the decode loop after every generated token
+        if self._cancelled.is_set():
+            return True
+        
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.timed_out = True
+            return True
+        
+        return False
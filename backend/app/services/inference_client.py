@@ -0,0 +1,352 @@
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional
+from config.settings import settings
+from core.story_text import FALLBACK_STORY
+from models.schemas import StoryParams
+from services.generation_control import GenerationControl, GenerationCancelled
+from services.scheduler import QueueFullError
+from services.inference_protocol import (
+    FrameType, ProtocolError, connect, decode_delta, decode_json, encode_frame, encode_json, parse_address, recv_frame
+)
+import logging
+import select
+import socket
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# "all" runs the model in the API process, "frontend" forwards generation to
+# inference workers and "inference" is such a worker
+SERVICE_ROLES = ("all", "frontend", "inference")
+
+# Called with (row, text) for every piece of story text as it is decoded
+DeltaCallback = Callable[[int, str], None]
+
+class InferenceServerError(RuntimeError):
+    # An inference server answered a request with an error
+    pass
+
+class InferenceClient(ABC):
+    # Where stories are generated; callers never import the model code themselves
+    
+    @abstractmethod
+    def generate_stories_sync(
+        self, params_list: List[StoryParams], control: GenerationControl, on_delta: Optional[DeltaCallback] = None
+    ) -> List[str]:
+        pass
+    
+    def generate_story_sync(self, params: StoryParams, control: GenerationControl, on_delta: Optional[DeltaCallback] = None) -> str:
+        return self.generate_stories_sync([params], control, on_delta)[0]
+    
+    @abstractmethod
+    def status(self) -> Dict:
+        # model_loaded and model_name, plus the load stats once known
+        pass
+    
+    def preload(self):
+        pass
+    
+    @staticmethod
+    def _remaining(control: GenerationControl) -> Optional[float]:
+        # Seconds a remote worker gets for the story; a deadline that already passed is
+        # never forwarded, since the worker would take it for no deadline at all
+        remaining = control.remaining()
+        if remaining is not None and remaining <= 0:
+            control.timed_out = True
+            raise TimeoutError("Generation deadline passed before the story reached an inference worker")
+        return remaining
+    
+    @staticmethod
+    def _failed(params_list: List[StoryParams], control: GenerationControl, error: Exception, timed_out: bool) -> List[str]:
+        # Same outcome as a failed generation in this process: every row gets the fallback
+        # story and is reported as rejected, instead of the error reaching the caller
+        logger.warning("Remote generation failed", extra={"fields": {"error": str(error), "timed_out": timed_out}})
+        if timed_out:
+            control.timed_out = True
+        control.rejected = list(range(len(params_list)))
+        return [FALLBACK_STORY for _ in params_list]
+
+class LocalInferenceClient(InferenceClient):
+    # Model in this process; torch and transformers are imported on first use
+    
+    def _service(self):
+        from services.llm_service import llm_service
+        return llm_service
+    
+    def generate_stories_sync(
+        self, params_list: List[StoryParams], control: GenerationControl, on_delta: Optional[DeltaCallback] = None
+    ) -> List[str]:
+        return self._service().generate_stories_sync(params_list, control, on_delta)
+    
+    def status(self) -> Dict:
+        # A health check must not be the thing that imports torch
+        if "services.llm_service" not in sys.modules:
+            return {"model_loaded": False, "model_name": settings.get_model_path()}
+        
+        service = self._service()
+        return {
+            "model_loaded": service.is_loaded(),
+            "model_name": service.get_model_name(),
+            **service.get_load_stats()
+        }
+    
+    def load_model(self):
+        self._service().load_model()
+    
+    def preload(self):
+        if settings.preload_model:
+            self._service().load_model()
+        elif settings.preload_tokenizer:
+            self._service().load_tokenizer()
+
+class HTTPInferenceClient(InferenceClient):
+    # Forwards generation to an inference worker (SERVICE_ROLE=inference) over HTTP; no streaming
+    
+    def __init__(self, url: str, timeout_margin: float, poll_interval: float):
+        import httpx
+        self.url = url
+        self.timeout_margin = timeout_margin
+        self.poll_interval = poll_interval
+        # Thread-safe, keeps connections to the worker alive between stories
+        headers = {"X-Inference-Token": settings.inference_token} if settings.inference_token else {}
+        self._client = httpx.Client(base_url=url, headers=headers)
+    
+    def generate_stories_sync(
+        self, params_list: List[StoryParams], control: GenerationControl, on_delta: Optional[DeltaCallback] = None
+    ) -> List[str]:
+        import httpx
+        try:
+            return self._forward(params_list, control)
+        except (TimeoutError, httpx.TimeoutException) as e:
+            return self._failed(params_list, control, e, timed_out=True)
+        except httpx.HTTPError as e:
+            # Worker unreachable or failing
+            return self._failed(params_list, control, e, timed_out=False)
+    
+    def _forward(self, params_list: List[StoryParams], control: GenerationControl) -> List[str]:
+        if control.is_cancelled():
+            raise GenerationCancelled()
+        
+        # The worker enforces the deadline, the margin covers its queue and the transfer
+        remaining = self._remaining(control)
+        request_id = uuid.uuid4().hex
+        done = threading.Event()
+        watcher = threading.Thread(target=self._forward_cancel, args=(request_id, control, done), daemon=True)
+        watcher.start()
+        try:
+            response = self._client.post(
+                "/internal/generate",
+                json={
+                    "params": [params.dict() for params in params_list],
+                    "timeout_seconds": remaining,
+                    "request_id": request_id
+                },
+                timeout=remaining + self.timeout_margin if remaining is not None else None
+            )
+        finally:
+            done.set()
+        
+        if response.status_code == 499 or control.is_cancelled():
+            raise GenerationCancelled()
+        if response.status_code == 503:
+            raise QueueFullError(response.json().get("detail", "Inference worker is busy"))
+        response.raise_for_status()
+        
+        data = response.json()
+        if data["timed_out"]:
+            control.timed_out = True
+        control.rejected = data.get("rejected", [])
+        return data["stories"]
+    
+    def _forward_cancel(self, request_id: str, control: GenerationControl, done: threading.Event):
+        # Runs next to the blocking request and stops the worker's decode loop on cancellation
+        while not done.wait(self.poll_interval):
+            if control.is_cancelled():
+                try:
+                    self._client.post(f"/internal/cancel/{request_id}", timeout=2.0)
+                except Exception:
+                    logger.warning("Could not cancel generation on inference worker", extra={"fields": {"url": self.url}})
+                return
+    
+    def status(self) -> Dict:
+        try:
+            response = self._client.get("/internal/status", timeout=2.0)
+            response.raise_for_status()
+            return response.json()
+        except Exception:
+            logger.warning("Inference worker unreachable", extra={"fields": {"url": self.url}})
+            return {"model_loaded": False, "model_name": settings.get_model_path()}
+
+class _ConnectionPool:
+    # Idle connections to one inference server, reused across requests
+    
+    def __init__(self, address: str, max_idle: int, connect_timeout: float):
+        self.address = address
+        self.max_idle = max_idle
+        self.connect_timeout = connect_timeout
+        self.in_use = 0
+        self._idle: List[socket.socket] = []
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> socket.socket:
+        with self._lock:
+            self.in_use += 1
+            while self._idle:
+                sock = self._idle.pop()
+                # An idle connection has nothing to read unless the server closed it
+                if not select.select([sock], [], [], 0)[0]:
+                    return sock
+                sock.close()
+        try:
+            sock = connect(self.address, self.connect_timeout)
+        except OSError:
+            with self._lock:
+                self.in_use -= 1
+            raise
+        sock.settimeout(None)
+        return sock
+    
+    def release(self, sock: socket.socket, reusable: bool):
+        with self._lock:
+            self.in_use -= 1
+            if reusable and len(self._idle) < self.max_idle:
+                self._idle.append(sock)
+                return
+        sock.close()
+
+class SocketInferenceClient(InferenceClient):
+    # Talks to inference_server.py over Unix domain sockets or local TCP, with
+    # streamed deltas, in-flight cancellation and pooled connections. Given several
+    # addresses, each request goes to the server with the fewest requests in flight.
+    
+    def __init__(self, addresses: List[str], max_idle: int, timeout_margin: float, poll_interval: float):
+        for address in addresses:
+            parse_address(address)
+        self.pools = [_ConnectionPool(address, max_idle, connect_timeout=5.0) for address in addresses]
+        self.timeout_margin = timeout_margin
+        self.poll_interval = poll_interval
+        # Sent with GENERATE and STATUS, servers check it like the HTTP worker's header
+        self._token = {"token": settings.inference_token} if settings.inference_token else {}
+        self._lock = threading.Lock()
+    
+    def _pool(self) -> _ConnectionPool:
+        with self._lock:
+            return min(self.pools, key=lambda pool: pool.in_use)
+    
+    def generate_stories_sync(
+        self, params_list: List[StoryParams], control: GenerationControl, on_delta: Optional[DeltaCallback] = None
+    ) -> List[str]:
+        try:
+            return self._forward(params_list, control, on_delta)
+        except TimeoutError as e:
+            return self._failed(params_list, control, e, timed_out=True)
+        except (OSError, ProtocolError, InferenceServerError) as e:
+            # Server unreachable, out of step or failing
+            return self._failed(params_list, control, e, timed_out=False)
+    
+    def _forward(self, params_list: List[StoryParams], control: GenerationControl, on_delta: Optional[DeltaCallback]) -> List[str]:
+        if control.is_cancelled():
+            raise GenerationCancelled()
+        
+        remaining = self._remaining(control)
+        give_up_at = time.monotonic() + remaining + self.timeout_margin if remaining is not None else None
+        pool = self._pool()
+        sock = pool.acquire()
+        # Only a connection that ended on a complete reply can carry the next request
+        reusable = False
+        try:
+            sock.sendall(encode_json(FrameType.GENERATE, {
+                "params": [params.dict() for params in params_list],
+                "timeout_seconds": remaining,
+                "stream": on_delta is not None,
+                **self._token
+            }))
+            cancel_sent = False
+            while True:
+                # Wake up regularly to forward a cancellation while the server decodes
+                readable, _, _ = select.select([sock], [], [], self.poll_interval)
+                if control.is_cancelled() and not cancel_sent:
+                    sock.sendall(encode_frame(FrameType.CANCEL))
+                    cancel_sent = True
+                if not readable:
+                    if give_up_at is not None and time.monotonic() > give_up_at:
+                        raise TimeoutError(f"No reply from inference server {pool.address}")
+                    continue
+                
+                kind, payload = recv_frame(sock)
+                if kind == FrameType.DELTA:
+                    if on_delta is not None:
+                        on_delta(*decode_delta(payload))
+                    continue
+                
+                reusable = True
+                if kind == FrameType.RESULT:
+                    data = decode_json(payload)
+                    if data["timed_out"]:
+                        control.timed_out = True
+                    control.rejected = data.get("rejected", [])
+                    if control.is_cancelled():
+                        raise GenerationCancelled()
+                    return data["stories"]
+                if kind == FrameType.ERROR:
+                    data = decode_json(payload)
+                    if data["code"] == "cancelled":
+                        raise GenerationCancelled()
+                    if data["code"] == "busy":
+                        raise QueueFullError(data["error"])
+                    raise InferenceServerError(f"Inference server error: {data['error']}")
+                
+                reusable = False
+                raise ProtocolError(f"Unexpected {kind.name} frame")
+        finally:
+            pool.release(sock, reusable)
+    
+    def status(self) -> Dict:
+        # First reachable server; model_loaded only when every server has its model
+        statuses = []
+        for pool in self.pools:
+            try:
+                sock = pool.acquire()
+            except OSError:
+                logger.warning("Inference server unreachable", extra={"fields": {"address": pool.address}})
+                continue
+            reusable = False
+            try:
+                sock.settimeout(2.0)
+                sock.sendall(encode_json(FrameType.STATUS, self._token))
+                kind, payload = recv_frame(sock)
+                sock.settimeout(None)
+                reusable = kind == FrameType.STATUS
+                if reusable:
+                    statuses.append(decode_json(payload))
+            except (OSError, ProtocolError):
+                logger.warning("Inference server unreachable", extra={"fields": {"address": pool.address}})
+            finally:
+                pool.release(sock, reusable)
+        
+        if not statuses:
+            return {"model_loaded": False, "model_name": settings.get_model_path()}
+        return {**statuses[0], "model_loaded": len(statuses) == len(self.pools) and all(s["model_loaded"] for s in statuses)}
+
+def create_inference_client(role: Optional[str] = None) -> InferenceClient:
+    role = role or settings.service_role
+    if role not in SERVICE_ROLES:
+        raise ValueError(f"SERVICE_ROLE must be one of {', '.join(SERVICE_ROLES)}, got {role}")
+    if role != "frontend":
+        return LocalInferenceClient()
+    
+    # http(s):// for an API process in the inference role, unix: / tcp:// for inference_server.py
+    if settings.inference_url.startswith(("http://", "https://")):
+        return HTTPInferenceClient(settings.inference_url, settings.inference_timeout_margin, settings.disconnect_poll_interval)
+    return SocketInferenceClient(
+        [address.strip() for address in settings.inference_url.split(",") if address.strip()],
+        settings.inference_pool_size,
+        settings.inference_timeout_margin,
+        settings.disconnect_poll_interval
+    )
+
+# Global instance
+inference_client = create_inference_client()
@@ -0,0 +1,107 @@
+from typing import Optional, Tuple, Union
+from enum import IntEnum
+import asyncio
+import json
+import socket
+import struct
+
+# Wire format shared by inference_server.py and SocketInferenceClient. Every frame is
+# a 1-byte type and a 4-byte big-endian payload length, followed by the payload.
+# Control frames carry compact JSON, story deltas a 2-byte row index and raw UTF-8.
+#
+#   client -> server   GENERATE {"params": [...], "timeout_seconds": t, "stream": b, "token": ...},
+#                      CANCEL, STATUS {"token": ...}; the token only when INFERENCE_TOKEN is set
+#   server -> client   DELTA* (with "stream") then RESULT {"stories": [...], "timed_out": b} or ERROR {"code", "error"};
+#                      STATUS {...} for STATUS
+#
+# A connection carries one request at a time and is reused afterwards.
+
+HEADER = struct.Struct("!BI")
+ROW = struct.Struct("!H")
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+class FrameType(IntEnum):
+    GENERATE = 1
+    CANCEL = 2
+    STATUS = 3
+    DELTA = 4
+    RESULT = 5
+    ERROR = 6
+
+class ProtocolError(Exception):
+    # Raised on a malformed frame; the connection cannot be used any more
+    pass
+
+def encode_frame(kind: FrameType, payload: bytes = b"") -> bytes:
+    return HEADER.pack(kind, len(payload)) + payload
+
+def encode_json(kind: FrameType, data) -> bytes:
+    return encode_frame(kind, json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def encode_delta(row: int, text: str) -> bytes:
+    return encode_frame(FrameType.DELTA, ROW.pack(row) + text.encode("utf-8"))
+
+def decode_json(payload: bytes):
+    try:
+        return json.loads(payload)
+    except ValueError as e:
+        raise ProtocolError(f"Invalid JSON payload: {e}")
+
+def decode_delta(payload: bytes) -> Tuple[int, str]:
+    (row,) = ROW.unpack_from(payload)
+    return row, payload[ROW.size:].decode("utf-8")
+
+def _check_header(header: bytes) -> Tuple[FrameType, int]:
+    kind, length = HEADER.unpack(header)
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Frame of {length} bytes is over the {MAX_PAYLOAD} byte limit")
+    try:
+        return FrameType(kind), length
+    except ValueError:
+        raise ProtocolError(f"Unknown frame type {kind}")
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[FrameType, bytes]:
+    # Raises asyncio.IncompleteReadError when the peer closes the connection
+    kind, length = _check_header(await reader.readexactly(HEADER.size))
+    return kind, await reader.readexactly(length)
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError("Inference server closed the connection")
+        buffer += chunk
+    return bytes(buffer)
+
+def recv_frame(sock: socket.socket) -> Tuple[FrameType, bytes]:
+    kind, length = _check_header(_recv_exactly(sock, HEADER.size))
+    return kind, _recv_exactly(sock, length)
+
+# "unix:/path/to.sock" or "tcp://host:port"
+Address = Tuple[str, Union[str, Tuple[str, int]]]
+
+def parse_address(address: str) -> Address:
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if address.startswith("tcp://"):
+        host, _, port = address[len("tcp://"):].rpartition(":")
+        if host and port.isdigit():
+            return "tcp", (host.strip("[]"), int(port))
+    raise ValueError(f"Inference address must be unix:<path> or tcp://<host>:<port>, got {address}")
+
+def connect(address: str, timeout: Optional[float] = None) -> socket.socket:
+    family, target = parse_address(address)
+    if family == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET6 if ":" in target[0] else socket.AF_INET, socket.SOCK_STREAM)
+        # Deltas are small frames, send them right away
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(target)
+    except OSError:
+        sock.close()
+        raise
+    return sock
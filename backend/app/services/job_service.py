@@ -0,0 +1,245 @@
+from typing import Dict, List, Optional
+from models.schemas import StoryParams, JobStatus
+from services.story_service import story_service
+from services.chat_service import chat_service
+from services.scheduler import get_priority, QueueFullError, DEFAULT_PRIORITY
+from services.profile_service import profile_service
+from services.generation_control import GenerationControl
+from config.settings import settings
+from utils.metrics import metrics
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+class JobService:
+    # Background story jobs backed by a local SQLite queue
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+    
+    def _connect(self) -> sqlite3.Connection:
+        # Open the queue database on first use
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT UNIQUE NOT NULL,
+                    session_id TEXT,
+                    client_id TEXT,
+                    priority INTEGER NOT NULL,
+                    params TEXT NOT NULL,
+                    timeout_seconds REAL,
+                    status TEXT NOT NULL,
+                    story TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            self._migrate(conn)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority, seq)")
+            self._conn = conn
+        return self._conn
+    
+    def _migrate(self, conn: sqlite3.Connection):
+        # Queues created before scheduling classes have no client_id / priority columns
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "client_id" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN client_id TEXT")
+        if "priority" not in columns:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT {DEFAULT_PRIORITY}")
+        
+        # The old index was on (status, seq) and would shadow the new one
+        indexed = [row["name"] for row in conn.execute("PRAGMA index_info(idx_jobs_status)")]
+        if indexed and indexed != ["status", "priority", "seq"]:
+            conn.execute("DROP INDEX idx_jobs_status")
+            logger.info("Migrated job queue schema", extra={"fields": {"path": self.db_path}})
+    
+    def _execute(self, query: str, args: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connect().execute(query, args)
+    
+    async def start(self):
+        # Start background workers, picking up jobs left over from a previous run
+        self._wakeup = asyncio.Event()
+        self._requeue_stale_jobs()
+        for _ in range(settings.job_workers):
+            self._workers.append(asyncio.create_task(self._worker()))
+    
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+    
+    def submit(
+        self, session_id: Optional[str], params: StoryParams, client_id: str,
+        timeout_seconds: Optional[float] = None, job_id: Optional[str] = None
+    ) -> str:
+        # Persist a new job and wake up a worker
+        job_id = job_id or str(uuid.uuid4())
+        self._execute(
+            """INSERT INTO jobs (id, session_id, client_id, priority, params, timeout_seconds, status, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (job_id, session_id, client_id, get_priority(profile_service.select(params).batch_class), params.json(),
+             timeout_seconds, JobStatus.QUEUED.value, time.time())
+        )
+        metrics.increment("jobs_submitted")
+        
+        if self._wakeup:
+            self._wakeup.set()
+        return job_id
+    
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+    
+    def get_queue_position(self, job: Dict) -> Optional[int]:
+        # Number of queued jobs that will be claimed before this one
+        if job["status"] != JobStatus.QUEUED.value:
+            return None
+        row = self._execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ? AND (priority < ? OR (priority = ? AND seq < ?))",
+            (JobStatus.QUEUED.value, job["priority"], job["priority"], job["seq"])
+        ).fetchone()
+        return row[0]
+    
+    def estimate_wait(self, job: Dict) -> Optional[float]:
+        # Estimated seconds until the job finishes, based on recent job durations
+        if job["status"] not in (JobStatus.QUEUED.value, JobStatus.RUNNING.value):
+            return None
+        
+        row = self._execute(
+            """SELECT AVG(finished_at - started_at) FROM (
+                   SELECT started_at, finished_at FROM jobs
+                   WHERE status = ? ORDER BY seq DESC LIMIT 20
+               )""",
+            (JobStatus.DONE.value,)
+        ).fetchone()
+        average = row[0] if row[0] is not None else settings.generation_timeout_seconds
+        
+        if job["status"] == JobStatus.RUNNING.value:
+            return max(average - (time.time() - job["started_at"]), 0.0)
+        
+        position = self.get_queue_position(job)
+        rounds = position // max(settings.job_workers, 1) + 1
+        return rounds * average
+    
+    def cleanup_old_jobs(self) -> int:
+        # Remove finished jobs past the retention window
+        cutoff = time.time() - settings.job_retention_hours * 3600
+        cursor = self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (JobStatus.DONE.value, JobStatus.FAILED.value, cutoff)
+        )
+        return cursor.rowcount
+    
+    def _requeue_stale_jobs(self):
+        # Jobs still marked running can only belong to a dead worker once the longest deadline has passed
+        cutoff = time.time() - settings.max_generation_timeout_seconds - settings.job_poll_interval
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ? AND started_at < ?",
+            (JobStatus.QUEUED.value, JobStatus.RUNNING.value, cutoff)
+        )
+        if cursor.rowcount:
+            logger.warning("Requeued interrupted jobs", extra={"fields": {"jobs": cursor.rowcount}})
+    
+    def _claim_next(self) -> Optional[Dict]:
+        # Atomically move the next queued job to running, shortest stories first
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY priority, seq LIMIT 1",
+                    (JobStatus.QUEUED.value,)
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+                        (JobStatus.RUNNING.value, time.time(), row["id"])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return dict(row) if row else None
+    
+    def _finish(self, job_id: str, status: JobStatus, story: Optional[str] = None, error: Optional[str] = None):
+        self._execute(
+            "UPDATE jobs SET status = ?, story = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status.value, story, error, time.time(), job_id)
+        )
+    
+    async def _worker(self):
+        while True:
+            job = self._claim_next()
+            if job is None:
+                # Other processes may enqueue into the same file, so poll as well as wait
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.job_poll_interval)
+                except asyncio.TimeoutError:
+                    self._requeue_stale_jobs()
+                continue
+            
+            await self._run(job)
+    
+    def _requeue(self, job_id: str):
+        self._execute(
+            "UPDATE jobs SET status = ?, started_at = NULL WHERE id = ?",
+            (JobStatus.QUEUED.value, job_id)
+        )
+    
+    async def _run(self, job: Dict):
+        control = GenerationControl(settings.get_generation_timeout(job["timeout_seconds"]))
+        try:
+            params = StoryParams(**json.loads(job["params"]))
+            story = await story_service.generate(params, job["client_id"] or "jobs", control)
+            self._finish(job["id"], JobStatus.DONE, story=story)
+            metrics.increment("jobs_completed")
+            # The conversation gets its story even if the client never fetches the result
+            if job["session_id"]:
+                chat_service.set_story(job["session_id"], story)
+        
+        except QueueFullError:
+            # Interactive traffic has the queue full, try again later
+            self._requeue(job["id"])
+            await asyncio.sleep(settings.job_poll_interval)
+        
+        except asyncio.CancelledError:
+            # Worker shutting down, leave the job for the next start
+            control.cancel()
+            self._requeue(job["id"])
+            raise
+        
+        except Exception as e:
+            logger.exception("Job failed", extra={"fields": {"job_id": job["id"]}})
+            self._finish(job["id"], JobStatus.FAILED, error=str(e))
+            metrics.increment("jobs_failed")
+            if job["session_id"]:
+                # The session may generate again
+                chat_service.release_generation(job["session_id"], job["id"])
+
+# Global instance
+job_service = JobService(settings.job_db_path)
@@ -1,9 +1,86 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from transformers import AutoTokenizer, AutoModelForCausalLM, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+from transformers import TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+from transformers.generation.streamers import BaseStreamer
 import torch
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
 import os
+import threading
+import time
 from config.settings import settings
-from utils.validators import validate_story_output
+from core.logits_processors import IncrementalRepetitionPenaltyLogitsProcessor, IncrementalNoRepeatNGramLogitsProcessor
+from core.prompts import prompt_engine
+from core.story_text import FALLBACK_STORY, IncrementalDetokenizer, StoryText, StoryTextProcessor
+from models.schemas import StoryParams
+from services.model_store import model_store
+from services.generation_control import GenerationControl, GenerationCancelled
+from services.profile_service import profile_service, GenerationProfile
+from services.profiler import generation_profiler
+from utils.metrics import metrics
+from utils.validators import validate_story_stats
+from utils.log import StageTimer
+
+logger = logging.getLogger(__name__)
+
+class DeadlineStoppingCriteria(StoppingCriteria):
+    # Stops decoding once the request deadline passes or the request is cancelled
+    
+    def __init__(self, control: GenerationControl):
+        self.control = control
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        stop = self.control.should_stop()
+        return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+class StoryStreamer(BaseStreamer):
+    # Detokenizes and post-processes every story in the batch while it is decoded
+    
+    def __init__(self, tokenizer, batch_size: int, on_delta: Optional[Callable[[int, str], None]] = None):
+        self.eos_token_id = tokenizer.eos_token_id
+        # Also handed every raw text delta, e.g. to stream it to a client
+        self.on_delta = on_delta
+        self.detokenizers = [IncrementalDetokenizer(tokenizer) for _ in range(batch_size)]
+        self.processors = [StoryTextProcessor() for _ in range(batch_size)]
+        self._finished = [False] * batch_size
+        self.new_tokens = [0] * batch_size
+        # perf_counter() when the first new tokens arrived, i.e. when prefill ended
+        self.first_token_at: Optional[float] = None
+        self._prompt_seen = False
+    
+    def put(self, value: torch.Tensor):
+        # generate() passes the prompt first, then one new token per row on every step
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        
+        for row, token in enumerate(value.reshape(-1).tolist()):
+            if self._finished[row]:
+                continue
+            # Rows that reached EOS only receive padding from here on
+            if token == self.eos_token_id:
+                self._finished[row] = True
+                continue
+            self.new_tokens[row] += 1
+            delta = self.detokenizers[row].push(token)
+            if delta:
+                self._feed(row, delta)
+    
+    def end(self):
+        for row, detokenizer in enumerate(self.detokenizers):
+            delta = detokenizer.flush()
+            if delta:
+                self._feed(row, delta)
+    
+    def _feed(self, row: int, delta: str):
+        self.processors[row].feed(delta)
+        if self.on_delta is not None:
+            self.on_delta(row, delta)
+    
+    def results(self) -> List[StoryText]:
+        return [processor.finish() for processor in self.processors]
 
 class LLMService:
     # LLM service for story generation
@@ -11,55 +88,110 @@ class LLMService:
     def __init__(self):
         self.model = None
         self.tokenizer = None
-        self.pipeline = None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self._loaded = False
         self._model_name = settings.model_name
+        # Where the weights came from ("store", "local" or "hub") and how long loading took
+        self._model_source: Optional[str] = None
+        self._load_stages: Dict[str, float] = {}
+        # (path, source, local_files_only) once resolved, so a pinned model is verified only once
+        self._resolved: Optional[Tuple[str, str, bool]] = None
+        self._lock = threading.Lock()
+        # Token and attention-mask buffers of the direct decode loop, one pair per worker thread
+        self._buffers = threading.local()
+    
+    def _resolve_model_path(self, model_path: str, timer: StageTimer) -> Tuple[str, str, bool]:
+        if self._resolved is None:
+            self._resolved = self._locate_model(model_path, timer)
+        return self._resolved
+    
+    def _locate_model(self, model_path: str, timer: StageTimer) -> Tuple[str, str, bool]:
+        # Pinned models load from the store, verified and without touching the network
+        if model_store.has(model_path):
+            path = model_store.resolve(model_path, verify=settings.model_store_verify)
+            timer.mark("verify")
+            return path, "store", True
+        if os.path.isdir(model_path):
+            return model_path, "local", True
+        if settings.model_offline:
+            # Only whatever is already in the Hugging Face cache
+            return model_path, "hub", True
+        return model_path, "hub", False
+    
+    def load_tokenizer(self):
+        # Load only the fast tokenizer and the pre-tokenized prompts, e.g. ahead of the model at startup
+        with self._lock:
+            if self.tokenizer is not None:
+                return
+            timer = StageTimer()
+            path, source, local_only = self._resolve_model_path(settings.get_model_path(), timer)
+            self._load_tokenizer(path, local_only, timer)
+            self._model_source = source
+            self._load_stages.update(timer.stages)
+    
+    def _load_tokenizer(self, path: str, local_only: bool, timer: StageTimer):
+        self.tokenizer = AutoTokenizer.from_pretrained(path, use_fast=True, local_files_only=local_only)
+        timer.mark("tokenizer")
+        
+        # Set pad token if not exists
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
         
+        # Pre-tokenize the static prompt templates
+        prompt_engine.compile(self.tokenizer)
+        timer.mark("prompt_templates")
+    
     def load_model(self):
         # Load the language model
         if self._loaded:
-            print("Model already loaded")
+            logger.debug("Model already loaded")
             return
         
-        try:
-            model_path = settings.get_model_path()
-            print(f"Loading model from: {model_path}")
-            print(f"Device: {self.device}")
-            
-            # Load tokenizer
-            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-            
-            # Set pad token if not exists
-            if self.tokenizer.pad_token is None:
-                self.tokenizer.pad_token = self.tokenizer.eos_token
+        with self._lock:
+            if self._loaded:
+                return
             
-            # Load model
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                low_cpu_mem_usage=True
-            )
-            
-            # Move to device
-            self.model.to(self.device)
-            self.model.eval()
-            
-            # Create pipeline
-            self.pipeline = pipeline(
-                "text-generation",
-                model=self.model,
-                tokenizer=self.tokenizer,
-                device=0 if self.device == "cuda" else -1
-            )
-            
-            self._loaded = True
-            self._model_name = model_path
-            print("Model loaded successfully!")
-            
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            raise
+            timer = StageTimer()
+            model_path = settings.get_model_path()
+            try:
+                logger.info("Loading model", extra={"fields": {"model": model_path, "device": self.device}})
+                
+                path, source, local_only = self._resolve_model_path(model_path, timer)
+                if self.tokenizer is None:
+                    self._load_tokenizer(path, local_only, timer)
+                
+                # Load model
+                self.model = AutoModelForCausalLM.from_pretrained(
+                    path,
+                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
+                    low_cpu_mem_usage=True,
+                    local_files_only=local_only
+                )
+                
+                # Move to device
+                self.model.to(self.device)
+                self.model.eval()
+                timer.mark("model")
+                
+                self._load_stages.update(timer.stages)
+                self._model_source = source
+                self._loaded = True
+                self._model_name = model_path
+                logger.info("Model loaded", extra={"fields": {
+                    "model": model_path, "source": source, "stages_ms": self._load_stages
+                }})
+                
+            except Exception:
+                logger.exception("Error loading model", extra={"fields": {"model": model_path}})
+                raise
+    
+    def get_load_stats(self) -> Dict:
+        # Cold-start cost: per-stage load times and their total
+        return {
+            "model_source": self._model_source,
+            "cold_start_ms": round(sum(self._load_stages.values()), 2) if self._loaded else None,
+            "load_stages_ms": dict(self._load_stages) or None
+        }
     
     def is_loaded(self) -> bool:
         return self._loaded
@@ -67,97 +199,253 @@ class LLMService:
     def get_model_name(self) -> str:
         return self._model_name
     
-    async def generate_story(self, prompt: str) -> str:
+    async def generate_story(self, params: StoryParams, control: Optional[GenerationControl] = None) -> str:
+        # Run the blocking decode loop in a worker thread so the event loop stays free
+        if control is None:
+            control = GenerationControl(settings.get_generation_timeout())
+        return await asyncio.to_thread(self.generate_story_sync, params, control)
+    
+    def generate_story_sync(self, params: StoryParams, control: GenerationControl) -> str:
+        return self.generate_stories_sync([params], control)[0]
+    
+    def generate_stories_sync(
+        self, params_list: List[StoryParams], control: GenerationControl, on_delta: Optional[Callable[[int, str], None]] = None
+    ) -> List[str]:
+        # Generate several stories in one batched decode; they share the first story's profile
         if not self._loaded:
             self.load_model()
         
+        profile = profile_service.select(params_list[0])
+        # Only profiled while an admin capture window is open
+        with generation_profiler.capture(f"{profile.name} x{len(params_list)}"):
+            return self._generate_stories(params_list, control, on_delta, profile)
+    
+    def _generate_stories(
+        self, params_list: List[StoryParams], control: GenerationControl, on_delta: Optional[Callable[[int, str], None]], profile: GenerationProfile
+    ) -> List[str]:
+        count = len(params_list)
+        metrics.increment("generations_started", count)
+        timer = StageTimer()
+        log_fields = {"model": self._model_name, "profile": profile.name, "batch_size": count, "stages_ms": timer.stages}
+        
+        # Request may have been cancelled while waiting for a worker
+        if control.is_cancelled():
+            metrics.increment("generations_cancelled", count)
+            raise GenerationCancelled()
+        
         try:
-            # Generate text
-            outputs = self.pipeline(
-                prompt,
-                max_length=settings.max_length,
-                temperature=settings.temperature,
-                top_p=settings.top_p,
-                top_k=settings.top_k,
-                do_sample=True,
-                num_return_sequences=1,
-                pad_token_id=self.tokenizer.eos_token_id,
-                eos_token_id=self.tokenizer.eos_token_id,
-                repetition_penalty=1.2,
-                no_repeat_ngram_size=3
-            )
-            
-            # Extract generated text
-            generated_text = outputs[0]['generated_text']
+            # Prompt ids from the pre-tokenized templates
+            input_ids, attention_mask = self._encode_batch(params_list)
+            streamer = StoryStreamer(self.tokenizer, count, on_delta)
+            timer.mark("tokenize")
             
-            # Remove the prompt from output
-            story = generated_text[len(prompt):].strip()
+            if profile.threads and torch.get_num_threads() != profile.threads:
+                # Process-wide; with more than one concurrent generation the last profile wins
+                torch.set_num_threads(profile.threads)
             
-            # Post-process the story
-            story = self._post_process_story(story)
-            
-            # Validate output
-            is_valid, error = validate_story_output(
-                story, 
-                settings.min_story_length, 
-                settings.max_story_length
+            # Stories are post-processed token by token as they are generated
+            with torch.inference_mode():
+                if settings.decode_loop == "generate":
+                    self.model.generate(
+                        input_ids=input_ids,
+                        attention_mask=attention_mask,
+                        max_new_tokens=profile.max_new_tokens,
+                        pad_token_id=self.tokenizer.pad_token_id,
+                        eos_token_id=self.tokenizer.eos_token_id,
+                        logits_processor=self._repetition_processors(profile),
+                        stopping_criteria=StoppingCriteriaList([DeadlineStoppingCriteria(control)]),
+                        streamer=streamer,
+                        **self._decoding_kwargs(profile)
+                    )
+                else:
+                    self._decode(input_ids, attention_mask, profile, control, streamer)
+            # Prefill ends with the first new token, decoding takes the rest
+            timer.mark("prefill", at=streamer.first_token_at)
+            timer.mark("decode")
+        except Exception:
+            logger.exception("Error generating story", extra={"fields": log_fields})
+            metrics.increment("generations_failed", count)
+            profile_service.record_failure(profile, count)
+            control.rejected = list(range(count))
+            return [self._get_fallback_story() for _ in params_list]
+        
+        if control.is_cancelled():
+            metrics.increment("generations_cancelled", count)
+            raise GenerationCancelled()
+        
+        if control.timed_out:
+            metrics.increment("generations_timed_out", count)
+        
+        generate_ms = timer.stages["prefill"] + timer.stages["decode"]
+        stories = []
+        for row, (result, new_tokens) in enumerate(zip(streamer.results(), streamer.new_tokens)):
+            story, accepted = self._finish_story(result, control, log_fields)
+            profile_service.record(profile, generate_ms, new_tokens, accepted, control.timed_out)
+            if not accepted:
+                control.rejected.append(row)
+            stories.append(story)
+        timer.mark("post_process")
+        generation_profiler.record_stages(timer.stages)
+        
+        metrics.increment("generations_completed", count)
+        logger.info("Story generated", extra={"fields": {**log_fields, "timed_out": control.timed_out}})
+        return stories
+    
+    def _decode(
+        self, input_ids: torch.Tensor, attention_mask: torch.Tensor, profile: GenerationProfile, control: GenerationControl, streamer: StoryStreamer
+    ):
+        # The greedy/sampling loop of model.generate without its per-call setup: prompt and new
+        # tokens go into reused buffers instead of being concatenated every step, and only the
+        # newest token is fed to the model once the prompt is in the KV cache. Caller holds
+        # torch.inference_mode().
+        batch_size, prompt_length = input_ids.shape
+        ids, mask = self._decode_buffers(batch_size, prompt_length + profile.max_new_tokens)
+        ids[:, :prompt_length] = input_ids
+        mask[:, :prompt_length] = attention_mask
+        mask[:, prompt_length:] = 1
+        
+        processors = self._repetition_processors(profile)
+        processors.extend(self._sampling_warpers(profile))
+        do_sample = profile.decoding.strategy != "greedy"
+        pad_token_id, eos_token_id = self.tokenizer.pad_token_id, self.tokenizer.eos_token_id
+        # Left padding: positions count real tokens only, as in generate()
+        positions = (attention_mask.cumsum(-1) - 1).clamp_(min=0)
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=input_ids.device)
+        
+        streamer.put(input_ids)
+        step_ids, past_key_values, length = input_ids, None, prompt_length
+        for _ in range(profile.max_new_tokens):
+            outputs = self.model(
+                input_ids=step_ids,
+                attention_mask=mask[:, :length],
+                position_ids=positions,
+                past_key_values=past_key_values,
+                use_cache=True
             )
+            past_key_values = outputs.past_key_values
+            scores = processors(ids[:, :length], outputs.logits[:, -1, :].float())
+            if do_sample:
+                next_tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            else:
+                next_tokens = torch.argmax(scores, dim=-1)
+            # Rows that already produced EOS only get padding
+            next_tokens.masked_fill_(finished, pad_token_id)
+            ids[:, length] = next_tokens
+            length += 1
+            streamer.put(next_tokens)
             
-            if not is_valid:
-                print(f"Generated story validation failed: {error}")
-                # Return a fallback story
-                story = self._get_fallback_story()
-            
-            return story
-            
-        except Exception as e:
-            print(f"Error generating story: {e}")
-            return self._get_fallback_story()
-    
-    def _post_process_story(self, text: str) -> str:
-        if not text:
-            return ""
-        
-        # Remove incomplete sentences at the end
-        if text and not text[-1] in ['.', '!', '?']:
-            # Find last complete sentence
-            last_punct = max(
-                text.rfind('.'),
-                text.rfind('!'),
-                text.rfind('?')
+            finished |= next_tokens == eos_token_id
+            if bool(finished.all()) or control.should_stop():
+                break
+            step_ids = ids[:, length - 1:length]
+            positions = positions[:, -1:] + 1
+        streamer.end()
+    
+    def _decode_buffers(self, batch_size: int, width: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        # Views into this thread's buffers, which only ever grow
+        buffers = getattr(self._buffers, "tensors", None)
+        if buffers is None or buffers[0].shape[0] < batch_size or buffers[0].shape[1] < width:
+            rows = max(batch_size, buffers[0].shape[0] if buffers else 0)
+            columns = max(width, buffers[0].shape[1] if buffers else 0)
+            buffers = self._buffers.tensors = (
+                torch.empty((rows, columns), dtype=torch.long, device=self.device),
+                torch.empty((rows, columns), dtype=torch.long, device=self.device)
             )
-            if last_punct > 0:
-                text = text[:last_punct + 1]
+        return buffers[0][:batch_size, :width], buffers[1][:batch_size, :width]
+    
+    def _decoding_kwargs(self, profile: GenerationProfile) -> Dict:
+        decoding = profile.decoding
+        if decoding.strategy == "greedy":
+            return {"do_sample": False}
+        return {
+            "do_sample": True,
+            "temperature": decoding.temperature,
+            "top_p": decoding.top_p,
+            "top_k": decoding.top_k
+        }
+    
+    def _repetition_processors(self, profile: GenerationProfile) -> LogitsProcessorList:
+        # Incremental equivalents of repetition_penalty and no_repeat_ngram_size; they hold
+        # per-sequence state, so every generate call gets new instances
+        decoding = profile.decoding
+        processors = LogitsProcessorList()
+        if decoding.repetition_penalty != 1.0:
+            processors.append(IncrementalRepetitionPenaltyLogitsProcessor(decoding.repetition_penalty))
+        if decoding.no_repeat_ngram_size > 0:
+            processors.append(IncrementalNoRepeatNGramLogitsProcessor(decoding.no_repeat_ngram_size))
+        return processors
+    
+    def _sampling_warpers(self, profile: GenerationProfile) -> LogitsProcessorList:
+        # What _decoding_kwargs makes generate() apply, in generate()'s order
+        decoding = profile.decoding
+        warpers = LogitsProcessorList()
+        if decoding.strategy == "greedy":
+            return warpers
+        if decoding.temperature != 1.0:
+            warpers.append(TemperatureLogitsWarper(decoding.temperature))
+        if decoding.top_k > 0:
+            warpers.append(TopKLogitsWarper(decoding.top_k))
+        if decoding.top_p < 1.0:
+            warpers.append(TopPLogitsWarper(decoding.top_p))
+        return warpers
+    
+    def _encode_batch(self, params_list: List[StoryParams]) -> Tuple[torch.Tensor, torch.Tensor]:
+        prompts = [prompt_engine.encode(params.dict()) for params in params_list]
+        width = max(len(ids) for ids in prompts)
+        
+        # Left padding keeps every prompt directly in front of its generated tokens
+        input_ids = torch.full((len(prompts), width), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(prompts), width), dtype=torch.long)
+        for row, ids in enumerate(prompts):
+            input_ids[row, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, width - len(ids):] = 1
+        
+        return input_ids.to(self.device), attention_mask.to(self.device)
+    
+    def _finish_story(self, result: StoryText, control: GenerationControl, log_fields: Dict) -> Tuple[str, bool]:
+        # Returns the story and whether the generated text was accepted
+        story = result.text
         
-        # Clean up extra whitespace
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
-        text = '\n\n'.join(lines)
+        if control.timed_out:
+            # Keep the partial story only if enough sentences were produced
+            if result.sentences < settings.min_partial_sentences:
+                logger.warning("Generation deadline reached before enough sentences were produced", extra={"fields": log_fields})
+                return self._get_fallback_story(), False
         
-        # Ensure proper spacing after punctuation
-        import re
-        text = re.sub(r'([.!?])([A-Z])', r'\1 \2', text)
+        # Validate output
+        is_valid, error = validate_story_stats(
+            len(story),
+            result.sentences,
+            result.blocked,
+            settings.min_story_length, 
+            settings.max_story_length
+        )
         
-        return text.strip()
+        if not is_valid:
+            logger.warning("Generated story validation failed", extra={"fields": {**log_fields, "error": error}})
+            # Return a fallback story
+            return self._get_fallback_story(), False
+        
+        return story, True
     
     def _get_fallback_story(self) -> str:
         # Return a fallback story if generation fails
-        return """# Little Hero
-
-Once upon a time, there lived a brave boy in a small town. Every day, he sought new adventures and played fun games with his friends.
-One day, he found a little cat lost in the town park. The cat was very sad and scared. The boy decided to help the cat.
-He searched all day for the cat's owner. He knocked on every door, asking everyone. Finally, he found a family who missed the cat very much.
-The family was overjoyed and thanked the boy. The boy learned how beautiful it was to help.
-From that day on, he always tried to help others. And so, he became the little hero."""
+        return FALLBACK_STORY
     
     def unload_model(self):
         # Unload model from memory
-        if self._loaded:
-            del self.model
-            del self.tokenizer
-            del self.pipeline
+        with self._lock:
+            if not self._loaded:
+                return
+            self.model = None
+            self.tokenizer = None
+            # Compiled against the old tokenizer; load_model compiles them again
+            prompt_engine.reset()
             torch.cuda.empty_cache()
             self._loaded = False
-            print("Model unloaded")
+            self._load_stages = {}
+            self._resolved = None
+            logger.info("Model unloaded")
 
 # Global instance
 llm_service = LLMService()
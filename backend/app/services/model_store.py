@@ -0,0 +1,137 @@
+from typing import Dict, Optional
+from datetime import datetime
+from config.settings import settings
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Store layout:
+#   blobs/sha256/<digest>     file contents, named by their checksum
+#   manifests/<model>.json    relative file path -> digest for one pinned model
+#   snapshots/<id>/           the manifest's files hard-linked back into a model directory
+
+class ModelStoreError(Exception):
+    # Raised when a pinned model is missing or fails verification
+    pass
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ModelStore:
+    # Content-addressed store of pinned model and tokenizer files
+    
+    def __init__(self, root: str):
+        self.root = root
+    
+    def _manifest_path(self, name: str) -> str:
+        # Hub ids contain a slash ("org/model")
+        return os.path.join(self.root, "manifests", name.replace("/", "--") + ".json")
+    
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", "sha256", digest)
+    
+    def has(self, name: str) -> bool:
+        return os.path.exists(self._manifest_path(name))
+    
+    def get_manifest(self, name: str) -> Dict:
+        path = self._manifest_path(name)
+        if not os.path.exists(path):
+            raise ModelStoreError(f"Model {name} is not pinned in {self.root}")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    
+    def pin(self, name: str, source_dir: str, source: Optional[str] = None) -> Dict:
+        # Copy every file of source_dir into the store and record them in the model's manifest
+        files = {}
+        for directory, _, filenames in os.walk(source_dir):
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                relative = os.path.relpath(path, source_dir).replace(os.sep, "/")
+                files[relative] = self._add_blob(path)
+        
+        if not files:
+            raise ModelStoreError(f"No files to pin in {source_dir}")
+        
+        manifest = {
+            "name": name,
+            "source": source or name,
+            "pinned_at": datetime.now().isoformat(),
+            "files": dict(sorted(files.items()))
+        }
+        self._write_atomic(self._manifest_path(name), json.dumps(manifest, indent=2).encode("utf-8"))
+        logger.info("Model pinned", extra={"fields": {"model": name, "files": len(files)}})
+        return manifest
+    
+    def _add_blob(self, path: str) -> str:
+        digest = file_sha256(path)
+        blob = self._blob_path(digest)
+        # An existing blob is rewritten if it no longer matches its name
+        if not os.path.exists(blob) or file_sha256(blob) != digest:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(blob))
+            os.close(fd)
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, blob)
+        return digest
+    
+    def _write_atomic(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    
+    def verify(self, name: str) -> Dict:
+        # Re-hash every blob of the model against its manifest
+        manifest = self.get_manifest(name)
+        for relative, digest in manifest["files"].items():
+            blob = self._blob_path(digest)
+            if not os.path.exists(blob):
+                raise ModelStoreError(f"Missing blob for {name}/{relative}")
+            actual = file_sha256(blob)
+            if actual != digest:
+                raise ModelStoreError(f"Checksum mismatch for {name}/{relative}: expected {digest}, got {actual}")
+        return manifest
+    
+    def resolve(self, name: str, verify: bool = True) -> str:
+        # Directory with the model's pinned files, ready for from_pretrained(local_files_only=True)
+        manifest = self.verify(name) if verify else self.get_manifest(name)
+        files = manifest["files"]
+        
+        # Same files, same snapshot: the id is the hash of the file list
+        snapshot_id = hashlib.sha256(json.dumps(files, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        snapshot = os.path.join(self.root, "snapshots", snapshot_id)
+        
+        for relative, digest in files.items():
+            blob = self._blob_path(digest)
+            if not os.path.exists(blob):
+                raise ModelStoreError(f"Missing blob for {name}/{relative}")
+            target = os.path.join(snapshot, *relative.split("/"))
+            if os.path.exists(target):
+                # A link to the (verified) blob, or a copy that still matches it
+                if os.path.samefile(target, blob) or (verify and file_sha256(target) == digest):
+                    continue
+                os.remove(target)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(blob, target)
+            except FileExistsError:
+                # Another worker materialized it first
+                continue
+            except OSError:
+                # Filesystems without hard links get a copy
+                shutil.copyfile(blob, target)
+        
+        return snapshot
+
+# Global instance
+model_store = ModelStore(settings.model_store_path)
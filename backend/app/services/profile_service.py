@@ -0,0 +1,229 @@
+from typing import Deque, Dict, List, Optional
+from collections import deque
+from pydantic import BaseModel, Field, field_validator, model_validator
+from config.settings import settings
+from models.schemas import StoryParams
+from services.scheduler import LENGTH_PRIORITIES
+from utils.validators import VALID_AGE_GROUPS, VALID_LENGTHS
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DECODING_STRATEGIES = ("sample", "greedy")
+
+class DecodingConfig(BaseModel):
+    # Decoding strategy; unset values fall back to the global settings
+    strategy: str = "sample"
+    temperature: float = Field(default_factory=lambda: settings.temperature, gt=0)
+    top_p: float = Field(default_factory=lambda: settings.top_p, gt=0, le=1)
+    top_k: int = Field(default_factory=lambda: settings.top_k, ge=0)
+    repetition_penalty: float = Field(default_factory=lambda: settings.repetition_penalty, gt=0)
+    no_repeat_ngram_size: int = Field(default_factory=lambda: settings.no_repeat_ngram_size, ge=0)
+    
+    @field_validator("strategy")
+    @classmethod
+    def check_strategy(cls, value: str) -> str:
+        if value not in DECODING_STRATEGIES:
+            raise ValueError(f"strategy must be one of {', '.join(DECODING_STRATEGIES)}")
+        return value
+
+class GenerationProfile(BaseModel):
+    # Decoding settings and budgets for one class of stories
+    name: str = Field(min_length=1)
+    # Empty lists match every age group / length
+    age_groups: List[str] = []
+    lengths: List[str] = []
+    decoding: DecodingConfig = Field(default_factory=DecodingConfig)
+    max_new_tokens: int = Field(gt=0)
+    # Torch intra-op threads while this profile decodes, None keeps the current setting
+    threads: Optional[int] = Field(default=None, gt=0)
+    # Scheduler class; also only stories with the same profile share a batch
+    batch_class: str = "medium"
+    
+    @field_validator("age_groups")
+    @classmethod
+    def check_age_groups(cls, value: List[str]) -> List[str]:
+        unknown = set(value) - set(VALID_AGE_GROUPS)
+        if unknown:
+            raise ValueError(f"unknown age groups: {', '.join(sorted(unknown))}")
+        return value
+    
+    @field_validator("lengths")
+    @classmethod
+    def check_lengths(cls, value: List[str]) -> List[str]:
+        unknown = set(value) - set(VALID_LENGTHS)
+        if unknown:
+            raise ValueError(f"unknown lengths: {', '.join(sorted(unknown))}")
+        return value
+    
+    @field_validator("max_new_tokens")
+    @classmethod
+    def check_max_new_tokens(cls, value: int) -> int:
+        if value > settings.max_length:
+            raise ValueError(f"max_new_tokens can be at most {settings.max_length} (MAX_LENGTH)")
+        return value
+    
+    @field_validator("batch_class")
+    @classmethod
+    def check_batch_class(cls, value: str) -> str:
+        if value not in LENGTH_PRIORITIES:
+            raise ValueError(f"batch_class must be one of {', '.join(LENGTH_PRIORITIES)}")
+        return value
+    
+    def matches(self, params: StoryParams) -> bool:
+        return (
+            (not self.age_groups or params.age_group in self.age_groups)
+            and (not self.lengths or params.length in self.lengths)
+        )
+
+class ProfileConfig(BaseModel):
+    # Profiles are tried in order, the first match wins
+    profiles: List[GenerationProfile] = Field(min_length=1)
+    
+    @model_validator(mode="after")
+    def check_profiles(self) -> "ProfileConfig":
+        names = [profile.name for profile in self.profiles]
+        duplicates = {name for name in names if names.count(name) > 1}
+        if duplicates:
+            raise ValueError(f"duplicate profile names: {', '.join(sorted(duplicates))}")
+        
+        # Every valid request must get a profile
+        for age_group in VALID_AGE_GROUPS:
+            for length in VALID_LENGTHS:
+                if not any(
+                    (not p.age_groups or age_group in p.age_groups) and (not p.lengths or length in p.lengths)
+                    for p in self.profiles
+                ):
+                    raise ValueError(f"no profile matches age group {age_group} with length {length}")
+        return self
+
+class ProfileStats:
+    # Latency and acceptance counters for one profile
+    
+    def __init__(self, window: int = 1000):
+        self.stories = 0
+        self.accepted = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.tokens = 0
+        self._latencies: Deque[float] = deque(maxlen=window)
+    
+    def record(self, latency_ms: float, new_tokens: int, accepted: bool, timed_out: bool):
+        self.stories += 1
+        self.accepted += int(accepted)
+        self.timed_out += int(timed_out)
+        self.tokens += new_tokens
+        self._latencies.append(round(latency_ms, 2))
+    
+    def record_failure(self, count: int):
+        self.stories += count
+        self.failed += count
+    
+    def snapshot(self) -> Dict:
+        latencies = sorted(self._latencies)
+        return {
+            "stories": self.stories,
+            "accepted": self.accepted,
+            "acceptance_rate": round(self.accepted / self.stories, 4) if self.stories else None,
+            "timed_out": self.timed_out,
+            "failed": self.failed,
+            "avg_new_tokens": round(self.tokens / self.stories, 1) if self.stories else None,
+            "latency_ms_p50": _percentile(latencies, 0.5),
+            "latency_ms_p95": _percentile(latencies, 0.95),
+            "latency_ms_max": latencies[-1] if latencies else None
+        }
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class ProfileService:
+    # Generation profiles loaded from a JSON file, reloaded when the file changes
+    
+    def __init__(self, path: str, reload_interval: float):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._config: Optional[ProfileConfig] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ProfileStats] = {}
+    
+    def load(self):
+        # Load and validate the profile file; raises on a missing or invalid file
+        with self._lock:
+            self._load()
+    
+    def _load(self):
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            config = ProfileConfig(**json.load(f))
+        
+        self._config = config
+        self._mtime = mtime
+        self._checked_at = time.monotonic()
+        logger.info("Generation profiles loaded", extra={"fields": {
+            "path": self.path, "profiles": [profile.name for profile in config.profiles]
+        }})
+    
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self._config is not None and now - self._checked_at < self.reload_interval:
+            return
+        
+        with self._lock:
+            if self._config is None:
+                self._load()
+                return
+            if now - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = now
+            
+            try:
+                if os.path.getmtime(self.path) == self._mtime:
+                    return
+                self._load()
+            except Exception:
+                # Keep serving the last good profiles
+                logger.exception("Invalid generation profiles, keeping the previous ones", extra={"fields": {"path": self.path}})
+    
+    def get_profiles(self) -> List[GenerationProfile]:
+        self._maybe_reload()
+        return self._config.profiles
+    
+    def select(self, params: StoryParams) -> GenerationProfile:
+        for profile in self.get_profiles():
+            if profile.matches(params):
+                return profile
+        # Unreachable for validated params, the config covers every combination
+        raise ValueError(f"No generation profile for {params.age_group}/{params.length}")
+    
+    def record(self, profile: GenerationProfile, latency_ms: float, new_tokens: int, accepted: bool, timed_out: bool):
+        with self._lock:
+            self._stats.setdefault(profile.name, ProfileStats()).record(latency_ms, new_tokens, accepted, timed_out)
+    
+    def record_failure(self, profile: GenerationProfile, count: int):
+        with self._lock:
+            self._stats.setdefault(profile.name, ProfileStats()).record_failure(count)
+    
+    def stats(self) -> Dict:
+        profiles = self.get_profiles()
+        with self._lock:
+            return {
+                "path": self.path,
+                "profiles": [
+                    {
+                        **profile.dict(),
+                        "stats": self._stats.get(profile.name, ProfileStats()).snapshot()
+                    }
+                    for profile in profiles
+                ]
+            }
+
+# Global instance
+profile_service = ProfileService(settings.generation_profiles_path, settings.generation_profiles_reload_interval)
@@ -0,0 +1,265 @@
+from typing import Dict, List, Optional, Tuple
+from collections import deque
+from contextlib import contextmanager
+from config.settings import settings
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Stage timings kept per stage for the percentiles in status()
+STAGE_WINDOW = 512
+MODES = ("cpu", "torch")
+
+class ProfilerBusy(Exception):
+    # Raised when a capture window is already open
+    pass
+
+class _StackSampler(threading.Thread):
+    # Samples one thread's Python stack at a fixed interval and writes it as a speedscope
+    # sampled profile; the generating thread itself is never touched
+    
+    def __init__(self, thread_id: int, interval: float, max_seconds: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.frames: List[Dict] = []
+        self._frame_ids: Dict[Tuple[str, str, int], int] = {}
+        self.samples: List[List[int]] = []
+        self.weights: List[float] = []
+        self._stopped = threading.Event()
+    
+    def run(self):
+        started = last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or now - started > self.max_seconds:
+                return
+            
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                frame_id = self._frame_ids.get(key)
+                if frame_id is None:
+                    frame_id = self._frame_ids[key] = len(self.frames)
+                    self.frames.append({"name": key[0], "file": key[1], "line": key[2]})
+                stack.append(frame_id)
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+            self.weights.append(round((now - last) * 1000, 3))
+            last = now
+    
+    def start_capture(self):
+        self.start()
+    
+    def stop_capture(self):
+        self._stopped.set()
+        self.join()
+    
+    def save(self, path: str, name: str):
+        total = round(sum(self.weights), 3)
+        document = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "story-generator",
+            "shared": {"frames": self.frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": self.samples,
+                "weights": self.weights
+            }]
+        }
+        with open(path, "w") as f:
+            json.dump(document, f, separators=(",", ":"))
+
+class _TorchTrace:
+    # torch.profiler over one generation, exported as a Chrome trace
+    
+    def __init__(self):
+        import torch
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._profile = torch.profiler.profile(activities=activities, record_shapes=False, with_stack=False)
+    
+    def start_capture(self):
+        self._profile.__enter__()
+    
+    def stop_capture(self):
+        self._profile.__exit__(None, None, None)
+    
+    def save(self, path: str, name: str):
+        self._profile.export_chrome_trace(path)
+
+class GenerationProfiler:
+    # Aggregates the per-stage timers of every generation, and on request profiles the
+    # next N generations into settings.profile_output_dir. A capture window closes after
+    # N generations or profile_window_seconds, whichever comes first; each capture stops
+    # after profile_max_seconds, and only the newest profile_keep_files files are kept.
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, deque] = {}
+        self._window: Optional[Dict] = None
+        self._torch_busy = False
+        self._sequence = 0
+    
+    def record_stages(self, stages: Dict[str, float]):
+        # Called once per generation; deque appends need no lock
+        for stage, ms in stages.items():
+            window = self._stages.get(stage)
+            if window is None:
+                window = self._stages.setdefault(stage, deque(maxlen=STAGE_WINDOW))
+            window.append(ms)
+    
+    def stage_stats(self) -> Dict[str, Dict[str, float]]:
+        stats = {}
+        for stage, window in list(self._stages.items()):
+            values = sorted(window)
+            if not values:
+                continue
+            stats[stage] = {
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values), 2),
+                "p50_ms": values[len(values) // 2],
+                "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))],
+                "max_ms": values[-1]
+            }
+        return stats
+    
+    def _open_window(self) -> Optional[Dict]:
+        # Caller holds the lock
+        window = self._window
+        if window and ((window["remaining"] <= 0 and not window["running"]) or time.time() > window["expires_at"]):
+            window["active"] = False
+        return window if window and window["active"] else None
+    
+    def start(self, mode: str, generations: int, interval_ms: float) -> Dict:
+        if mode not in MODES:
+            raise ValueError(f"Profile mode must be one of {', '.join(MODES)}")
+        if not 1 <= generations <= settings.profile_max_generations:
+            raise ValueError(f"Up to {settings.profile_max_generations} generations can be profiled at once")
+        
+        with self._lock:
+            if self._open_window():
+                raise ProfilerBusy("A profile capture is already running")
+            self._window = {
+                "active": True,
+                "mode": mode,
+                "interval_ms": interval_ms,
+                "requested": generations,
+                "remaining": generations,
+                "running": 0,
+                "started_at": time.time(),
+                "expires_at": time.time() + settings.profile_window_seconds,
+                "files": []
+            }
+        logger.info("Profile capture started", extra={"fields": {"mode": mode, "generations": generations}})
+        return self.status()
+    
+    def stop(self) -> Dict:
+        # Close the window; captures already running finish and are written
+        with self._lock:
+            if self._window:
+                self._window["active"] = False
+        return self.status()
+    
+    def status(self) -> Dict:
+        with self._lock:
+            self._open_window()
+            window = dict(self._window, files=list(self._window["files"])) if self._window else None
+        return {"capture": window, "output_dir": settings.profile_output_dir, "stages": self.stage_stats()}
+    
+    def _claim(self) -> Optional[Dict]:
+        with self._lock:
+            window = self._open_window()
+            if not window or window["remaining"] <= 0:
+                return None
+            if window["mode"] == "torch":
+                # torch.profiler is process-wide, concurrent generations wait for the next slot
+                if self._torch_busy:
+                    return None
+                self._torch_busy = True
+            window["remaining"] -= 1
+            window["running"] += 1
+            self._sequence += 1
+            return dict(window, sequence=self._sequence)
+    
+    def _release(self, claim: Dict, path: Optional[str]):
+        with self._lock:
+            window = self._window
+            if claim["mode"] == "torch":
+                self._torch_busy = False
+            if window and window["started_at"] == claim["started_at"]:
+                window["running"] -= 1
+                if path:
+                    window["files"].append(os.path.basename(path))
+    
+    @contextmanager
+    def capture(self, label: str):
+        # Profiles the enclosed generation when a capture window has a slot left
+        claim = self._claim() if self._window is not None and self._window["active"] else None
+        if claim is None:
+            yield
+            return
+        
+        recorder = None
+        try:
+            if claim["mode"] == "torch":
+                recorder = _TorchTrace()
+            else:
+                recorder = _StackSampler(threading.get_ident(), claim["interval_ms"] / 1000, settings.profile_max_seconds)
+            recorder.start_capture()
+        except Exception:
+            logger.exception("Could not start profile capture")
+            recorder = None
+        
+        try:
+            yield
+        finally:
+            path = self._save(recorder, claim, label) if recorder else None
+            self._release(claim, path)
+    
+    def _save(self, recorder, claim: Dict, label: str) -> Optional[str]:
+        try:
+            recorder.stop_capture()
+            os.makedirs(settings.profile_output_dir, exist_ok=True)
+            suffix = "trace.json" if claim["mode"] == "torch" else "speedscope.json"
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{claim['sequence']:04d}-{claim['mode']}.{suffix}"
+            path = os.path.join(settings.profile_output_dir, name)
+            recorder.save(path, label)
+            self._prune()
+            logger.info("Profile written", extra={"fields": {"path": path}})
+            return path
+        except Exception:
+            logger.exception("Could not write profile")
+            return None
+    
+    def _prune(self):
+        directory = settings.profile_output_dir
+        files = sorted(name for name in os.listdir(directory) if name.endswith((".speedscope.json", ".trace.json")))
+        for name in files[:-settings.profile_keep_files]:
+            os.remove(os.path.join(directory, name))
+    
+    def file_path(self, name: str) -> Optional[str]:
+        # A profile written to the output directory, never anything outside it
+        if os.path.basename(name) != name or not name.endswith((".speedscope.json", ".trace.json")):
+            return None
+        path = os.path.join(settings.profile_output_dir, name)
+        return path if os.path.isfile(path) else None
+
+
+# Global instance
+generation_profiler = GenerationProfiler()
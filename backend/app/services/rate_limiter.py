@@ -0,0 +1,166 @@
+from typing import Dict, List, Tuple
+from config.settings import settings
+from utils.metrics import metrics
+import math
+import os
+import sqlite3
+import threading
+import time
+
+class RateLimitExceeded(Exception):
+    # Raised when a client has used up one of its budgets
+    def __init__(self, budget: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded for {budget}, retry in {math.ceil(retry_after)} seconds")
+        self.budget = budget
+        self.retry_after = retry_after
+
+def _refill(tokens: float, updated: float, now: float, capacity: float, rate: float) -> float:
+    return min(capacity, tokens + (now - updated) * rate)
+
+# Seconds between sweeps of full buckets out of the SQLite store
+PRUNE_INTERVAL = 60.0
+
+class MemoryBucketStore:
+    # Token buckets held in this process
+    
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> (tokens, updated, capacity, rate); every limit keeps its own refill parameters
+        self._buckets: Dict[str, Tuple[float, float, float, float]] = {}
+        # Size at which the next sweep runs, so sweeping stays amortized O(1) per take
+        self._prune_at = max_keys
+        self._lock = threading.Lock()
+    
+    def take(self, keys: List[str], cost: float, capacity: float, rate: float) -> float:
+        # Take cost from every bucket, or from none; returns seconds to wait, 0 when allowed
+        now = time.monotonic()
+        with self._lock:
+            levels = [
+                _refill(*self._buckets.get(key, (capacity, now))[:2], now, capacity, rate)
+                for key in keys
+            ]
+            retry_after = self._retry_after(levels, cost, rate)
+            if retry_after:
+                return retry_after
+            
+            for key, level in zip(keys, levels):
+                self._buckets[key] = (level - cost, now, capacity, rate)
+            
+            if len(self._buckets) > self._prune_at:
+                self._prune(now)
+        return 0.0
+    
+    @staticmethod
+    def _retry_after(levels: List[float], cost: float, rate: float) -> float:
+        lowest = min(levels)
+        if lowest >= cost:
+            return 0.0
+        return (cost - lowest) / rate
+    
+    def _prune(self, now: float):
+        # A bucket that has refilled completely is the same as a missing one
+        full = [
+            key for key, (tokens, updated, capacity, rate) in self._buckets.items()
+            if _refill(tokens, updated, now, capacity, rate) >= capacity
+        ]
+        for key in full:
+            del self._buckets[key]
+        # Buckets still draining stay; wait until the store has doubled before sweeping again
+        self._prune_at = max(self.max_keys, 2 * len(self._buckets))
+
+class SQLiteBucketStore:
+    # Token buckets in a local SQLite file shared by all worker processes on the node
+    
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        # Longest time any limit seen so far needs to refill from empty; rows idle for
+        # longer are full whatever limit they belong to
+        self._refill_horizon = 0.0
+        self._pruned_at = time.time()
+    
+    def take(self, keys: List[str], cost: float, capacity: float, rate: float) -> float:
+        # Wall clock time, since monotonic clocks are not shared between processes
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                placeholders = ",".join("?" * len(keys))
+                rows = {
+                    key: (tokens, updated) for key, tokens, updated in self._conn.execute(
+                        f"SELECT key, tokens, updated FROM buckets WHERE key IN ({placeholders})",
+                        keys
+                    )
+                }
+                levels = [
+                    _refill(*rows.get(key, (capacity, now)), now, capacity, rate)
+                    for key in keys
+                ]
+                retry_after = MemoryBucketStore._retry_after(levels, cost, rate)
+                if not retry_after:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                        [(key, level - cost, now) for key, level in zip(keys, levels)]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            
+            self._refill_horizon = max(self._refill_horizon, capacity / rate)
+            if now - self._pruned_at > PRUNE_INTERVAL:
+                self._pruned_at = now
+                self._conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self._refill_horizon,))
+        return retry_after
+
+class RateLimiter:
+    # Separate token-bucket budgets for conversational turns and generated tokens
+    
+    def __init__(self, store):
+        self.store = store
+    
+    def check_turn(self, keys: List[str]):
+        self._take(
+            "turns",
+            [f"turn:{key}" for key in keys],
+            1,
+            settings.rate_limit_turn_burst,
+            settings.rate_limit_turns_per_minute / 60.0
+        )
+    
+    def check_generation(self, keys: List[str], tokens: int):
+        capacity = settings.rate_limit_generation_token_burst
+        self._take(
+            "generation tokens",
+            [f"gen:{key}" for key in keys],
+            # A single request larger than the burst could never be admitted
+            min(tokens, capacity),
+            capacity,
+            settings.rate_limit_generation_tokens_per_hour / 3600.0
+        )
+    
+    def _take(self, budget: str, keys: List[str], cost: float, capacity: float, rate: float):
+        if not settings.rate_limit_enabled:
+            return
+        
+        retry_after = self.store.take(keys, cost, capacity, rate)
+        if retry_after:
+            metrics.increment("rate_limited")
+            raise RateLimitExceeded(budget, retry_after)
+
+def _create_store():
+    if settings.rate_limit_store == "sqlite":
+        return SQLiteBucketStore(settings.rate_limit_db_path)
+    return MemoryBucketStore()
+
+# Global instance
+rate_limiter = RateLimiter(_create_store())
@@ -0,0 +1,180 @@
+from typing import Any, Callable, Deque, Dict, Optional
+from collections import OrderedDict, deque
+from config.settings import settings
+from utils.metrics import metrics
+import asyncio
+import contextvars
+import itertools
+import time
+
+# Shortest expected job first: short stories are served before long ones
+LENGTH_PRIORITIES = {
+    "short": 0,
+    "medium": 1,
+    "long": 2
+}
+DEFAULT_PRIORITY = 1
+# Bulk work only runs when no interactive story is waiting (or has starved)
+BATCH_PRIORITY = 3
+
+class QueueFullError(Exception):
+    # Raised when admission control rejects a request
+    def __init__(self, message: str, per_client: bool = False):
+        super().__init__(message)
+        self.per_client = per_client
+
+class _Ticket:
+    # A queued unit of work
+    def __init__(self, seq: int, client_id: str, priority: int, fn: Callable, args: tuple, future: asyncio.Future):
+        self.seq = seq
+        self.client_id = client_id
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        # Run in the submitter's context so request ids follow the work
+        self.context = contextvars.copy_context()
+
+def get_priority(length: Optional[str]) -> int:
+    return LENGTH_PRIORITIES.get(length, DEFAULT_PRIORITY)
+
+class GenerationScheduler:
+    # Priority classes with round-robin fair queuing between clients inside each class
+    
+    def __init__(self, max_concurrency: int, max_queue: int, max_queue_per_client: int, max_wait_seconds: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.max_wait_seconds = max_wait_seconds
+        # priority -> client_id -> tickets, clients kept in round-robin order
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Ticket]]"] = {}
+        self._client_counts: Dict[str, int] = {}
+        self._pending = 0
+        self._active = 0
+        self._seq = itertools.count()
+        self._tasks = set()
+    
+    async def submit(self, client_id: str, priority: int, fn: Callable, *args) -> Any:
+        # Queue a blocking call and wait for its result
+        if self._pending >= self.max_queue:
+            metrics.increment("scheduler_rejected")
+            raise QueueFullError("Generation queue is full, please try again later")
+        
+        if self._client_counts.get(client_id, 0) >= self.max_queue_per_client:
+            metrics.increment("scheduler_rejected")
+            raise QueueFullError("Too many pending stories for this client", per_client=True)
+        
+        future = asyncio.get_running_loop().create_future()
+        ticket = _Ticket(next(self._seq), client_id, priority, fn, args, future)
+        self._enqueue(ticket)
+        self._dispatch()
+        
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Caller went away before the ticket was started
+            if self._remove(ticket):
+                metrics.increment("generations_cancelled")
+            raise
+    
+    def stats(self) -> Dict[str, int]:
+        return {
+            "scheduler_queued": self._pending,
+            "scheduler_active": self._active,
+            "scheduler_clients": len(self._client_counts)
+        }
+    
+    def _enqueue(self, ticket: _Ticket):
+        clients = self._queues.setdefault(ticket.priority, OrderedDict())
+        clients.setdefault(ticket.client_id, deque()).append(ticket)
+        self._client_counts[ticket.client_id] = self._client_counts.get(ticket.client_id, 0) + 1
+        self._pending += 1
+    
+    def _remove(self, ticket: _Ticket) -> bool:
+        clients = self._queues.get(ticket.priority)
+        tickets = clients.get(ticket.client_id) if clients else None
+        if not tickets or ticket not in tickets:
+            return False
+        
+        tickets.remove(ticket)
+        if not tickets:
+            del clients[ticket.client_id]
+        self._release_client(ticket.client_id)
+        return True
+    
+    def _release_client(self, client_id: str):
+        self._pending -= 1
+        self._client_counts[client_id] -= 1
+        if not self._client_counts[client_id]:
+            del self._client_counts[client_id]
+    
+    def _next(self) -> Optional[_Ticket]:
+        # Pick the next ticket: starving tickets first, then highest priority class round-robin
+        starving = None
+        now = time.monotonic()
+        for priority in sorted(self._queues):
+            for tickets in self._queues[priority].values():
+                head = tickets[0]
+                if now - head.enqueued_at > self.max_wait_seconds and (starving is None or head.seq < starving.seq):
+                    starving = head
+        
+        if starving is not None:
+            clients = self._queues[starving.priority]
+            clients[starving.client_id].popleft()
+            if not clients[starving.client_id]:
+                del clients[starving.client_id]
+            self._release_client(starving.client_id)
+            return starving
+        
+        for priority in sorted(self._queues):
+            clients = self._queues[priority]
+            if not clients:
+                continue
+            
+            # Serve the first client, then rotate it to the back
+            client_id, tickets = next(iter(clients.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                clients.move_to_end(client_id)
+            else:
+                del clients[client_id]
+            self._release_client(client_id)
+            return ticket
+        
+        return None
+    
+    def _dispatch(self):
+        while self._active < self.max_concurrency and self._pending:
+            ticket = self._next()
+            if ticket is None:
+                break
+            if ticket.future.done():
+                continue
+            
+            self._active += 1
+            metrics.increment("scheduler_dispatched")
+            metrics.increment("scheduler_wait_ms", int((time.monotonic() - ticket.enqueued_at) * 1000))
+            task = asyncio.create_task(self._run(ticket))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, ticket: _Ticket):
+        try:
+            result = await asyncio.to_thread(ticket.context.run, ticket.fn, *ticket.args)
+            if not ticket.future.done():
+                ticket.future.set_result(result)
+        except Exception as e:
+            if not ticket.future.done():
+                ticket.future.set_exception(e)
+        finally:
+            self._active -= 1
+            self._dispatch()
+
+# Global instance
+generation_scheduler = GenerationScheduler(
+    max_concurrency=settings.scheduler_max_concurrency,
+    max_queue=settings.scheduler_max_queue,
+    max_queue_per_client=settings.scheduler_max_queue_per_client,
+    max_wait_seconds=settings.scheduler_max_wait_seconds
+)
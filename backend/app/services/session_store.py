@@ -0,0 +1,292 @@
+from typing import Dict, Iterable, Optional, Tuple
+from config.settings import settings
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Append-only log of session snapshots. The file starts with MAGIC, then one record per
+# snapshot of a session:
+#
+#   header crc32 (4) | payload crc32 (4) | payload length (4) | session id (16) | created_at (8, epoch) | payload
+#
+# Little-endian; the header CRC covers the rest of the header. The last record of a session
+# wins. Startup only scans and checks the fixed-size headers to find each session's latest
+# record, skipping expired ones by created_at; payloads are read and checked when a
+# session is first used.
+
+MAGIC = b"STSNAP1\n"
+RECORD = struct.Struct("<III16sd")
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+# session id bytes -> (record offset, record size, created_at)
+IndexEntry = Tuple[int, int, float]
+
+class SessionLogLocked(RuntimeError):
+    # Raised when another process already has the session log open
+    pass
+
+class SessionStore:
+    # Snapshot log of chat sessions, compacted once most of it is superseded records
+    
+    def __init__(self, path: str, timeout_seconds: float, compact_ratio: float = 2.0, compact_min_bytes: int = 1024 * 1024, fsync: bool = True):
+        self.path = path
+        self.timeout_seconds = timeout_seconds
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.fsync = fsync
+        self._file = None
+        # Exclusive flock on <path>.lock, held while the log is open; a lock on the log itself
+        # would not carry over to the new file that compaction swaps in
+        self._lock_file = None
+        self._index: Dict[bytes, IndexEntry] = {}
+        self._size = 0
+        self._live_bytes = 0
+        # Guards the index and the file handle; writes are also serialized by _write_lock
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+    
+    def _cutoff(self) -> float:
+        return time.time() - self.timeout_seconds
+    
+    def open(self) -> int:
+        # Scan the log; returns the number of unexpired sessions in it
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        with self._write_lock, self._lock:
+            self._acquire_lock()
+            if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+                with open(self.path, "wb") as f:
+                    f.write(MAGIC)
+            
+            self._file = open(self.path, "r+b")
+            if self._file.read(len(MAGIC)) != MAGIC:
+                # Not ours or from another format version: keep it aside and start empty
+                self._file.close()
+                os.replace(self.path, self.path + ".unreadable")
+                logger.warning("Session log has an unknown format, starting empty", extra={"fields": {"path": self.path}})
+                with open(self.path, "wb") as f:
+                    f.write(MAGIC)
+                self._file = open(self.path, "r+b")
+            
+            started = time.perf_counter()
+            records, end = self._scan()
+            self._file.seek(0, os.SEEK_END)
+            size = self._file.tell()
+            if end < size:
+                # A torn write from a crash: drop everything from the first bad record
+                logger.warning("Truncating damaged session log tail", extra={"fields": {"path": self.path, "bytes": size - end}})
+                self._file.truncate(end)
+            self._size = end
+            
+            logger.info("Session log replayed", extra={"fields": {
+                "records": records,
+                "sessions": len(self._index),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+            }})
+            return len(self._index)
+    
+    def _acquire_lock(self):
+        # Records are written at this process's own idea of the log size, so a second
+        # process appending to the same log would overwrite records
+        if self._lock_file is not None:
+            return
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise SessionLogLocked(
+                f"Session log {self.path} is in use by another process, give every API process its own SESSION_SNAPSHOT_PATH"
+            )
+        self._lock_file = lock_file
+    
+    def _scan(self) -> Tuple[int, int]:
+        # Build the index from the record headers; returns (records read, end of the valid log)
+        self._index = {}
+        self._live_bytes = 0
+        size = os.fstat(self._file.fileno()).st_size
+        if size <= len(MAGIC):
+            return 0, len(MAGIC)
+        
+        cutoff = self._cutoff()
+        index = self._index
+        header_size = RECORD.size
+        unpack_from = RECORD.unpack_from
+        crc32 = zlib.crc32
+        records = 0
+        offset = len(MAGIC)
+        
+        with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            view = memoryview(data)
+            try:
+                while offset + header_size <= size:
+                    header_crc, _, length, sid, created_at = unpack_from(data, offset)
+                    end = offset + header_size + length
+                    if crc32(view[offset + 4:offset + header_size]) != header_crc or length > MAX_PAYLOAD or end > size:
+                        break
+                    
+                    if created_at >= cutoff:
+                        index[sid] = (offset, end - offset, created_at)
+                    records += 1
+                    offset = end
+            finally:
+                view.release()
+        
+        self._live_bytes = sum(entry[1] for entry in index.values())
+        return records, offset
+    
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+    
+    def __len__(self) -> int:
+        return len(self._index)
+    
+    def __contains__(self, session_id: str) -> bool:
+        return _key(session_id) in self._index
+    
+    def read(self, session_id: str) -> Optional[Tuple[float, bytes]]:
+        # Latest (created_at, payload) for an unexpired session, None if there is none
+        key = _key(session_id)
+        if key is None:
+            return None
+        
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or self._file is None:
+                return None
+            offset, size, created_at = entry
+            if created_at < self._cutoff():
+                return None
+            record = os.pread(self._file.fileno(), size, offset)
+        
+        payload = record[RECORD.size:]
+        if zlib.crc32(payload) != RECORD.unpack_from(record)[1]:
+            logger.warning("Damaged session snapshot", extra={"fields": {"session_id": session_id}})
+            return None
+        return created_at, payload
+    
+    def append(self, snapshots: Iterable[Tuple[str, float, bytes]]):
+        # Write (session id, created_at, payload) records in one go
+        chunks = []
+        entries = []
+        for session_id, created_at, payload in snapshots:
+            key = _key(session_id)
+            if key is None:
+                continue
+            header = RECORD.pack(0, zlib.crc32(payload), len(payload), key, created_at)[4:]
+            chunks.append(struct.pack("<I", zlib.crc32(header)) + header + payload)
+            entries.append((key, len(chunks[-1]), created_at))
+        
+        if not chunks:
+            return
+        
+        with self._write_lock:
+            data = b"".join(chunks)
+            fileno = self._file.fileno()
+            os.pwrite(fileno, data, self._size)
+            if self.fsync:
+                os.fsync(fileno)
+            
+            with self._lock:
+                offset = self._size
+                for key, size, created_at in entries:
+                    previous = self._index.get(key)
+                    if previous:
+                        self._live_bytes -= previous[1]
+                    self._index[key] = (offset, size, created_at)
+                    self._live_bytes += size
+                    offset += size
+                self._size = offset
+    
+    def drop_expired(self) -> int:
+        # Forget expired sessions; their records go away with the next compaction
+        cutoff = self._cutoff()
+        with self._lock:
+            expired = [key for key, entry in self._index.items() if entry[2] < cutoff]
+            for key in expired:
+                self._live_bytes -= self._index.pop(key)[1]
+        return len(expired)
+    
+    def needs_compaction(self) -> bool:
+        return self._size > self.compact_min_bytes and self._size > (self._live_bytes + len(MAGIC)) * self.compact_ratio
+    
+    def compact(self):
+        # Rewrite the log with only the latest record of each unexpired session. Reads keep
+        # using the old file until the new one is swapped in.
+        with self._write_lock:
+            self.drop_expired()
+            with self._lock:
+                entries = sorted(self._index.items(), key=lambda item: item[1][0])
+                fileno = self._file.fileno()
+                before = self._size
+            
+            started = time.perf_counter()
+            temp_path = self.path + ".compact"
+            index: Dict[bytes, IndexEntry] = {}
+            with open(temp_path, "wb") as out:
+                out.write(MAGIC)
+                offset = len(MAGIC)
+                for key, (old_offset, size, created_at) in entries:
+                    out.write(os.pread(fileno, size, old_offset))
+                    index[key] = (offset, size, created_at)
+                    offset += size
+                out.flush()
+                os.fsync(out.fileno())
+            
+            with self._lock:
+                # Sessions dropped meanwhile stay dropped
+                for key in list(index):
+                    if key not in self._index:
+                        del index[key]
+                os.replace(temp_path, self.path)
+                self._file.close()
+                self._file = open(self.path, "r+b")
+                self._index = index
+                self._size = offset
+                self._live_bytes = sum(entry[1] for entry in index.values())
+            
+            logger.info("Session log compacted", extra={"fields": {
+                "sessions": len(index),
+                "bytes_before": before,
+                "bytes_after": offset,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+            }})
+    
+    def stats(self) -> Dict:
+        return {"sessions": len(self._index), "log_bytes": self._size, "live_bytes": self._live_bytes}
+    
+    def close(self):
+        with self._write_lock, self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+            if self._lock_file:
+                self._lock_file.close()
+                self._lock_file = None
+
+def _key(session_id: str) -> Optional[bytes]:
+    # Session ids are UUIDs, stored as their 16 raw bytes
+    try:
+        return uuid.UUID(session_id).bytes
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+# Global instance
+session_store = SessionStore(
+    settings.session_snapshot_path,
+    settings.session_timeout_hours * 3600,
+    compact_ratio=settings.session_snapshot_compact_ratio,
+    fsync=settings.session_snapshot_fsync
+)
@@ -0,0 +1,46 @@
+from typing import Tuple
+from models.schemas import StoryParams
+from services.inference_client import inference_client
+from services.profile_service import profile_service
+from services.scheduler import generation_scheduler, get_priority
+from services.generation_control import GenerationControl
+from services.topic_index import topic_index
+from config.settings import settings
+from utils.validators import validate_story_params, sanitize_input
+
+class StoryService:
+    # Entry point for story generation requests from the API and background jobs
+    
+    def prepare(self, params: StoryParams) -> Tuple[bool, str]:
+        # Sanitize free-text fields in place and validate everything in one pass
+        params.topic = sanitize_input(params.topic)
+        if params.characters:
+            params.characters = [sanitize_input(c) for c in params.characters]
+        
+        return validate_story_params(
+            params.age_group, params.genre, params.length, params.topic, params.characters
+        )
+    
+    async def generate(self, params: StoryParams, client_id: str, control: GenerationControl) -> str:
+        # An earlier story for the same kind of request and a rephrased topic will do
+        if settings.topic_reuse_enabled:
+            story = topic_index.lookup(params)
+            if story is not None:
+                return story
+        
+        # Wait for a generation slot
+        story = await generation_scheduler.submit(
+            client_id,
+            get_priority(profile_service.select(params).batch_class),
+            inference_client.generate_story_sync,
+            params,
+            control
+        )
+        
+        # Cut-short stories and the fallback story are not worth handing out again
+        if settings.topic_reuse_enabled and not control.timed_out and not control.rejected:
+            topic_index.add(params, story)
+        return story
+
+# Global instance
+story_service = StoryService()
@@ -0,0 +1,155 @@
+from typing import Dict, List, Optional, Tuple
+from models.schemas import StoryParams
+from config.settings import settings
+from utils.metrics import metrics
+import re
+import threading
+import zlib
+
+# Finds earlier stories whose topic is a rephrasing of a new one ("an astronaut in space" /
+# "space astronaut adventure"). Topics become feature-hashed vectors of their stemmed
+# content words; cosine similarity against the stories already written for the same
+# age group, genre and length picks candidates. A candidate only matches with exactly the
+# same content words, so a hash collision never passes for a match and neither does a
+# topic that differs in one word ("...the big red train" / "...the big red boat"). Each
+# of those buckets is a fixed-size ring, so memory is bounded by the number of buckets
+# times topic_index_bucket_size. numpy is imported on first use, so only processes with
+# topic reuse enabled load it.
+
+_WORD = re.compile(r"\w+")
+STOPWORDS = frozenset({
+    "a", "an", "the", "and", "or", "of", "in", "on", "at", "to", "for", "from", "with", "about",
+    "who", "that", "which", "is", "are", "his", "her", "their", "its", "story", "stories", "tale",
+    "adventure", "bir", "ve", "ile", "bu", "da", "de", "hakkında", "hikaye", "hikayesi", "masal"
+})
+# Longest first; a stem keeps at least three letters
+SUFFIXES = ("ing", "ies", "es", "ed", "s", "e")
+
+def stem(word: str) -> str:
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def topic_words(topic: str) -> List[str]:
+    return [stem(word) for word in _WORD.findall(topic.lower()) if word not in STOPWORDS]
+
+def personalize(story: str, old: Optional[List[str]], new: Optional[List[str]]) -> Optional[str]:
+    # Swap the stored story's character names for the requested ones; None if that cannot work
+    if not new or new == old:
+        return story
+    if not old or len(old) != len(new):
+        return None
+    names = dict(zip(old, new))
+    pattern = re.compile(r"\b(" + "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True)) + r")\b")
+    return pattern.sub(lambda match: names[match.group(1)], story)
+
+class _Bucket:
+    # Ring of (vector, topic, characters, story) rows for one age/genre/length
+    
+    def __init__(self, dims: int, capacity: int):
+        import numpy as np
+        self.capacity = capacity
+        self.vectors = np.zeros((min(capacity, 64), dims), dtype=np.float32)
+        self.entries: List[Tuple[str, Optional[List[str]], str]] = []
+        self.next = 0
+    
+    def add(self, vector, entry: Tuple[str, Optional[List[str]], str]):
+        import numpy as np
+        if len(self.entries) < self.capacity:
+            row = len(self.entries)
+            if row == len(self.vectors):
+                grown = np.zeros((min(self.capacity, row * 2), self.vectors.shape[1]), dtype=np.float32)
+                grown[:row] = self.vectors
+                self.vectors = grown
+            self.entries.append(entry)
+        else:
+            # Full: the oldest story makes room
+            row = self.next
+            self.entries[row] = entry
+            self.next = (row + 1) % self.capacity
+        self.vectors[row] = vector
+    
+    def nearest(self, vector, threshold: float, limit: int) -> List[Tuple[float, Tuple[str, Optional[List[str]], str]]]:
+        # Up to limit entries scoring at least threshold, best first
+        import numpy as np
+        count = len(self.entries)
+        if not count:
+            return []
+        scores = self.vectors[:count] @ vector
+        candidates = np.flatnonzero(scores >= threshold)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        ranked = sorted(candidates, key=lambda row: -scores[row])
+        return [(float(scores[row]), self.entries[row]) for row in ranked]
+
+class TopicIndex:
+    # Near-duplicate topic lookup over stories generated so far
+    
+    def __init__(self, dims: int, bucket_size: int, threshold: float):
+        self.dims = dims
+        self.bucket_size = bucket_size
+        self.threshold = threshold
+        self._buckets: Dict[Tuple[str, str, str], _Bucket] = {}
+        self._lock = threading.Lock()
+    
+    def vectorize(self, topic: str):
+        # Signed feature hashing keeps collisions from adding up to fake similarity
+        import numpy as np
+        vector = np.zeros(self.dims, dtype=np.float32)
+        for word in topic_words(topic):
+            digest = zlib.crc32(word.encode("utf-8"))
+            vector[digest % self.dims] += 1.0 if digest & 0x80000000 else -1.0
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else None
+    
+    @staticmethod
+    def _key(params: StoryParams) -> Tuple[str, str, str]:
+        return params.age_group, params.genre, params.length
+    
+    def add(self, params: StoryParams, story: str):
+        vector = self.vectorize(params.topic)
+        if vector is None:
+            return
+        with self._lock:
+            bucket = self._buckets.get(self._key(params))
+            if bucket is None:
+                bucket = self._buckets[self._key(params)] = _Bucket(self.dims, self.bucket_size)
+            bucket.add(vector, (params.topic, list(params.characters) if params.characters else None, story))
+    
+    def lookup(self, params: StoryParams) -> Optional[str]:
+        # A stored story for a similar topic, with the requested character names
+        metrics.increment("topic_index_lookups")
+        vector = self.vectorize(params.topic)
+        if vector is None:
+            return None
+        
+        with self._lock:
+            bucket = self._buckets.get(self._key(params))
+            matches = bucket.nearest(vector, self.threshold, limit=8) if bucket else []
+        
+        words = topic_words(params.topic)
+        for _, (topic, characters, story) in matches:
+            # Word order, repeats and stopwords may differ, the content words may not
+            if set(topic_words(topic)) != set(words):
+                continue
+            personalized = personalize(story, characters, params.characters)
+            if personalized is not None:
+                metrics.increment("topic_index_hits")
+                return personalized
+        return None
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(bucket.entries) for bucket in self._buckets.values())
+    
+    def stats(self) -> Dict:
+        lookups = metrics.get("topic_index_lookups")
+        return {
+            "topic_index_entries": len(self),
+            "topic_index_hit_rate": round(metrics.get("topic_index_hits") / lookups, 4) if lookups else 0.0
+        }
+
+
+# Global instance
+topic_index = TopicIndex(settings.topic_index_dims, settings.topic_index_bucket_size, settings.topic_reuse_threshold)
@@ -0,0 +1,111 @@
+from typing import Optional
+from contextvars import ContextVar
+from config.settings import settings
+from utils.metrics import metrics
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+# Request context picked up by every log record
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+session_id_var: ContextVar[Optional[str]] = ContextVar("session_id", default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line
+    
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "session_id": getattr(record, "session_id", None)
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class ContextFilter(logging.Filter):
+    # Attach request context on the calling thread, before the record is queued
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    # Keep only a fraction of records logged with extra={"sampled": True}
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sampled", False):
+            return random.random() < settings.log_sample_rate
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Never block the caller: drop records when the queue is full
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("log_records_dropped")
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Format args now, the listener thread sees the record later
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def setup_logging():
+    # Route all logging through a queue drained by a background thread
+    global _listener
+    if _listener is not None:
+        return
+    
+    output = logging.StreamHandler(sys.stdout)
+    if settings.log_json:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+    
+    log_queue = queue.Queue(maxsize=settings.log_queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+    handler.addFilter(ContextFilter())
+    
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(settings.log_level.upper())
+    
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    # Flush queued records
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+class StageTimer:
+    # Collects per-stage durations in milliseconds
+    
+    def __init__(self):
+        self.stages = {}
+        self._last = time.perf_counter()
+    
+    def mark(self, stage: str, at: Optional[float] = None):
+        # Ends the stage now, or at an earlier perf_counter() reading
+        now = time.perf_counter() if at is None else at
+        self.stages[stage] = round((now - self._last) * 1000, 2)
+        self._last = now
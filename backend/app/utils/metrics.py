@@ -0,0 +1,24 @@
+import threading
+from typing import Dict
+
+class Metrics:
+    # Thread-safe in-process counters
+    
+    def __init__(self):
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+    
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+    
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+# Global instance
+metrics = Metrics()
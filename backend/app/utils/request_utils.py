@@ -0,0 +1,34 @@
+from fastapi import Request
+from config.settings import settings
+from typing import Optional
+import hashlib
+import hmac
+import ipaddress
+
+def get_client_id(request: Request) -> str:
+    # Identify the caller by API key, falling back to the remote address. Only configured
+    # keys count, otherwise a new random key per request would get fresh budgets every time
+    api_key = request.headers.get("x-api-key")
+    if api_key and _is_known_key(api_key):
+        # Keys end up in job rows and logs, so only a digest identifies the client
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return request.client.host if request.client else "anonymous"
+
+def is_inference_peer(token: Optional[str], host: Optional[str]) -> bool:
+    # Whether a caller may use an inference worker: the shared INFERENCE_TOKEN when one is
+    # configured, otherwise only processes on the same host
+    if settings.inference_token:
+        return bool(token) and hmac.compare_digest(token.encode("utf-8"), settings.inference_token.encode("utf-8"))
+    return is_loopback(host)
+
+def is_loopback(host: Optional[str]) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except (ValueError, TypeError):
+        return False
+
+def _is_known_key(api_key: str) -> bool:
+    candidate = api_key.encode("utf-8")
+    return any(hmac.compare_digest(candidate, key.encode("utf-8")) for key in settings.get_api_keys())
@@ -0,0 +1,62 @@
+from typing import Any, Iterable
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+class FastJSONResponse(JSONResponse):
+    # JSON through orjson when it is installed, compact stdlib json otherwise
+    
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match may list several tags, weak ones included (compression marks them weak)
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+def cached_response(request: Request, content: Any, etag: str, max_age: int) -> Response:
+    # 304 when the client already has this version
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(content, headers=headers)
+
+class CompressionMiddleware:
+    # Brotli (with gzip fallback) when brotli-asgi is installed and enabled, else gzip.
+    # Streaming endpoints are skipped, the compressor would hold their lines back.
+    
+    def __init__(self, app: ASGIApp, minimum_size: int, brotli: bool = False, skip_paths: Iterable[str] = ()):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+        self.compressed = self._compressor(app, minimum_size, brotli)
+    
+    @staticmethod
+    def _compressor(app: ASGIApp, minimum_size: int, brotli: bool) -> ASGIApp:
+        if brotli:
+            try:
+                from brotli_asgi import BrotliMiddleware
+                return BrotliMiddleware(app, minimum_size=minimum_size, gzip_fallback=True)
+            except ImportError:
+                logger.warning("brotli-asgi is not installed, compressing with gzip only")
+        return GZipMiddleware(app, minimum_size=minimum_size)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["path"] not in self.skip_paths:
+            await self.compressed(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
@@ -1,10 +1,10 @@
-from typing import List, Tuple
+from typing import List, NamedTuple, Optional, Tuple
 import re
 
 # Available options
 VALID_AGE_GROUPS = ["3-5", "6-10", "11-15"]
 VALID_GENRES = [
-    "adventure", "fantasy", "friendship", "educational", 
+    "adventure", "fantasy", "friendship", "educational",
     "animal", "family", "nature", "science", "mystery", "humor"
 ]
 VALID_LENGTHS = ["short", "medium", "long"]
@@ -16,6 +16,39 @@ INAPPROPRIATE_WORDS = [
     'drug', 'alcohol', 'smoke', 'cigarette', 'sex', 'war'
 ]
 
+# Compiled once at import. Every pattern is linear: no nested quantifiers, and
+# repeated character classes are disjoint from whatever follows them.
+# The blocklist runs on lowercased text: a case-sensitive alternation of
+# literals lets the regex engine skip ahead on the first letter.
+_BLOCKLIST = re.compile("|".join(map(re.escape, INAPPROPRIATE_WORDS)))
+_CHARACTER_NAME = re.compile(r"[a-zA-ZğüşıöçĞÜŞİÖÇ\s\-']+")
+_SENTENCE_END = re.compile(r"[.!?]+")
+_SPECIAL_CHARS = re.compile(r"[^a-zA-Z0-9\s.,!?;:\-çğıöşüÇĞIİÖŞÜ]+")
+
+# sanitize_input passes. A single combined pattern was tried and was slower on
+# ordinary text: each of these is a plain scan inside the regex engine, while a
+# combined alternation is tried at every position and needs a Python callback.
+# [^<>] keeps a run of unclosed '<' linear
+_TAG = re.compile(r"<[^<>]+>")
+_DISALLOWED = re.compile(r"[^\w\s.,!?;:\-'\"çğıöşüÇĞIİÖŞÜ]+")
+_PUNCT_RUN = re.compile(r"([.!?]){3,}")
+
+class TextStats(NamedTuple):
+    # Counts used by the validators, gathered together so each text is analyzed once
+    length: int
+    special_chars: int
+    sentences: int
+    blocked_words: int
+
+def analyze_text(text: str) -> TextStats:
+    # Sentences are segments longer than 5 characters between runs of . ! ?
+    return TextStats(
+        length=len(text),
+        special_chars=sum(map(len, _SPECIAL_CHARS.findall(text))),
+        sentences=count_sentences(text),
+        blocked_words=len(_BLOCKLIST.findall(text.lower()))
+    )
+
 def validate_age_group(age_group: str) -> bool:
     return age_group in VALID_AGE_GROUPS
 
@@ -37,15 +70,14 @@ def validate_prompt(prompt: str) -> Tuple[bool, str]:
     if len(cleaned) > 500:
         return False, "Subject can be up to 500 characters"
     
+    stats = analyze_text(cleaned)
+    
     # Check for inappropriate content
-    prompt_lower = cleaned.lower()
-    for word in INAPPROPRIATE_WORDS:
-        if word in prompt_lower:
-            return False, "Inappropriate content detected. Choose a child-friendly topic"
+    if stats.blocked_words:
+        return False, "Inappropriate content detected. Choose a child-friendly topic"
     
     # Check for excessive special characters
-    special_chars = len(re.findall(r'[^a-zA-Z0-9\s\.,!?;:\-çğıöşüÇĞIİÖŞÜ]', cleaned))
-    if special_chars > len(cleaned) * 0.1:
+    if stats.special_chars > stats.length * 0.1:
         return False, "There are too many special characters"
     
     return True, ""
@@ -70,14 +102,12 @@ def validate_characters(characters: List[str]) -> Tuple[bool, str]:
             return False, f"'{cleaned}' the name is too short (min 2 characters)"
         
         # Only letters, spaces, hyphens allowed
-        if not re.match(r"^[a-zA-ZğüşıöçĞÜŞİÖÇ\s\-']+$", cleaned):
+        if not _CHARACTER_NAME.fullmatch(cleaned):
             return False, f"'{cleaned}' contains invalid characters"
         
         # Check inappropriate names
-        char_lower = cleaned.lower()
-        for word in INAPPROPRIATE_WORDS:
-            if word in char_lower:
-                return False, f"'{cleaned}' contains inappropriate content"
+        if _BLOCKLIST.search(cleaned.lower()):
+            return False, f"'{cleaned}' contains inappropriate content"
     
     # Check duplicates
     cleaned_names = [c.strip().lower() for c in characters]
@@ -86,21 +116,39 @@ def validate_characters(characters: List[str]) -> Tuple[bool, str]:
     
     return True, ""
 
+def validate_story_params(age_group: str, genre: str, length: str, topic: str, characters: Optional[List[str]]) -> Tuple[bool, str]:
+    # Validate a complete set of story parameters in one pass
+    if not validate_age_group(age_group):
+        return False, f"Invalid age group: {age_group}"
+    
+    if not validate_genre(genre):
+        return False, f"Invalid genre: {genre}"
+    
+    if not validate_length(length):
+        return False, f"Invalid length: {length}"
+    
+    is_valid, error = validate_prompt(topic)
+    if not is_valid:
+        return False, error
+    
+    return validate_characters(characters or [])
+
 def sanitize_input(text: str) -> str:
     if not text:
         return ""
     
-    # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text.strip())
+    # Collapse whitespace; str.split uses the same whitespace definition as \s
+    text = " ".join(text.split())
     
     # Remove HTML tags
-    text = re.sub(r'<[^>]+>', '', text)
+    if "<" in text:
+        text = _TAG.sub("", text)
     
     # Remove dangerous characters but keep Turkish chars
-    text = re.sub(r'[^\w\s\.,!?;:\-\'\"çğıöşüÇĞIİÖŞÜ]', '', text)
+    text = _DISALLOWED.sub("", text)
     
     # Limit consecutive punctuation
-    text = re.sub(r'([.!?]){3,}', r'\1\1\1', text)
+    text = _PUNCT_RUN.sub(r"\1\1\1", text)
     
     return text.strip()
 
@@ -108,34 +156,39 @@ def is_safe_content(text: str) -> bool:
     if not text:
         return True
     
+    # A few substring scans beat the blocklist regex on long texts
     text_lower = text.lower()
-    
-    for word in INAPPROPRIATE_WORDS:
-        if word in text_lower:
-            return False
-    
-    return True
+    return not any(word in text_lower for word in INAPPROPRIATE_WORDS)
+
+def count_sentences(text: str) -> int:
+    return len([segment for segment in _SENTENCE_END.split(text) if len(segment.strip()) > 5])
 
 def validate_story_output(story: str, min_length: int = 100, max_length: int = 2000) -> Tuple[bool, str]:
-    if not story or not story.strip():
+    cleaned = story.strip() if story else ""
+    return validate_story_stats(
+        len(cleaned),
+        count_sentences(cleaned),
+        not is_safe_content(cleaned),
+        min_length,
+        max_length
+    )
+
+def validate_story_stats(length: int, sentences: int, blocked: bool, min_length: int = 100, max_length: int = 2000) -> Tuple[bool, str]:
+    # Validate a story from counts gathered while it was post-processed
+    if not length:
         return False, "Story is empty"
     
-    cleaned = story.strip()
-    
-    if len(cleaned) < min_length:
+    if length < min_length:
         return False, f"The story is too short (min {min_length} character)"
     
-    if len(cleaned) > max_length:
+    if length > max_length:
         return False, f"The story is too long (max {max_length} character)"
     
-    if not is_safe_content(cleaned):
+    if blocked:
         return False, "The story contains inappropriate content"
     
     # Check minimum sentences
-    sentences = re.split(r'[.!?]+', cleaned)
-    valid_sentences = [s.strip() for s in sentences if len(s.strip()) > 5]
-    
-    if len(valid_sentences) < 3:
+    if sentences < 3:
         return False, "The story must contain at least 3 sentences"
     
-    return True, ""
\ No newline at end of file
+    return True, ""
@@ -0,0 +1,111 @@
+"""
+Chat response benchmark
+Walks one conversation through the questionnaire to a finished story and,
+for every turn, measures serialization time and bytes on the wire for the
+old path (indented prompt texts through response_model and the stdlib JSON
+encoder), the current one (normalized texts, FastJSONResponse) and lean
+responses, each uncompressed, gzipped and brotli-compressed when available.
+"""
+
+import argparse
+import gzip
+import sys
+import time
+from pathlib import Path
+
+# Application modules live in backend/app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from core.prompts import StoryPrompts, prompt_catalog
+from models.schemas import ChatResponse
+from services.chat_service import ChatService
+from utils.responses import FastJSONResponse, orjson
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TURNS = ["hi", "6-10", "adventure", "short", "a little fox who learns to share", "Tom, Anna"]
+STORY_SENTENCE = "Once upon a time, a little fox named Tom learned that sharing berries with Anna made them both happy. "
+
+def conversation(story_chars: int) -> list:
+    # (ChatResponse with the old prompt texts, the same with today's texts) per turn
+    service = ChatService()
+    raw = {prompt_catalog.texts[key]: text for key, text in StoryPrompts.get_collection_prompts().items()}
+    story = (STORY_SENTENCE * (story_chars // len(STORY_SENTENCE) + 1))[:story_chars]
+    
+    turns = []
+    session_id = None
+    for message in TURNS:
+        turn = service.process_message(session_id, message)
+        session_id = turn.session_id
+        fields = {
+            "session_id": session_id,
+            "story_params": turn.story_params,
+            "story": story if turn.is_complete else None,
+            "is_complete": turn.is_complete
+        }
+        turns.append((
+            ChatResponse(message=raw.get(turn.response, turn.response), **fields),
+            ChatResponse(message=turn.response, message_id=prompt_catalog.message_id(turn.response), **fields)
+        ))
+    return turns
+
+def default_path(response: ChatResponse) -> bytes:
+    # What FastAPI does with response_model and its default response class
+    return JSONResponse(jsonable_encoder(response)).body
+
+def fast_path(response: ChatResponse) -> bytes:
+    return FastJSONResponse(response.dict()).body
+
+def lean_path(response: ChatResponse) -> bytes:
+    return FastJSONResponse(response.dict(exclude_none=True, exclude={"message"} if response.message_id else None)).body
+
+def timed(encode, response: ChatResponse, repeat: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = encode(response)
+    return (time.perf_counter() - started) / repeat * 1e6, body
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chat response serialization and compression')
+    parser.add_argument('--story-chars', type=int, default=2000, help='Length of the story in the final turn')
+    parser.add_argument('--repeat', type=int, default=2000, help='Serializations per measurement')
+    parser.add_argument('--min-size', type=int, default=500, help='Compression threshold in bytes, as COMPRESSION_MIN_SIZE')
+    
+    args = parser.parse_args()
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}, brotli: {'yes' if brotli is not None else 'not installed'}")
+    
+    paths = [("before", default_path, 0), ("now", fast_path, 1), ("lean", lean_path, 1)]
+    header = f"{'turn':<6}{'path':<8}{'us':>8}{'raw':>8}{'gzip':>8}"
+    if brotli is not None:
+        header += f"{'br':>8}"
+    print(header)
+    
+    totals = {name: [0.0, 0, 0, 0] for name, _, _ in paths}
+    for number, pair in enumerate(conversation(args.story_chars), 1):
+        for name, encode, version in paths:
+            micros, body = timed(encode, pair[version], args.repeat)
+            compressed = len(body) >= args.min_size
+            gzipped = len(gzip.compress(body, compresslevel=9)) if compressed else len(body)
+            brotlied = len(brotli.compress(body, quality=4)) if brotli is not None and compressed else len(body)
+            
+            row = f"{number:<6}{name:<8}{micros:>8.1f}{len(body):>8}{gzipped:>8}"
+            if brotli is not None:
+                row += f"{brotlied:>8}"
+            print(row)
+            for index, value in enumerate((micros, len(body), gzipped, brotlied)):
+                totals[name][index] += value
+    
+    print("conversation totals")
+    for name, (micros, raw, gzipped, brotlied) in totals.items():
+        row = f"{'':<6}{name:<8}{micros:>8.1f}{raw:>8}{gzipped:>8}"
+        if brotli is not None:
+            row += f"{brotlied:>8}"
+        print(row)
+
+if __name__ == "__main__":
+    main()
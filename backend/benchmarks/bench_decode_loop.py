@@ -0,0 +1,122 @@
+"""
+Decode loop benchmark
+Per-call cost of turning one story prompt into new text at small token
+budgets, where overhead rather than the model dominates: the old
+pipeline("text-generation") wrapper (prompt string in, prompt re-tokenized,
+full sequence decoded and the prompt cut off), model.generate on the
+pre-tokenized prompt and LLMService's direct KV-cache loop over reused
+buffers. Greedy decoding, so generate and the direct loop must produce the
+same tokens for every batch row.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Application modules live in backend/app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+import torch
+from transformers import StoppingCriteriaList, pipeline
+from transformers.utils import logging as transformers_logging
+
+from config.settings import settings
+from models.schemas import StoryParams
+from services.generation_control import GenerationControl
+from services.llm_service import DeadlineStoppingCriteria, StoryStreamer, llm_service
+from services.profile_service import DecodingConfig, GenerationProfile
+
+TOPICS = ["a little fox who learns to share", "a dragon", "two friends who build a boat", "the moon"]
+
+def greedy_profile(new_tokens: int) -> GenerationProfile:
+    # Repetition control off, the pipeline baseline never had the incremental processors
+    decoding = DecodingConfig(strategy="greedy", repetition_penalty=1.0, no_repeat_ngram_size=0)
+    return GenerationProfile(name="bench", decoding=decoding, max_new_tokens=new_tokens)
+
+def run_pipeline(generator, prompts: list, profile: GenerationProfile) -> list:
+    # What generate_story did before: text in, prompt stripped from the decoded output
+    outputs = generator(prompts, max_new_tokens=profile.max_new_tokens, do_sample=False, pad_token_id=llm_service.tokenizer.eos_token_id)
+    return [output[0]["generated_text"][len(prompt):] for prompt, output in zip(prompts, outputs)]
+
+def run_generate(input_ids, attention_mask, profile: GenerationProfile) -> torch.Tensor:
+    control = GenerationControl(60)
+    streamer = StoryStreamer(llm_service.tokenizer, input_ids.shape[0])
+    with torch.inference_mode():
+        output = llm_service.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=profile.max_new_tokens,
+            pad_token_id=llm_service.tokenizer.pad_token_id,
+            eos_token_id=llm_service.tokenizer.eos_token_id,
+            logits_processor=llm_service._repetition_processors(profile),
+            stopping_criteria=StoppingCriteriaList([DeadlineStoppingCriteria(control)]),
+            streamer=streamer,
+            **llm_service._decoding_kwargs(profile)
+        )
+    streamer.results()
+    return output[:, input_ids.shape[1]:]
+
+def run_direct(input_ids, attention_mask, profile: GenerationProfile) -> torch.Tensor:
+    streamer = StoryStreamer(llm_service.tokenizer, input_ids.shape[0])
+    with torch.inference_mode():
+        llm_service._decode(input_ids, attention_mask, profile, GenerationControl(60), streamer)
+    streamer.results()
+    # Tokens stay in the thread's buffer until the next call
+    output = llm_service._buffers.tensors[0][:input_ids.shape[0], input_ids.shape[1]:input_ids.shape[1] + profile.max_new_tokens]
+    return output.clone()
+
+def timed(call, repeat: int) -> float:
+    # Median milliseconds per call, after one warm-up call
+    call()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the decode loop against generate and the pipeline')
+    parser.add_argument('--model', type=str, default=None, help='Model to load instead of the configured one')
+    parser.add_argument('--tokens', type=int, nargs='+', default=[1, 4, 16, 64], help='New tokens per call')
+    parser.add_argument('--batch-size', type=int, default=1, help='Stories per call')
+    parser.add_argument('--repeat', type=int, default=50, help='Timed calls per measurement')
+    
+    args = parser.parse_args()
+    if args.model:
+        settings.model_name = args.model
+        settings.use_fine_tuned = False
+    # The pipeline warns about its own max_length default on every call
+    transformers_logging.set_verbosity_error()
+    llm_service.load_model()
+    generator = pipeline("text-generation", model=llm_service.model, tokenizer=llm_service.tokenizer)
+    
+    params_list = [
+        StoryParams(topic=TOPICS[row % len(TOPICS)], age_group="6-10", genre="adventure", length="short")
+        for row in range(args.batch_size)
+    ]
+    input_ids, attention_mask = llm_service._encode_batch(params_list)
+    prompts = [
+        llm_service.tokenizer.decode(ids[mask.bool()], skip_special_tokens=False)
+        for ids, mask in zip(input_ids, attention_mask)
+    ]
+    print(f"model {llm_service.get_model_name()} on {llm_service.device}, batch {args.batch_size}, prompt {input_ids.shape[1]} tokens")
+    print(f"{'tokens':>8}{'pipeline ms':>14}{'generate ms':>14}{'direct ms':>12}{'vs pipeline':>13}{'vs generate':>13}")
+    
+    for new_tokens in args.tokens:
+        profile = greedy_profile(new_tokens)
+        expected = run_generate(input_ids, attention_mask, profile)
+        actual = run_direct(input_ids, attention_mask, profile)
+        if not torch.equal(expected, actual[:, :expected.shape[1]]):
+            raise AssertionError(f"Direct loop and generate differ ({new_tokens} tokens)")
+        
+        pipeline_ms = timed(lambda: run_pipeline(generator, prompts, profile), args.repeat)
+        generate_ms = timed(lambda: run_generate(input_ids, attention_mask, profile), args.repeat)
+        direct_ms = timed(lambda: run_direct(input_ids, attention_mask, profile), args.repeat)
+        print(f"{new_tokens:>8}{pipeline_ms:>14.2f}{generate_ms:>14.2f}{direct_ms:>12.2f}"
+              f"{pipeline_ms / direct_ms:>12.2f}x{generate_ms / direct_ms:>12.2f}x")
+
+if __name__ == "__main__":
+    main()
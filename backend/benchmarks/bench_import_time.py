@@ -0,0 +1,83 @@
+"""
+API import time benchmark
+Imports the API app in a fresh interpreter under -X importtime, reports the
+slowest modules and the process RSS, and fails when a heavy ML module is
+imported at startup or the total goes over budget
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+# Only the inference side may import these, and only when it first needs the model
+HEAVY_MODULES = ("torch", "transformers", "accelerate", "safetensors", "tokenizers", "huggingface_hub")
+
+CHILD = """
+import resource, sys
+import {module}
+print("RSS_KB", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file=sys.stderr)
+"""
+
+def run_import(module: str, role: str) -> str:
+    env = dict(os.environ, SERVICE_ROLE=role, LOG_LEVEL="ERROR")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD.format(module=module)],
+        cwd=APP_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return result.stderr
+
+def parse_importtime(output: str):
+    # "import time: self [us] | cumulative | imported package", nesting shown by indentation
+    modules = []
+    rss_kb = None
+    for line in output.splitlines():
+        if line.startswith("RSS_KB"):
+            rss_kb = int(line.split()[1])
+            continue
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us), (len(name) - len(name.lstrip()) - 1) // 2))
+    return modules, rss_kb
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark API startup imports')
+    parser.add_argument('--module', type=str, default='main', help='Module to import from backend/app')
+    parser.add_argument('--role', type=str, default='frontend', help='SERVICE_ROLE for the import')
+    parser.add_argument('--top', type=int, default=15, help='Slowest modules to list')
+    parser.add_argument('--max-ms', type=float, default=None, help='Fail when the total import time exceeds this')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs; the fastest one is reported')
+    
+    args = parser.parse_args()
+    
+    runs = [parse_importtime(run_import(args.module, args.role)) for _ in range(args.repeat)]
+    # Top-level imports (no indentation) add up to the whole import
+    totals = [sum(cumulative for _, _, cumulative, depth in modules if depth == 0) for modules, _ in runs]
+    best = totals.index(min(totals))
+    modules, rss_kb = runs[best]
+    total_ms = totals[best] / 1000
+    
+    print(f"Import of {args.module} (SERVICE_ROLE={args.role}): {total_ms:.1f} ms, {len(modules)} modules, max RSS {rss_kb / 1024:.1f} MB")
+    print(f"{'module':<48}{'self ms':>10}{'cumulative ms':>16}")
+    for name, self_us, cumulative_us, _ in sorted(modules, key=lambda m: m[2], reverse=True)[:args.top]:
+        print(f"{name:<48}{self_us / 1000:>10.1f}{cumulative_us / 1000:>16.1f}")
+    
+    failures = []
+    heavy = sorted({name.split(".")[0] for name, _, _, _ in modules} & set(HEAVY_MODULES))
+    if heavy:
+        failures.append(f"heavy modules imported at startup: {', '.join(heavy)}")
+    if args.max_ms is not None and total_ms > args.max_ms:
+        failures.append(f"import took {total_ms:.1f} ms, budget is {args.max_ms:.1f} ms")
+    
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Inference transport benchmark
+Starts inference_server.py on a Unix domain socket and on local TCP, then
+sends the same stories in-process and through each transport, with several
+concurrent callers sharing the pooled client. Everything runs on this
+machine; the model is the one MODEL_NAME points at.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+# Application modules live in backend/app
+sys.path.insert(0, str(APP_DIR))
+
+from config.settings import settings
+from models.schemas import StoryParams
+from services.generation_control import GenerationControl
+from services.inference_client import LocalInferenceClient, SocketInferenceClient
+
+PARAMS = StoryParams(topic="a little fox who learns to share", age_group="6-10", genre="friendship", length="short")
+
+def start_server(address: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, str(APP_DIR / "inference_server.py"), "--address", address],
+        cwd=APP_DIR, env=dict(os.environ, LOG_LEVEL="ERROR")
+    )
+
+def wait_ready(client: SocketInferenceClient, server: subprocess.Popen, timeout: float):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if server.poll() is not None:
+            raise RuntimeError("Inference server exited during startup")
+        if client.status()["model_loaded"]:
+            return
+        time.sleep(0.2)
+    raise RuntimeError("Inference server did not load its model in time")
+
+def run(client, requests: int, concurrency: int):
+    # Returns (mean latency ms, stories per second, deltas received)
+    deltas = []
+    
+    def one(_):
+        started = time.perf_counter()
+        client.generate_story_sync(PARAMS, GenerationControl(settings.get_generation_timeout()), lambda row, text: deltas.append(text))
+        return time.perf_counter() - started
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    return sum(latencies) / len(latencies) * 1000, requests / elapsed, len(deltas)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark in-process vs socket inference')
+    parser.add_argument('--requests', type=int, default=20, help='Stories per transport')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent callers')
+    parser.add_argument('--port', type=int, default=9317, help='Local TCP port for the TCP run')
+    parser.add_argument('--startup-timeout', type=float, default=120.0, help='Seconds to wait for a server')
+    
+    args = parser.parse_args()
+    
+    print(f"{'transport':<12}{'callers':>8}{'mean ms':>12}{'stories/s':>12}{'deltas':>10}")
+    
+    local = LocalInferenceClient()
+    local.load_model()
+    # One warm-up story so every transport starts from a loaded, warm model
+    run(local, 1, 1)
+    mean_ms, rate, deltas = run(local, args.requests, 1)
+    print(f"{'in-process':<12}{1:>8}{mean_ms:>12.1f}{rate:>12.2f}{deltas:>10}")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, address in (("unix", f"unix:{tmp}/inference.sock"), ("tcp", f"tcp://127.0.0.1:{args.port}")):
+            server = start_server(address)
+            try:
+                client = SocketInferenceClient([address], max_idle=args.concurrency, timeout_margin=10.0, poll_interval=0.5)
+                wait_ready(client, server, args.startup_timeout)
+                run(client, 1, 1)
+                # One caller shows the transport overhead, several show the pooled connections
+                for callers in sorted({1, args.concurrency}):
+                    mean_ms, rate, deltas = run(client, args.requests, callers)
+                    print(f"{name:<12}{callers:>8}{mean_ms:>12.1f}{rate:>12.2f}{deltas:>10}")
+            finally:
+                server.terminate()
+                server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Repetition control benchmark
+Compares the stock repetition_penalty / no_repeat_ngram_size processors with
+the incremental ones used by LLMService, first in isolation on synthetic
+logits and then through model.generate, for 200, 500 and 1000 new tokens.
+Every step's scores and every generated sequence must match exactly.
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Application modules live in backend/app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+import torch
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor, NoRepeatNGramLogitsProcessor
+)
+
+from config.settings import settings
+from core.logits_processors import IncrementalRepetitionPenaltyLogitsProcessor, IncrementalNoRepeatNGramLogitsProcessor
+
+def stock_processors() -> LogitsProcessorList:
+    return LogitsProcessorList([
+        RepetitionPenaltyLogitsProcessor(settings.repetition_penalty),
+        NoRepeatNGramLogitsProcessor(settings.no_repeat_ngram_size)
+    ])
+
+def incremental_processors() -> LogitsProcessorList:
+    return LogitsProcessorList([
+        IncrementalRepetitionPenaltyLogitsProcessor(settings.repetition_penalty),
+        IncrementalNoRepeatNGramLogitsProcessor(settings.no_repeat_ngram_size)
+    ])
+
+def bench_processors(new_tokens: int, batch_size: int, prompt_length: int, vocab_size: int):
+    # Feed both processor lists the same growing sequence and compare every step
+    generator = torch.Generator().manual_seed(new_tokens)
+    # A small token range makes repeated n-grams (and bans) frequent
+    sequence = torch.randint(0, 200, (batch_size, prompt_length + new_tokens), generator=generator)
+    logits = torch.randn((new_tokens, batch_size, vocab_size), generator=generator)
+    
+    timings = {}
+    results = {}
+    for name, factory in (("stock", stock_processors), ("incremental", incremental_processors)):
+        processors = factory()
+        outputs = []
+        started = time.perf_counter()
+        for step in range(new_tokens):
+            outputs.append(processors(sequence[:, :prompt_length + step], logits[step]))
+        timings[name] = time.perf_counter() - started
+        results[name] = outputs
+    
+    for step, (expected, actual) in enumerate(zip(results["stock"], results["incremental"])):
+        if not torch.equal(expected, actual):
+            raise AssertionError(f"Scores differ at step {step} ({new_tokens} tokens)")
+    
+    return timings
+
+def bench_generate(model, tokenizer, new_tokens: int, batch_size: int, seed: int):
+    # Same seed on both sides: the sampled tokens must be identical
+    prompts = ["Once upon a time, a little fox"] * batch_size
+    inputs = tokenizer(prompts, return_tensors="pt")
+    common = dict(
+        **inputs,
+        max_new_tokens=new_tokens,
+        min_new_tokens=new_tokens,
+        do_sample=True,
+        temperature=settings.temperature,
+        top_p=settings.top_p,
+        top_k=settings.top_k,
+        pad_token_id=tokenizer.pad_token_id
+    )
+    
+    runs = {
+        "stock": dict(repetition_penalty=settings.repetition_penalty, no_repeat_ngram_size=settings.no_repeat_ngram_size),
+        "incremental": dict(logits_processor=incremental_processors())
+    }
+    timings = {}
+    outputs = {}
+    for name, extra in runs.items():
+        torch.manual_seed(seed)
+        started = time.perf_counter()
+        with torch.inference_mode():
+            outputs[name] = model.generate(**common, **extra)
+        timings[name] = time.perf_counter() - started
+    
+    if not torch.equal(outputs["stock"], outputs["incremental"]):
+        raise AssertionError(f"Generated sequences differ ({new_tokens} tokens)")
+    
+    return timings
+
+def report(label: str, new_tokens: int, timings: dict):
+    stock, incremental = timings["stock"], timings["incremental"]
+    print(f"{label:<12}{new_tokens:>8}{stock * 1000:>14.1f}{incremental * 1000:>16.1f}{stock / incremental:>10.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark repetition control logits processors')
+    parser.add_argument('--model', type=str, default=settings.get_model_path(), help='Model for the generate benchmark')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[200, 500, 1000], help='New tokens per run')
+    parser.add_argument('--batch-size', type=int, default=1, help='Sequences per run')
+    parser.add_argument('--prompt-length', type=int, default=60, help='Prompt tokens in the synthetic benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='Sampling seed')
+    parser.add_argument('--skip-generate', action='store_true', help='Only run the synthetic benchmark')
+    
+    args = parser.parse_args()
+    
+    print(f"{'benchmark':<12}{'tokens':>8}{'stock ms':>14}{'incremental ms':>16}{'speedup':>10}")
+    
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    for new_tokens in args.lengths:
+        timings = bench_processors(new_tokens, args.batch_size, args.prompt_length, len(tokenizer))
+        report("processors", new_tokens, timings)
+    
+    if args.skip_generate:
+        return
+    
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(args.model)
+    model.eval()
+    limit = model.config.max_position_embeddings
+    for new_tokens in args.lengths:
+        if new_tokens + 16 > limit:
+            print(f"Skipping generate with {new_tokens} tokens, the model's context is {limit}")
+            continue
+        timings = bench_generate(model, tokenizer, new_tokens, args.batch_size, args.seed)
+        report("generate", new_tokens, timings)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Session snapshot benchmark
+Writes a session log with many snapshots per session, a share of them from
+sessions older than SESSION_TIMEOUT_HOURS, then times what a restart does:
+the header scan that restores the index, loading sessions on first use, and
+compaction. Checks that exactly the unexpired sessions come back.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+# Application modules live in backend/app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from services.chat_service import ChatService, Session
+from services.session_store import SessionStore
+
+TURNS = ["hi", "6-10", "adventure", "short", "a little fox who learns to share", "Tom, Anna"]
+
+def sample_payloads() -> list:
+    # Snapshots of a real session after each questionnaire turn
+    service = ChatService()
+    session_id = None
+    payloads = []
+    for message in TURNS:
+        session_id = service.process_message(session_id, message, uuid.uuid4().hex).session_id
+        payloads.append(service.sessions[session_id].to_record())
+    return payloads
+
+def write_log(path: str, timeout_seconds: float, records: int, sessions: int, expired_share: float, batch: int) -> set:
+    # Returns the ids of the sessions that should be restored
+    payloads = sample_payloads()
+    now = time.time()
+    ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    created = {
+        session_id: now - timeout_seconds * (2 if random.random() < expired_share else random.random() * 0.9)
+        for session_id in ids
+    }
+    
+    store = SessionStore(path, timeout_seconds, fsync=False)
+    store.open()
+    pending = []
+    for number in range(records):
+        session_id = ids[number % sessions]
+        pending.append((session_id, created[session_id], payloads[min(number // sessions, len(payloads) - 1)]))
+        if len(pending) >= batch:
+            store.append(pending)
+            pending = []
+    store.append(pending)
+    store.close()
+    return {session_id for session_id, at in created.items() if at >= now - timeout_seconds}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark session log replay and compaction')
+    parser.add_argument('--records', type=int, default=2_000_000, help='Snapshot records in the log')
+    parser.add_argument('--sessions', type=int, default=400_000, help='Distinct sessions among them')
+    parser.add_argument('--expired', type=float, default=0.3, help='Share of sessions past the timeout')
+    parser.add_argument('--timeout-hours', type=float, default=24, help='Session timeout used for replay')
+    parser.add_argument('--sample', type=int, default=10_000, help='Sessions loaded after the replay')
+    parser.add_argument('--batch', type=int, default=10_000, help='Records per append while writing the log')
+    
+    args = parser.parse_args()
+    random.seed(0)
+    timeout_seconds = args.timeout_hours * 3600
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.log")
+        started = time.perf_counter()
+        expected = write_log(path, timeout_seconds, args.records, args.sessions, args.expired, args.batch)
+        print(f"wrote {args.records} records for {args.sessions} sessions "
+              f"({os.path.getsize(path) / 2**20:.0f} MiB) in {time.perf_counter() - started:.1f}s")
+        
+        store = SessionStore(path, timeout_seconds, fsync=False)
+        service = ChatService(store)
+        started = time.perf_counter()
+        restored = service.restore()
+        replay = time.perf_counter() - started
+        print(f"replay: {restored} sessions in {replay:.2f}s")
+        
+        errors = []
+        if restored != len(expected):
+            errors.append(f"restored {restored} sessions, expected {len(expected)}")
+        
+        sample = random.sample(sorted(expected), min(args.sample, len(expected)))
+        started = time.perf_counter()
+        for session_id in sample:
+            session = service.get_session(session_id)
+            if not isinstance(session, Session) or session.id != session_id:
+                errors.append(f"session {session_id} did not load")
+        loaded = time.perf_counter() - started
+        if sample:
+            print(f"first use: {len(sample)} sessions, {loaded / len(sample) * 1e6:.0f}us each")
+        
+        started = time.perf_counter()
+        before = os.path.getsize(path)
+        store.compact()
+        print(f"compaction: {before / 2**20:.0f} -> {os.path.getsize(path) / 2**20:.0f} MiB in {time.perf_counter() - started:.2f}s")
+        store.close()
+        
+        reopened = SessionStore(path, timeout_seconds, fsync=False)
+        started = time.perf_counter()
+        count = reopened.open()
+        print(f"replay after compaction: {count} sessions in {time.perf_counter() - started:.2f}s")
+        reopened.close()
+        if count != len(expected):
+            errors.append(f"{count} sessions after compaction, expected {len(expected)}")
+    
+    for error in errors[:20]:
+        print(f"FAIL: {error}")
+    print("OK" if not errors else f"{len(errors)} failures")
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Story post-processing benchmark
+Feeds generated-looking text to StoryTextProcessor in token-sized deltas and
+checks the result against the previous whole-string post-processing and
+validation, then compares the time spent after decoding has finished
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+# Application modules live in backend/app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from core.story_text import StoryTextProcessor
+from utils.validators import count_sentences, is_safe_content, validate_story_output
+
+# Previous implementation, kept for comparison
+def legacy_post_process_story(text: str) -> str:
+    if not text:
+        return ""
+    if text and not text[-1] in ['.', '!', '?']:
+        last_punct = max(text.rfind('.'), text.rfind('!'), text.rfind('?'))
+        if last_punct > 0:
+            text = text[:last_punct + 1]
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    text = '\n\n'.join(lines)
+    text = re.sub(r'([.!?])([A-Z])', r'\1 \2', text)
+    return text.strip()
+
+FRAGMENTS = [
+    " Once", " upon", " a", " time", ",", " there", " was", " a", " fox", ".", "The", " end", "!",
+    "\n", "\n\n", " ", "  ", "\t", "?", "...", " Ay", "şe", " İ", "pek", " ki", "ll", " hel", "lo",
+    " sky", "Blue", ".", "A", " war", "m", " day", " \n ", "!?", " kn", "ife", " smile"
+]
+
+# Long runs without marks or line breaks fill the processor's pending deltas
+PLAIN_FRAGMENTS = [fragment for fragment in FRAGMENTS if not any(char in fragment for char in ".!?\n")]
+
+def random_story(rng: random.Random, tokens: int, fragments: list = FRAGMENTS) -> list:
+    return [rng.choice(fragments) for _ in range(tokens)]
+
+def incremental(deltas: list):
+    processor = StoryTextProcessor()
+    for delta in deltas:
+        processor.feed(delta)
+    return processor.finish()
+
+def check_equivalence(samples: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(samples):
+        deltas = random_story(rng, rng.randint(0, 120))
+        if rng.random() < 0.2:
+            at = rng.randint(0, len(deltas))
+            deltas[at:at] = random_story(rng, rng.randint(60, 200), PLAIN_FRAGMENTS)
+        result = incremental(deltas)
+        
+        expected = legacy_post_process_story("".join(deltas).strip())
+        assert result.text == expected, (deltas, result.text, expected)
+        assert result.sentences == count_sentences(expected), deltas
+        assert result.blocked == (not is_safe_content(expected)), deltas
+    print(f"Equivalence checks passed ({samples} samples)")
+
+def bench(tokens: int, repeat: int, seed: int):
+    rng = random.Random(seed)
+    stories = [random_story(rng, tokens) for _ in range(repeat)]
+    
+    # Old path: decode everything, then post-process and validate
+    started = time.perf_counter()
+    for deltas in stories:
+        validate_story_output(legacy_post_process_story("".join(deltas).strip()), 0, 10 ** 9)
+    legacy_ms = (time.perf_counter() - started) / repeat * 1000
+    
+    # New path: the per-token work overlaps decoding, only finish() is left at the end
+    processors = []
+    started = time.perf_counter()
+    for deltas in stories:
+        processor = StoryTextProcessor()
+        for delta in deltas:
+            processor.feed(delta)
+        processors.append(processor)
+    feed_ms = (time.perf_counter() - started) / repeat * 1000
+    
+    started = time.perf_counter()
+    for processor in processors:
+        processor.finish()
+    finish_ms = (time.perf_counter() - started) / repeat * 1000
+    
+    print(f"{tokens:>8}{legacy_ms:>14.3f}{feed_ms:>14.3f}{feed_ms / tokens * 1000:>14.2f}{finish_ms:>14.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark incremental story post-processing')
+    parser.add_argument('--samples', type=int, default=5000, help='Random stories for the equivalence check')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[200, 500, 1000], help='Tokens per story')
+    parser.add_argument('--repeat', type=int, default=200, help='Stories per timing')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    
+    args = parser.parse_args()
+    
+    check_equivalence(args.samples, args.seed)
+    print(f"{'tokens':>8}{'legacy ms':>14}{'feed ms':>14}{'us/token':>14}{'finish ms':>14}")
+    for tokens in args.lengths:
+        bench(tokens, args.repeat, args.seed)
+
+if __name__ == "__main__":
+    main()
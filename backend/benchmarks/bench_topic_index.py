@@ -0,0 +1,94 @@
+"""
+Topic index benchmark
+Fills the near-duplicate topic index with synthetic topics spread over every
+age group / genre / length combination (or one combination with
+--single-bucket, the worst case for a lookup), then looks up rephrased
+versions of stored topics, which should hit, and unseen topics, which should
+not. Reports insert rate, lookup latency, hit and false-hit rates and the
+memory the vectors take.
+"""
+
+import argparse
+import random
+import string
+import sys
+import time
+from itertools import product
+from pathlib import Path
+
+# Application modules live in backend/app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from models.schemas import StoryParams
+from services.topic_index import TopicIndex
+from utils.validators import VALID_AGE_GROUPS, VALID_GENRES, VALID_LENGTHS
+
+def make_vocabulary(size: int, rng: random.Random) -> list:
+    # Made-up words that none of the stemming suffixes apply to
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 8))) + rng.choice("klmnprt"))
+    return sorted(words)
+
+def rephrase(topic: str, rng: random.Random) -> str:
+    # Same content words in another order, with filler words and a plural
+    words = topic.split()
+    rng.shuffle(words)
+    words[0] += "s"
+    return "a " + " and the ".join(words)
+
+def percentile(values: list, share: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * share))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the near-duplicate topic index')
+    parser.add_argument('--entries', type=int, default=1_000_000, help='Stories in the index')
+    parser.add_argument('--queries', type=int, default=2000, help='Lookups of each kind')
+    parser.add_argument('--dims', type=int, default=256, help='Hashed vector size')
+    parser.add_argument('--threshold', type=float, default=0.81, help='Similarity threshold')
+    parser.add_argument('--vocabulary', type=int, default=50_000, help='Distinct topic words')
+    parser.add_argument('--single-bucket', action='store_true', help='Put every entry under one age/genre/length')
+    
+    args = parser.parse_args()
+    rng = random.Random(0)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    combinations = [("6-10", "adventure", "short")] if args.single_bucket else list(product(
+        sorted(VALID_AGE_GROUPS), sorted(VALID_GENRES), sorted(VALID_LENGTHS)
+    ))
+    bucket_size = -(-args.entries // len(combinations))
+    index = TopicIndex(args.dims, bucket_size, args.threshold)
+    
+    def params(topic: str, combination: tuple, characters=None) -> StoryParams:
+        return StoryParams(topic=topic, age_group=combination[0], genre=combination[1], length=combination[2], characters=characters)
+    
+    stored = []
+    started = time.perf_counter()
+    for number in range(args.entries):
+        combination = combinations[number % len(combinations)]
+        topic = " ".join(rng.sample(vocabulary, rng.randint(3, 6)))
+        index.add(params(topic, combination, ["Tom"]), f"Tom's story number {number}.")
+        if len(stored) < args.queries or rng.random() < args.queries / args.entries:
+            stored.append((topic, combination))
+    elapsed = time.perf_counter() - started
+    vector_bytes = sum(bucket.vectors.nbytes for bucket in index._buckets.values())
+    print(f"{len(index)} entries in {len(combinations)} buckets, {args.entries / elapsed:.0f} inserts/s, "
+          f"vectors {vector_bytes / 2**20:.0f} MiB")
+    
+    for kind in ("rephrased", "unseen"):
+        latencies = []
+        hits = 0
+        for topic, combination in rng.sample(stored, min(args.queries, len(stored))):
+            if kind == "rephrased":
+                query = rephrase(topic, rng)
+            else:
+                query = " ".join(rng.sample(vocabulary, rng.randint(3, 6)))
+            started = time.perf_counter()
+            story = index.lookup(params(query, combination, ["Anna"]))
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += story is not None and story.startswith("Anna")
+        
+        print(f"{kind:<10} hit rate {hits / len(latencies):6.1%}   lookup p50 {percentile(latencies, 0.5):.3f} ms, "
+              f"p99 {percentile(latencies, 0.99):.3f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Validator micro-benchmarks
+Times sanitize_input and the validators on typical and adversarial inputs,
+compares them with the previous multi-pass implementation and checks that
+run time grows linearly with input size (no catastrophic backtracking)
+"""
+
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+# Application modules live in backend/app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from utils.validators import (
+    INAPPROPRIATE_WORDS, analyze_text, sanitize_input, validate_prompt, validate_story_output, count_sentences
+)
+
+# Previous implementation, kept for comparison
+def legacy_sanitize_input(text: str) -> str:
+    if not text:
+        return ""
+    text = re.sub(r'\s+', ' ', text.strip())
+    text = re.sub(r'<[^>]+>', '', text)
+    text = re.sub(r'[^\w\s\.,!?;:\-\'\"çğıöşüÇĞIİÖŞÜ]', '', text)
+    text = re.sub(r'([.!?]){3,}', r'\1\1\1', text)
+    return text.strip()
+
+def legacy_validate_story_output(story: str) -> bool:
+    cleaned = story.strip()
+    lower = cleaned.lower()
+    if any(word in lower for word in INAPPROPRIATE_WORDS):
+        return False
+    sentences = re.split(r'[.!?]+', cleaned)
+    return len([s for s in sentences if len(s.strip()) > 5]) >= 3
+
+STORY = (
+    "Once upon a time, a little fox named Pamuk lived near a quiet river. "
+    "Every morning she visited her friend Ayşe the turtle! "
+    "Together they counted the stars, shared berries and laughed at the clouds. "
+    "One day they found a map... What could it lead to? "
+)
+
+TYPICAL = {
+    "topic": "a brave little fox who learns to share",
+    "topic_turkish": "Küçük bir tavşanın ormandaki macerası",
+    "story": STORY * 4
+}
+
+def adversarial(size: int) -> dict:
+    return {
+        "long_text": ("word " * (size // 5))[:size],
+        "punctuation": ("!?." * size)[:size],
+        "spaced_punctuation": ("! " * size)[:size],
+        "open_tags": "<" * size,
+        "unclosed_tag": "<" + "a" * size,
+        "whitespace": (" \t\n" * size)[:size],
+        "special_chars": ("@#$%" * size)[:size],
+        "mixed": ("a.<b>!!?? \t#" * size)[:size]
+    }
+
+def timeit(fn, text: str, repeat: int) -> float:
+    # Best of three, microseconds per call
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn(text)
+        best = min(best, time.perf_counter() - started)
+    return best / repeat * 1e6
+
+def run_comparison(repeat: int):
+    print(f"{'input':<22}{'function':<24}{'legacy us':>12}{'new us':>12}{'speedup':>10}")
+    cases = dict(TYPICAL, **adversarial(2000))
+    pairs = [
+        ("sanitize_input", legacy_sanitize_input, sanitize_input),
+        ("validate_story_output", legacy_validate_story_output, validate_story_output)
+    ]
+    for name, text in cases.items():
+        for fn_name, legacy, new in pairs:
+            old_us = timeit(legacy, text, repeat)
+            new_us = timeit(new, text, repeat)
+            print(f"{name:<22}{fn_name:<24}{old_us:>12.1f}{new_us:>12.1f}{old_us / new_us:>9.2f}x")
+
+def check_equivalence():
+    # Outputs that must not change for ordinary input
+    for text in list(TYPICAL.values()) + list(adversarial(2000).values()):
+        assert sanitize_input(text) == legacy_sanitize_input(text), text[:40]
+    assert count_sentences(STORY) == len([s for s in re.split(r'[.!?]+', STORY) if len(s.strip()) > 5])
+    assert validate_prompt(TYPICAL["topic"]) == (True, "")
+    assert not validate_prompt("a story about a scary monster")[0]
+    print("Equivalence checks passed")
+
+def check_linear(max_ratio: float):
+    # Doubling the input should roughly double the time. The validators reject
+    # oversized input up front, so only the unbounded scans are checked
+    failures = []
+    small, large = adversarial(50000), adversarial(100000)
+    functions = [sanitize_input, analyze_text, count_sentences]
+    for name in small:
+        for fn in functions:
+            ratio = timeit(fn, large[name], 5) / max(timeit(fn, small[name], 5), 1e-3)
+            if ratio > max_ratio:
+                failures.append(f"{fn.__name__} on {name}: x{ratio:.1f}")
+    
+    if failures:
+        print("Super-linear scaling detected:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"Linear scaling checks passed (max ratio {max_ratio})")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark input validators')
+    parser.add_argument('--repeat', type=int, default=200, help='Calls per timing')
+    parser.add_argument('--max-ratio', type=float, default=3.0, help='Allowed time ratio when input size doubles')
+    
+    args = parser.parse_args()
+    
+    check_equivalence()
+    run_comparison(args.repeat)
+    check_linear(args.max_ratio)
+
+if __name__ == "__main__":
+    main()
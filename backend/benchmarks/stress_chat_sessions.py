@@ -0,0 +1,169 @@
+"""
+Chat session stress test
+Hammers a single chat session from many asyncio tasks, each running its turns
+on the thread pool, while other threads claim generations, attach stories and
+run cleanup. Checks that no turn is lost or interleaved, every retried
+client_message_id gets its original reply, and every state change is allowed.
+--no-locks swaps the session locks for no-ops to show the races it catches.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Application modules live in backend/app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from services.chat_service import ChatService, InvalidTransition, TRANSITIONS
+
+# A valid answer for every questionnaire state
+ANSWERS = {
+    "greeting": "hi",
+    "age": "6-10",
+    "genre": "adventure",
+    "length": "short",
+    "topic": "a cat who learns to fly high",
+    "characters": "no",
+    "generating": "are you there?",
+    "done": "new story"
+}
+
+class NoLock:
+    # Stand-in for the session locks in --no-locks mode
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+def record_transitions(service: ChatService, transitions: list):
+    # Log every state change, allowed or not
+    set_state = service._set_state
+    
+    def recording(session, state):
+        transitions.append((session.state, state))
+        set_state(session, state)
+    
+    service._set_state = recording
+
+async def client(service: ChatService, session_id: str, index: int, turns: int, retry_rate: float, sent: dict, errors: list):
+    rng = random.Random(index)
+    for turn in range(turns):
+        session = service.sessions[session_id]
+        message_id = f"{index}-{turn}"
+        message = ANSWERS.get(session.state, "hi")
+        try:
+            result = await asyncio.to_thread(service.process_message, session_id, message, message_id)
+            sent[message_id] = result.response
+            if result.session_id != session_id:
+                errors.append(f"{message_id}: session replaced")
+            
+            if rng.random() < retry_rate:
+                # The client did not see the reply and sends the same turn again
+                retry = await asyncio.to_thread(service.process_message, session_id, message, message_id)
+                if not retry.duplicate or retry.response != result.response:
+                    errors.append(f"{message_id}: retry was processed again")
+            
+            if result.is_complete and not result.duplicate:
+                owner = f"gen-{message_id}"
+                if await asyncio.to_thread(service.claim_generation, session_id, owner):
+                    if rng.random() < 0.2:
+                        await asyncio.to_thread(service.release_generation, session_id, owner)
+                    else:
+                        await asyncio.to_thread(service.set_story, session_id, f"story {message_id}")
+        except InvalidTransition as e:
+            errors.append(f"{message_id}: invalid transition {e}")
+        except Exception as e:
+            errors.append(f"{message_id}: {type(e).__name__}: {e}")
+
+def cleanup_loop(service: ChatService, stop: threading.Event, errors: list):
+    # Expired sessions are removed while turns run; the stressed one never expires
+    while not stop.is_set():
+        try:
+            expired = service.create_session()
+            expired.created_at -= service._cleanup_interval * 2
+            service.cleanup_old_sessions()
+            service.get_session(expired.id)
+        except Exception as e:
+            errors.append(f"cleanup: {type(e).__name__}: {e}")
+
+def check_session(service: ChatService, session_id: str, sent: dict, transitions: list, errors: list):
+    session = service.sessions[session_id]
+    messages = session.messages
+    
+    # Turns never interleave: user and assistant messages strictly alternate
+    for position, message in enumerate(messages):
+        expected = "user" if position % 2 == 0 else "assistant"
+        if message["role"] != expected:
+            errors.append(f"message {position} is from {message['role']}, expected {expected}")
+            break
+    
+    # Every distinct client_message_id was processed exactly once (plus the opening turn)
+    processed = len(messages) // 2
+    if processed != len(sent) + 1:
+        errors.append(f"{processed} turns recorded for {len(sent) + 1} distinct messages")
+    
+    for old, new in transitions:
+        if new not in TRANSITIONS.get(old, ()):
+            errors.append(f"disallowed transition {old} -> {new}")
+            break
+
+async def run(args) -> list:
+    service = ChatService()
+    if args.no_locks:
+        service._stripes = [NoLock() for _ in service._stripes]
+        service._registry_lock = NoLock()
+    
+    transitions = []
+    record_transitions(service, transitions)
+    session_id = service.process_message(None, "hi").session_id
+    
+    sent = {}
+    errors = []
+    stop = threading.Event()
+    cleaners = [threading.Thread(target=cleanup_loop, args=(service, stop, errors)) for _ in range(args.cleanup_threads)]
+    for thread in cleaners:
+        thread.start()
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(service, session_id, index, args.turns, args.retry_rate, sent, errors)
+        for index in range(args.tasks)
+    ))
+    elapsed = time.perf_counter() - started
+    
+    stop.set()
+    for thread in cleaners:
+        thread.join()
+    
+    check_session(service, session_id, sent, transitions, errors)
+    print(f"{len(sent)} turns from {args.tasks} tasks in {elapsed:.2f}s, {len(transitions)} state changes, "
+          f"{len(service.sessions[session_id].messages)} messages")
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress one chat session from many concurrent tasks')
+    parser.add_argument('--tasks', type=int, default=32, help='Concurrent client tasks (retries are only recognised within the last MAX_REPLAYED_TURNS turns)')
+    parser.add_argument('--turns', type=int, default=200, help='Turns per task')
+    parser.add_argument('--retry-rate', type=float, default=0.2, help='Fraction of turns sent twice')
+    parser.add_argument('--cleanup-threads', type=int, default=2, help='Threads running session cleanup')
+    parser.add_argument('--switch-interval', type=float, default=1e-6, help='Thread switch interval, small values force interleaving')
+    parser.add_argument('--no-locks', action='store_true', help='Disable the session locks')
+    
+    args = parser.parse_args()
+    sys.setswitchinterval(args.switch_interval)
+    
+    errors = asyncio.run(run(args))
+    for error in errors[:20]:
+        print(f"FAIL: {error}")
+    if len(errors) > 20:
+        print(f"... {len(errors) - 20} more")
+    print("OK" if not errors else f"{len(errors)} failures")
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()
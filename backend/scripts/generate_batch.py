@@ -0,0 +1,108 @@
+"""
+Batch story generation script
+Reads story parameters as JSONL and writes generated stories as JSONL
+Re-running with the same output file resumes where the last run stopped
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# Application modules live in backend/app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from config.settings import settings
+from services.batch_service import parse_batch_line, format_result, chunk_items, GENERATION_FAILED
+from services.generation_control import GenerationControl
+from services.llm_service import llm_service
+
+def load_done_ids(output_path: Path) -> set:
+    # Ids already written by a previous run; drops a trailing partial line. Stories that
+    # failed to generate (params and an error) are not done and are retried
+    done = set()
+    if not output_path.exists():
+        return done
+    
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+    
+    for line in data[:end].decode('utf-8').splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "id" in record and not ("params" in record and "error" in record):
+            done.add(record["id"])
+    return done
+
+def generate_batch(input_file: str, output_file: str, batch_size: int):
+    output_path = Path(output_file)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    done = load_done_ids(output_path)
+    
+    print(f"Loading requests from {input_file}...")
+    valid, invalid = [], []
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = parse_batch_line(line, str(line_number))
+            if item[0] in done:
+                continue
+            (invalid if item[2] else valid).append(item)
+    
+    print(f"Already done: {len(done)}, to generate: {len(valid)}, invalid: {len(invalid)}")
+    
+    llm_service.load_model()
+    started = time.time()
+    generated = 0
+    failed = 0
+    
+    with open(output_path, 'a', encoding='utf-8', buffering=1024 * 1024) as out:
+        out.writelines(format_result(item_id, error=error) for item_id, _, error in invalid)
+        
+        for chunk in chunk_items(valid, batch_size):
+            params_list = [params for _, params, _ in chunk]
+            control = GenerationControl(settings.get_generation_timeout())
+            stories = llm_service.generate_stories_sync(params_list, control)
+            
+            # One write and flush per batch, so a crash loses at most one batch
+            out.writelines(
+                format_result(item_id, params, error=GENERATION_FAILED) if row in control.rejected
+                else format_result(item_id, params, story=story)
+                for row, ((item_id, params, _), story) in enumerate(zip(chunk, stories))
+            )
+            failed += len(control.rejected)
+            out.flush()
+            os.fsync(out.fileno())
+            
+            generated += len(chunk)
+            elapsed = time.time() - started
+            print(f"Generated {generated}/{len(valid)} ({generated / elapsed:.2f} stories/s), failed {failed}")
+    
+    print(f"\nBatch generation complete! Output: {output_path}")
+    if failed:
+        print(f"{failed} stories failed, run again with the same output file to retry them")
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate stories in bulk')
+    parser.add_argument('--input', type=str, required=True, help='JSONL file with story parameters')
+    parser.add_argument('--output', type=str, required=True, help='JSONL file for generated stories')
+    parser.add_argument('--batch-size', type=int, default=settings.batch_size, help='Stories per model batch')
+    
+    args = parser.parse_args()
+    
+    generate_batch(
+        input_file=args.input,
+        output_file=args.output,
+        batch_size=args.batch_size
+    )
+
+if __name__ == "__main__":
+    main()
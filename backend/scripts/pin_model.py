@@ -0,0 +1,66 @@
+"""
+Model pinning script
+Downloads (or reads from a local directory) a model and its fast tokenizer,
+saves them as safetensors / tokenizer.json and pins the files into the
+content-addressed model store, so the API can load them offline
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Application modules live in backend/app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from config.settings import settings
+from services.model_store import ModelStore, ModelStoreError
+
+def pin_model(store: ModelStore, model: str, name: str, revision: str) -> dict:
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        # Saving the fast tokenizer writes tokenizer.json, so loading never has to convert a slow one
+        tokenizer = AutoTokenizer.from_pretrained(model, revision=revision, use_fast=True)
+        if not tokenizer.is_fast:
+            print(f"Warning: {model} has no fast tokenizer, pinning the slow one")
+        tokenizer.save_pretrained(tmp)
+        
+        model_obj = AutoModelForCausalLM.from_pretrained(model, revision=revision)
+        model_obj.save_pretrained(tmp, safe_serialization=True)
+        
+        source = f"{model}@{revision}" if revision else model
+        return store.pin(name, tmp, source=source)
+
+def main():
+    parser = argparse.ArgumentParser(description='Pin a model into the local model store')
+    parser.add_argument('--model', type=str, default=settings.get_model_path(), help='Hub id or local model directory')
+    parser.add_argument('--name', type=str, default=None, help='Name to pin under (defaults to --model, which is what the API looks up)')
+    parser.add_argument('--revision', type=str, default=None, help='Hub revision (branch, tag or commit)')
+    parser.add_argument('--store', type=str, default=settings.model_store_path, help='Model store directory')
+    parser.add_argument('--verify', action='store_true', help='Only verify the checksums of an already pinned model')
+    
+    args = parser.parse_args()
+    store = ModelStore(args.store)
+    name = args.name or args.model
+    
+    started = time.time()
+    try:
+        if args.verify:
+            manifest = store.verify(name)
+            print(f"Verified {len(manifest['files'])} files of {name} in {time.time() - started:.1f}s")
+            return
+        
+        manifest = pin_model(store, args.model, name, args.revision)
+    except ModelStoreError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    
+    print(json.dumps(manifest, indent=2))
+    print(f"Pinned {name} into {os.path.abspath(args.store)} in {time.time() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()